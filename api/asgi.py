@@ -0,0 +1,234 @@
+"""ASGI serving mode.
+
+``POST /api/generate-meal-plan`` (synchronous mode) is handled natively on
+the event loop, so a worker holds many in-flight generations while it waits
+on OpenAI instead of one per thread. Every other route, including job mode
+and the SSE stream, goes to the Flask app through a small WSGI bridge that
+runs it in the loop's thread pool.
+
+Run with: gunicorn asgi:app -k uvicorn.workers.UvicornWorker --workers 2
+(the Procfile does). The LLM limits default higher than under the threaded
+server, sized for the async client's pool of 100 connections:
+LLM_MAX_CONCURRENCY=100 in-flight completions shared by all workers, and
+LLM_MAX_QUEUE=400 calls waiting per worker, a few LLM calls for each of a
+hundred or so queued generations. With more workers, raise
+LLM_MAX_CONCURRENCY towards 100 per worker as far as OPENAI_RPM and
+OPENAI_TPM allow; ASGI_LLM_MAX_CONCURRENCY and ASGI_LLM_MAX_QUEUE set them
+for this mode only.
+"""
+import asyncio
+import contextvars
+import io
+import json
+import logging
+import os
+import sys
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+# Before the service module reads them; explicit LLM_MAX_* settings still win
+os.environ.setdefault('LLM_MAX_CONCURRENCY', os.getenv('ASGI_LLM_MAX_CONCURRENCY', '100'))
+os.environ.setdefault('LLM_MAX_QUEUE', os.getenv('ASGI_LLM_MAX_QUEUE', '400'))
+
+from api import generate_meal_plan as service  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+GENERATE_PATH = '/api/generate-meal-plan'
+# Bridged Flask requests and blocking helpers (SQLite, rendering) share this pool
+THREADS = int(os.getenv('ASGI_THREADS', 64))
+CORS_HEADERS = [(b'access-control-allow-origin', b'*')]
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def send_json(send, status, payload, headers=()):
+    body = json.dumps(payload).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+                   + CORS_HEADERS + list(headers),
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class WSGIBridge:
+    """Serve a WSGI app from ASGI, one pool thread at a time.
+
+    Each request gets its own context, reused for every call into the app,
+    so context variables set by Flask persist across the chunks of a
+    streamed response. Iteration stops when the client disconnects.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    @staticmethod
+    def environ(scope, body):
+        server_name, server_port = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server_name,
+            'SERVER_PORT': str(server_port),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', ()):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+                environ[name] = value
+            else:
+                key = f'HTTP_{name}'
+                environ[key] = f'{environ[key]},{value}' if key in environ else value
+        return environ
+
+    async def __call__(self, scope, receive, send):
+        body = await read_body(receive)
+        if body is None:
+            return
+        context = contextvars.copy_context()
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                   for name, value in headers]
+
+        def call(func, *args):
+            return asyncio.to_thread(context.run, func, *args)
+
+        disconnected = asyncio.ensure_future(receive())
+        iterable = await call(self.wsgi_app, self.environ(scope, body), start_response)
+        try:
+            iterator = iter(iterable)
+            chunk = await call(next, iterator, None)
+            await send({'type': 'http.response.start', 'status': response['status'],
+                        'headers': response['headers']})
+            while chunk is not None and not disconnected.done():
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await call(next, iterator, None)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnected.cancel()
+            if hasattr(iterable, 'close'):
+                # Runs Flask's teardown and, for an abandoned stream, closes the upstream completion
+                await call(iterable.close)
+
+
+async def generate_meal_plan(scope, receive, send):
+    """Async twin of the Flask ``generate_meal_plan`` route (synchronous mode only)"""
+    started = time.perf_counter()
+    headers = dict(scope.get('headers', ()))
+    trace_id = headers.get(b'x-trace-id', b'').decode('latin-1').lower()
+    status = 500
+    with service.tracer.trace(f"POST {GENERATE_PATH}",
+                              trace_id=trace_id if service.TRACE_ID.fullmatch(trace_id) else None,
+                              sampled=True if headers.get(b'x-trace-sampled') == b'1' else None) as span:
+        trace_header = [(b'x-trace-id', span.trace_id.encode('latin-1'))]
+        try:
+            body = await read_body(receive)
+            if body is None:
+                return
+            data = json.loads(body or b'null')
+            if not isinstance(data, dict):
+                status = 400
+                await send_json(send, status, {"success": False, "error": "Request body must be a JSON object"},
+                                trace_header)
+                return
+            user_profile = data.get('userProfile', {})
+            user_email = data.get('email')
+            service.trace_request(user_profile, body_bytes=len(body))
+
+            validation_error = service.validate_meal_plan_request(user_profile, user_email)
+            if validation_error:
+                status = 400
+                await send_json(send, status, {"success": False, "error": validation_error}, trace_header)
+                return
+
+            plan_id = uuid.uuid4().hex
+            if not service.llm_scheduler().overloaded():
+                plan, error, unresolved = await service.adeliver_meal_plan(user_profile, user_email,
+                                                                            plan_id=plan_id)
+            else:
+                plan, error, unresolved = None, service.BUSY_ERROR, []
+            if error == service.BUSY_ERROR:
+                service.metrics().inc('eatreal_errors_total', component='scheduler')
+                status = 503
+                await send_json(send, status, {"success": False, "error": error[len('Error: '):]},
+                                trace_header + [(b'retry-after', b'1')])
+            elif error:
+                await send_json(send, status, {"success": False, "error": error,
+                                               **service.plan_reference(plan, plan_id),
+                                               **service.unresolved_reference(unresolved)}, trace_header)
+            else:
+                status = 200
+                await send_json(send, status, {"success": True, "plan": plan.to_dict(),
+                                               **service.plan_reference(plan, plan_id),
+                                               **service.unresolved_reference(unresolved)}, trace_header)
+        except Exception as e:
+            logger.error(f"Error in generate_meal_plan: {str(e)}")
+            logger.error(f"Error traceback: {traceback.format_exc()}")
+            status = 500
+            await send_json(send, status, {"success": False, "error": str(e)}, trace_header)
+        finally:
+            span.set(status=status)
+            service.metrics().observe('eatreal_http_request_duration_seconds', time.perf_counter() - started,
+                                      route=GENERATE_PATH, status=str(status))
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix='asgi'))
+            service.start_background_workers()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await service.llm_backend.aclose()
+            service.metrics().flush()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+bridge = WSGIBridge(service.app)
+
+
+def job_mode(scope):
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    return query.get('async', [''])[0].lower() in ('1', 'true', 'yes')
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        raise RuntimeError(f"Unsupported ASGI scope type {scope['type']}")
+    if scope['method'] == 'POST' and scope['path'] == GENERATE_PATH and not job_mode(scope):
+        return await generate_meal_plan(scope, receive, send)
+    return await bridge(scope, receive, send)
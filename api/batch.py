@@ -0,0 +1,199 @@
+"""Generate meal plans for a JSONL file of profiles.
+
+Each input line is either a questionnaire profile or an object with a
+``userProfile`` and an optional ``id``. Identical profiles (after
+normalization) are generated once. Results are appended to
+``<output>/results.jsonl`` as they finish, one record per unique profile
+listing the ids that share it, with the rendered plan in
+``<output>/html/<profile key>.html``. The results file doubles as the
+checkpoint: rerunning with the same output directory skips profiles that
+already succeeded and retries the ones that failed.
+
+Batch calls run at batch priority, so they yield to interactive requests
+sharing the same DATA_DIR rate limits.
+
+Usage: python -m api.batch profiles.jsonl --output out/ [--workers 4] [--no-html] [--restart]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from api.cache import profile_key
+
+logger = logging.getLogger(__name__)
+
+RESULTS_FILE = "results.jsonl"
+
+
+def read_profiles(path):
+    """Unique profiles in first-seen order: [(key, profile, [ids])]"""
+    by_key = {}
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{number}: invalid JSON ({str(e)})")
+            profile = item.get("userProfile", item) if isinstance(item, dict) else None
+            if not isinstance(profile, dict):
+                raise ValueError(f"{path}:{number}: expected a profile object")
+            item_id = item.get("id", number) if "userProfile" in item else number
+            key = profile_key(profile)
+            if key in by_key:
+                by_key[key][2].append(item_id)
+            else:
+                by_key[key] = (key, profile, [item_id])
+    return list(by_key.values())
+
+
+def load_checkpoint(results_path):
+    """Profile keys that already succeeded; drops a partly written last record"""
+    if not os.path.exists(results_path):
+        return set()
+    with open(results_path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            # Interrupted mid-write; the record is incomplete and gets regenerated
+            f.truncate(end)
+    done = set()
+    for line in data[:end].splitlines():
+        record = json.loads(line)
+        if record.get("status") == "ok":
+            done.add(record["profile_key"])
+        else:
+            done.discard(record["profile_key"])
+    return done
+
+
+def write_atomic(path, text):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def generate(key, profile, ids, html_dir):
+    """Run the pipeline for one profile and return its result record"""
+    # Imported here so --help and input errors don't pay for building the app
+    from api import email_template
+    from api.generate_meal_plan import compliance_error, generate_plan, metrics, review_plan, tracer
+    from api.pipeline import StageError
+    from api.renderers import html_sections
+    from api.scheduler import BATCH, priority_scope
+
+    start = time.perf_counter()
+    record = {"profile_key": key, "ids": ids}
+    try:
+        with tracer.trace('batch meal_plan'), priority_scope(BATCH):
+            plan = generate_plan(profile)
+            changed, unresolved, shed = review_plan(plan, profile)
+        error = compliance_error(unresolved, shed)
+        if unresolved:
+            record["unresolved"] = [violation.to_dict() for violation in unresolved]
+        if error:
+            # Not rendered, like a plan that couldn't be delivered; the next run retries it
+            record.update(status="failed", stage="compliance", error=error)
+        else:
+            record.update(status="ok", plan=plan.to_dict())
+            if changed:
+                record["regenerated_days"] = sorted(changed)
+            if html_dir:
+                html_path = os.path.join(html_dir, f"{key}.html")
+                write_atomic(html_path, email_template.render_html(profile, html_sections(plan)))
+                record["html"] = os.path.relpath(html_path, os.path.dirname(html_dir))
+    except StageError as e:
+        metrics().inc('eatreal_errors_total', component=e.stage)
+        record.update(status="failed", stage=e.stage, error=e.message)
+    except Exception as e:
+        # One bad profile (a parse bug, a full disk) mustn't stop the run; it's recorded and retried next run
+        logger.error(f"Profile {key[:12]} failed: {str(e)}")
+        metrics().inc('eatreal_errors_total', component='batch')
+        record = {"profile_key": key, "ids": ids, "status": "failed", "error": str(e)}
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def run(input_path, output_dir, workers=4, html=True, restart=False):
+    """Generate every pending profile; returns a summary dict"""
+    profiles = read_profiles(input_path)
+    os.makedirs(output_dir, exist_ok=True)
+    html_dir = os.path.join(output_dir, "html") if html else None
+    if html_dir:
+        os.makedirs(html_dir, exist_ok=True)
+    results_path = os.path.join(output_dir, RESULTS_FILE)
+    # Load the app's configuration once, so a bad environment fails before any work starts
+    import api.generate_meal_plan  # noqa: F401
+    if restart and os.path.exists(results_path):
+        os.remove(results_path)
+    done = load_checkpoint(results_path)
+    pending = [item for item in profiles if item[0] not in done]
+    summary = {"profiles": sum(len(ids) for _, _, ids in profiles), "unique": len(profiles),
+               "skipped": len(profiles) - len(pending), "succeeded": 0, "failed": 0}
+    logger.info(f"{summary['unique']} unique profiles, {summary['skipped']} already done, {len(pending)} to generate")
+
+    start = time.perf_counter()
+    items = iter(pending)
+    running = set()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch")
+    with open(results_path, "a", encoding="utf-8") as results:
+        try:
+            while True:
+                # Keep the pool busy without queueing the whole input up front
+                while len(running) < workers * 2:
+                    item = next(items, None)
+                    if item is None:
+                        break
+                    running.add(executor.submit(generate, *item, html_dir))
+                if not running:
+                    break
+                finished, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record = future.result()
+                    results.write(json.dumps(record) + "\n")
+                    results.flush()
+                    os.fsync(results.fileno())
+                    summary["succeeded" if record["status"] == "ok" else "failed"] += 1
+                    completed = summary["succeeded"] + summary["failed"]
+                    logger.info(f"[{completed}/{len(pending)}] {record['profile_key'][:12]} {record['status']} "
+                                f"in {record['seconds']:.1f}s")
+        except KeyboardInterrupt:
+            logger.warning("Interrupted; finished profiles are saved, rerun to resume")
+            raise
+        finally:
+            # Don't wait for in-flight profiles on interrupt; they aren't recorded and will be redone
+            executor.shutdown(wait=False, cancel_futures=True)
+    summary["elapsed_s"] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="JSONL file of profiles")
+    parser.add_argument("--output", required=True, help="directory for results.jsonl and html/")
+    parser.add_argument("--workers", type=int, default=int(os.getenv('BATCH_WORKERS', 4)),
+                        help="profiles generated concurrently")
+    parser.add_argument("--no-html", action="store_true", help="only write results.jsonl")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and regenerate everything")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
+    try:
+        summary = run(args.input, args.output, workers=args.workers, html=not args.no_html, restart=args.restart)
+    except (OSError, ValueError) as e:
+        parser.exit(2, f"error: {str(e)}\n")
+    except KeyboardInterrupt:
+        return 130
+    print(json.dumps(summary, indent=2))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt):
+    """Collapse whitespace so prompts that only differ in indentation share a key"""
+    return " ".join(prompt.split())
+
+
+def make_key(prompt, model, max_tokens, **extra):
+    """Stable cache key for a completion request"""
+    parts = {"prompt": normalize_prompt(prompt), "model": model, "max_tokens": max_tokens}
+    parts.update(extra)
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# Questionnaire answers that shape the generated plan (the email address doesn't)
+PROFILE_FIELDS = ("goal", "gender", "age", "height", "current_weight", "target_weight", "activity",
+                  "diet_preference", "allergies", "cooking_time", "meal_prep")
+
+
+def normalize_profile(profile):
+    """Plan-relevant profile fields with case, whitespace and number formatting evened out"""
+    normalized = {}
+    for field in PROFILE_FIELDS:
+        value = profile.get(field)
+        if value is None:
+            continue
+        value = " ".join(str(value).split()).lower()
+        try:
+            number = float(value)
+            value = f"{number:g}"
+        except ValueError:
+            pass
+        normalized[field] = value
+    return normalized
+
+
+def profile_key(profile):
+    """Stable hash of the normalized profile"""
+    return hashlib.sha256(json.dumps(normalize_profile(profile), sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class PromptCache:
+    """Two-tier completion cache: a per-process LRU in front of a shared SQLite file.
+
+    The SQLite tier is shared by every gunicorn worker pointing at the same
+    ``db_path``. Both tiers honour ``ttl`` (seconds); the disk tier is trimmed
+    to ``disk_max_entries`` by last access time.
+    """
+
+    def __init__(self, db_path, max_entries=256, disk_max_entries=5000, ttl=24 * 3600, enabled=True):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.disk_max_entries = disk_max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+        self._memory = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+        self._stores_since_trim = 0
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "errors": 0}
+        if self.enabled:
+            self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS completions (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    stored_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed_at)")
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _remember(self, key, stored_at, value):
+        with self._lock:
+            self._memory[key] = (stored_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        if not self.enabled:
+            return None
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[0] < self.ttl:
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return entry[1]
+                del self._memory[key]
+
+        try:
+            with closing(self._connect()) as conn:
+                row = conn.execute(
+                    "SELECT value, stored_at FROM completions WHERE key = ? AND stored_at > ?",
+                    (key, now - self.ttl)
+                ).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            logger.error(f"Prompt cache read error: {str(e)}")
+            self._count("errors")
+            row = None
+
+        if row is None:
+            self._count("misses")
+            return None
+        self._remember(key, row[1], row[0])
+        self._count("disk_hits")
+        return row[0]
+
+    def set(self, key, value):
+        """Store a value in both tiers"""
+        if not self.enabled:
+            return
+        now = time.time()
+        self._remember(key, now, value)
+        self._count("stores")
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO completions (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now)
+                )
+                self._stores_since_trim += 1
+                if self._stores_since_trim >= 50:
+                    self._stores_since_trim = 0
+                    self._trim(conn, now)
+        except sqlite3.Error as e:
+            logger.error(f"Prompt cache write error: {str(e)}")
+            self._count("errors")
+
+    def _trim(self, conn, now):
+        conn.execute("DELETE FROM completions WHERE stored_at <= ?", (now - self.ttl,))
+        conn.execute(
+            "DELETE FROM completions WHERE key IN ("
+            "SELECT key FROM completions ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.disk_max_entries,)
+        )
+
+    def stats(self):
+        """Hit/miss counters for this process plus current tier sizes"""
+        with self._lock:
+            stats = dict(self.counters)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 3) if lookups else 0.0
+        return stats
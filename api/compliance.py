@@ -0,0 +1,412 @@
+"""Allergen and diet checks for generated meals.
+
+Every meal's name and description is scanned once with a word-level
+Aho-Corasick automaton built from ``LEXICON``, so the cost is linear in the
+plan's text regardless of how many terms there are (a 7-day plan takes a
+fraction of a millisecond). Overlapping matches are
+resolved leftmost-longest, which lets specific terms override generic ones
+("almond milk" is a nut, not dairy; "coconut milk" is neither). A term is
+ignored when negated: "no dairy", "without cheese", "gluten-free pasta".
+"""
+import functools
+import logging
+import re
+
+from api.pipeline import Stage, StageError, run_stages
+from api.plan_model import MEAL_SLOTS
+from api.swap import replace_meal
+
+logger = logging.getLogger(__name__)
+
+# Category -> terms; a term may appear under several categories ("soy sauce" is soy and gluten)
+LEXICON = {
+    "MEAT": ["meat", "chicken", "chicken breast", "chicken thigh", "turkey", "beef", "ground beef", "steak",
+             "sirloin", "pork", "pork chop", "pork tenderloin", "bacon", "ham", "lamb", "sausage", "prosciutto",
+             "chorizo", "salami", "pepperoni", "duck", "veal", "venison", "bison", "jerky", "meatball", "gelatin",
+             "bone broth", "chicken broth", "beef broth", "chicken stock", "beef stock", "liver"],
+    "FISH": ["fish", "white fish", "salmon", "smoked salmon", "tuna", "cod", "tilapia", "halibut", "trout",
+             "sardine", "mackerel", "anchovy", "anchovies", "sea bass", "haddock", "swordfish", "catfish",
+             "fish sauce"],
+    "SHELLFISH": ["shellfish", "shrimp", "prawn", "crab", "lobster", "scallop", "mussel", "clam", "oyster",
+                  "calamari", "squid"],
+    "DAIRY": ["dairy", "milk", "whole milk", "cheese", "feta", "parmesan", "mozzarella", "cheddar", "ricotta",
+              "goat cheese", "cottage cheese", "cream cheese", "halloumi", "paneer", "yogurt", "yoghurt",
+              "greek yogurt", "butter", "cream", "sour cream", "ice cream", "heavy cream", "whey", "ghee", "kefir",
+              "custard", "tzatziki", "queso", "whey protein", "buttermilk"],
+    "EGGS": ["egg", "egg white", "egg yolk", "hard-boiled egg", "omelette", "omelet", "frittata", "quiche",
+             "mayonnaise", "mayo", "meringue", "aioli", "egg noodle"],
+    "HONEY": ["honey"],
+    "NUTS": ["nut", "tree nut", "mixed nut", "nut butter", "almond", "almond milk", "almond butter", "almond flour",
+             "walnut", "cashew", "pecan", "pistachio", "hazelnut", "macadamia", "brazil nut", "pine nut", "peanut",
+             "peanut butter", "pesto", "praline", "marzipan", "nutella", "trail mix"],
+    "GLUTEN": ["gluten", "wheat", "whole wheat", "bread", "whole grain bread", "toast", "sourdough", "pasta",
+               "spaghetti", "noodle", "couscous", "barley", "rye", "seitan", "bulgur", "farro", "spelt", "flour",
+               "tortilla", "cracker", "breadcrumb", "panko", "pita", "bagel", "croissant", "muffin", "pancake",
+               "waffle", "crouton", "pizza", "soy sauce", "teriyaki", "orzo", "ramen", "udon", "egg noodle"],
+    "SOY": ["soy", "soy sauce", "soy milk", "soybean", "tofu", "tempeh", "edamame", "tamari", "miso"],
+}
+# Terms that contain a restricted word but don't belong to its category
+SAFE_TERMS = {
+    "coconut milk": (), "oat milk": (), "rice milk": (), "soy milk": ("SOY",), "almond milk": ("NUTS",),
+    "coconut yogurt": (), "soy yogurt": ("SOY",), "vegan cheese": (), "vegan butter": (), "vegan mayo": (),
+    "coconut cream": (), "cocoa butter": (), "apple butter": (), "sunflower butter": (), "seed butter": (),
+    "coconut flour": (), "rice flour": (), "chickpea flour": (), "oat flour": (), "rice noodle": (),
+    "corn tortilla": (), "rice cracker": (), "flax egg": (), "chia egg": (), "coconut": (), "nutmeg": (),
+    "nutritional yeast": (), "veggie sausage": (), "butter lettuce": (),
+    "cashew cheese": ("NUTS",), "cashew cream": ("NUTS",), "nut milk": ("NUTS",), "chickpea pasta": (),
+    "lentil pasta": (), "zucchini noodle": (), "rice paper": (), "plant-based": (), "buckwheat": (),
+    "butternut": (), "butternut squash": (), "water chestnut": (), "eggplant": (),
+}
+# Questionnaire answers (and common free-text spellings) -> categories they rule out
+ALLERGIES = {
+    "nuts": ("NUTS",), "nut": ("NUTS",), "peanuts": ("NUTS",), "peanut": ("NUTS",), "tree nuts": ("NUTS",),
+    "dairy": ("DAIRY",), "milk": ("DAIRY",), "lactose": ("DAIRY",),
+    "gluten": ("GLUTEN",), "wheat": ("GLUTEN",), "celiac": ("GLUTEN",), "coeliac": ("GLUTEN",),
+    "eggs": ("EGGS",), "egg": ("EGGS",), "soy": ("SOY",), "fish": ("FISH",), "shellfish": ("SHELLFISH",),
+    "seafood": ("FISH", "SHELLFISH"),
+}
+DIETS = {
+    "vegetarian": ("MEAT", "FISH", "SHELLFISH"),
+    "vegan": ("MEAT", "FISH", "SHELLFISH", "DAIRY", "EGGS", "HONEY"),
+    "pescatarian": ("MEAT",),
+}
+NO_ALLERGIES = frozenset(["", "none", "no", "n/a", "na", "nothing"])
+NEGATIONS = frozenset([b"no", b"without", b"skip", b"omit", b"minus", b"free"])
+
+TOKEN = re.compile(r"[a-z]+")
+# Byte table that lowercases ASCII letters and turns other ASCII into spaces; UTF-8 sequences pass
+# through. bytes.translate + split tokenizes several times faster than TOKEN.findall on the hot path.
+FOLD = bytes(code + 32 if 65 <= code <= 90 else code if 97 <= code <= 122 or code >= 128 else 32
+             for code in range(256))
+ALLERGY_SEPARATOR = re.compile(r"\s*(?:,|;|/|&|\band\b)\s*")
+
+
+def tokenize(text):
+    return text.encode('utf-8').translate(FOLD).split()
+
+
+def _plurals(term):
+    words = tokenize(term)
+    last = words[-1]
+    forms = {last, last + b"s", last + b"es"}
+    if last.endswith(b"y"):
+        forms.add(last[:-1] + b"ies")
+    return [tuple(words[:-1] + [form]) for form in forms]
+
+
+class Automaton:
+    """Aho-Corasick over word tokens; patterns are word tuples labelled with categories"""
+    __slots__ = ("goto", "fail", "output")
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        outputs = [None]
+        for words, categories in patterns.items():
+            state = 0
+            for word in words:
+                following = self.goto[state].get(word)
+                if following is None:
+                    following = len(self.goto)
+                    self.goto[state][word] = following
+                    self.goto.append({})
+                    outputs.append(None)
+                state = following
+            outputs[state] = (len(words), frozenset(categories))
+        # Breadth-first failure links; each state's output includes the matches of its suffix states
+        self.fail = [0] * len(self.goto)
+        self.output = [[output] if output else [] for output in outputs]
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for word, following in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and word not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[following] = self.goto[fallback].get(word, 0)
+                self.output[following] = self.output[following] + self.output[self.fail[following]]
+                queue.append(following)
+
+    def matches(self, tokens):
+        """(start, end, categories) for every pattern occurrence, ``end`` inclusive"""
+        goto, fail, output = self.goto, self.fail, self.output
+        root = goto[0]
+        found = []
+        state = 0
+        for index, token in enumerate(tokens):
+            if state:
+                while state and token not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(token, 0)
+            else:
+                # Most words don't start a term
+                state = root.get(token, 0)
+                if not state:
+                    continue
+            if output[state]:
+                for length, categories in output[state]:
+                    found.append((index - length + 1, index, categories))
+        return found
+
+
+def _patterns(lexicon, safe_terms):
+    patterns = {}
+    for category, terms in lexicon.items():
+        for term in terms:
+            for words in _plurals(term):
+                patterns.setdefault(words, set()).add(category)
+    for term, categories in safe_terms.items():
+        for words in _plurals(term):
+            patterns[words] = set(categories)
+    return patterns
+
+
+PATTERNS = _patterns(LEXICON, SAFE_TERMS)
+AUTOMATON = Automaton(PATTERNS)
+
+
+@functools.lru_cache(maxsize=64)
+def _trigger_words(categories):
+    """Last words of the patterns in ``categories``; text without any of them can't violate"""
+    return frozenset(words[-1] for words, labels in PATTERNS.items() if labels & categories)
+
+
+@functools.lru_cache(maxsize=64)
+def _extra_automaton(terms):
+    """Automaton for free-text allergies the lexicon doesn't know, each its own category"""
+    return Automaton({words: {f"allergy:{term}"} for term in terms for words in _plurals(term)})
+
+
+class Restrictions:
+    """What a profile rules out: lexicon categories plus unknown allergy terms.
+
+    ``allergens`` are the categories an allergy (rather than only the diet)
+    rules out; free-text allergy terms always count as allergens.
+    """
+    __slots__ = ("categories", "extra_terms", "reasons", "allergens", "triggers")
+
+    def __init__(self, categories=(), extra_terms=(), reasons=None, allergens=()):
+        self.categories = frozenset(categories)
+        self.extra_terms = tuple(sorted(extra_terms))
+        # category -> the profile answer it came from, for messages and prompts
+        self.reasons = reasons or {}
+        self.allergens = frozenset(allergens)
+        self.triggers = _trigger_words(self.categories).union(
+            words[-1] for term in self.extra_terms for words in _plurals(term))
+
+    def __bool__(self):
+        return bool(self.categories or self.extra_terms)
+
+
+def profile_restrictions(user_profile):
+    """Restrictions implied by the profile's ``allergies`` and ``diet_preference`` answers"""
+    categories, extra_terms, reasons, allergens = set(), set(), {}, set()
+    diet = str(user_profile.get('diet_preference') or '').strip().lower().replace('_', ' ')
+    for category in DIETS.get(diet, ()):
+        categories.add(category)
+        reasons.setdefault(category, f"{diet} diet")
+    allergies = str(user_profile.get('allergies') or '').strip().lower().replace('_', ' ')
+    # "n/a" would otherwise split into the allergies "n" and "a"
+    for allergy in ALLERGY_SEPARATOR.split(allergies) if allergies not in NO_ALLERGIES else ():
+        if allergy in NO_ALLERGIES:
+            continue
+        known = ALLERGIES.get(allergy)
+        if known:
+            for category in known:
+                categories.add(category)
+                allergens.add(category)
+                reasons[category] = f"{allergy} allergy"
+        elif len(allergy) <= 40:
+            term = " ".join(TOKEN.findall(allergy))
+            # Single letters and the like match far too much to be an allergy
+            if len(term) >= 3:
+                extra_terms.add(term)
+                reasons[f"allergy:{term}"] = f"{allergy} allergy"
+    return Restrictions(categories, extra_terms, reasons, allergens)
+
+
+def _resolve(tokens, found):
+    """Leftmost-longest, non-negated matches as (start, end, categories)"""
+    found.sort(key=lambda match: (match[0], match[0] - match[1]))
+    selected = []
+    end = -1
+    freed = frozenset()
+    for start, stop, categories in found:
+        if start <= end:
+            continue
+        end = stop
+        if stop + 1 < len(tokens) and tokens[stop + 1] == b"free":
+            # "gluten-free pasta": the marker and the next match of its categories are fine
+            freed = categories
+            continue
+        if start and tokens[start - 1] in NEGATIONS:
+            if tokens[start - 1] == b"free":
+                categories = categories - freed
+            else:
+                continue
+        freed = frozenset()
+        if categories:
+            selected.append((start, stop, categories))
+    return selected
+
+
+class Violation:
+    """A restricted term found in a meal; ``allergen`` is True when an allergy (not only the diet) rules it out"""
+    __slots__ = ("day", "slot", "meal", "category", "term", "reason", "allergen")
+
+    def __init__(self, day, slot, meal, category, term, reason, allergen=False):
+        self.day = day
+        self.slot = slot
+        self.meal = meal
+        self.category = category
+        self.term = term
+        self.reason = reason
+        self.allergen = allergen
+
+    def to_dict(self):
+        return {"day": self.day, "slot": self.slot, "meal": self.meal, "category": self.category,
+                "term": self.term, "reason": self.reason, "allergen": self.allergen}
+
+
+def check_text(text, restrictions):
+    """(category, term) pairs in ``text`` that the restrictions rule out"""
+    tokens = tokenize(text)
+    if restrictions.triggers.isdisjoint(tokens):
+        return []
+    hits = []
+    if restrictions.categories:
+        for start, stop, categories in _resolve(tokens, AUTOMATON.matches(tokens)):
+            for category in categories & restrictions.categories:
+                hits.append((category, b" ".join(tokens[start:stop + 1]).decode('utf-8', 'replace')))
+    if restrictions.extra_terms:
+        automaton = _extra_automaton(restrictions.extra_terms)
+        for start, stop, categories in _resolve(tokens, automaton.matches(tokens)):
+            for category in categories:
+                hits.append((category, b" ".join(tokens[start:stop + 1]).decode('utf-8', 'replace')))
+    return hits
+
+
+def meal_text(meal):
+    return f"{meal.name or ''}. {meal.description or ''}"
+
+
+def check_meal(meal, restrictions, day_number=None):
+    """Violations in one meal's name and description"""
+    return _violations(meal, meal_text(meal), restrictions, day_number)
+
+
+def _violations(meal, text, restrictions, day_number):
+    violations = []
+    seen = set()
+    for category, term in check_text(text, restrictions):
+        if (category, term) not in seen:
+            seen.add((category, term))
+            violations.append(Violation(day_number, meal.slot, meal.name, category, term,
+                                        restrictions.reasons.get(category, category.lower()),
+                                        category in restrictions.allergens or category.startswith("allergy:")))
+    return violations
+
+
+def check_plan(plan, restrictions):
+    """Violations across every meal of the plan, in day and slot order"""
+    if not restrictions:
+        return []
+    meals = [(day.number, meal, meal_text(meal)) for day in plan.days for meal in day.meals]
+    # One tokenization of the whole plan settles the common case of a compliant plan
+    if restrictions.triggers.isdisjoint(tokenize("\n".join(text for _, _, text in meals))):
+        return []
+    violations = []
+    for day_number, meal, text in meals:
+        violations.extend(_violations(meal, text, restrictions, day_number))
+    return violations
+
+
+def meal_warnings(violations):
+    """(day number, slot) -> "Contains peanut butter (peanut allergy)", for meals that keep their violations"""
+    terms = {}
+    for violation in violations:
+        terms.setdefault((violation.day, violation.slot), {}).setdefault(violation.term, violation.reason)
+    return {pair: "Contains " + "; ".join(f"{term} ({reason})" for term, reason in found.items())
+            for pair, found in terms.items()}
+
+
+def flagged_meals(violations):
+    """(day number, slot) pairs to regenerate, each once and in plan order"""
+    order = {slot: index for index, slot in enumerate(MEAL_SLOTS)}
+    pairs = {(violation.day, violation.slot) for violation in violations}
+    return sorted(pairs, key=lambda pair: (pair[0], order.get(pair[1], len(order))))
+
+
+class RepairShed(Exception):
+    """Raised by a repair's ``generate`` when the model call was turned away for load rather than answered"""
+
+
+def repair_meals(plan, restrictions, violations, generate, max_meals=7, max_attempts=2, timeout=None):
+    """Regenerate only the flagged meals, concurrently, and patch them into ``plan``.
+
+    ``generate(day, slot, exclude, attempt)`` returns a replacement Meal (or
+    raises); ``exclude`` lists the (term, reason) pairs the meal must avoid. A
+    replacement is only used if it passes the check itself; meals that still
+    fail are retried with every term seen so far, up to ``max_attempts`` each.
+    A call ``generate`` reports as shed (RepairShed) doesn't use up an attempt
+    and is tried again, unless every call of a round was shed. Returns
+    (repaired, unresolved, shed) lists of (day number, slot); ``shed`` are the
+    unresolved meals whose last call was shed, and meals past ``max_meals``
+    are unresolved without being tried.
+    """
+    days = {day.number: day for day in plan.days}
+    flagged = flagged_meals(violations)
+    excluded = {}
+    for violation in violations:
+        excluded.setdefault((violation.day, violation.slot), {})[violation.term] = violation.reason
+    pending = flagged[:max_meals]
+    attempts = dict.fromkeys(pending, 0)
+    repaired, shed = [], set()
+
+    def run(day_number, slot, exclude, attempt):
+        try:
+            return generate(days[day_number], slot, exclude, attempt)
+        except RepairShed:
+            return RepairShed
+        except Exception as e:
+            logger.error(f"Error regenerating day {day_number} {slot}: {str(e)}")
+            return None
+
+    while pending:
+        stages = [Stage(f"repair_{day_number}_{slot}",
+                        lambda day_number=day_number, slot=slot: run(day_number, slot,
+                                                                     sorted(excluded[(day_number, slot)].items()),
+                                                                     attempts[(day_number, slot)]),
+                        timeout=timeout)
+                  for day_number, slot in pending]
+        try:
+            results = run_stages(stages)
+        except StageError as e:
+            logger.error(f"Meal repair stopped: {e.message}")
+            break
+
+        retry = []
+        for stage, pair in zip(stages, pending):
+            meal = results.get(stage.name)
+            if meal is RepairShed:
+                shed.add(pair)
+                retry.append(pair)
+                continue
+            shed.discard(pair)
+            attempts[pair] += 1
+            remaining = check_meal(meal, restrictions, pair[0]) if meal is not None else None
+            if meal is not None and not remaining:
+                replace_meal(plan, days[pair[0]], meal)
+                repaired.append(pair)
+                continue
+            for violation in remaining or ():
+                excluded[pair][violation.term] = violation.reason
+            if attempts[pair] < max_attempts:
+                retry.append(pair)
+        if retry and all(pair in shed for pair in pending):
+            # Nothing was answered; more calls now would only add to the load
+            break
+        pending = retry
+
+    unresolved = [pair for pair in flagged if pair not in repaired]
+    if unresolved:
+        logger.warning(f"Meals still breaking the profile's restrictions: {unresolved}")
+    return repaired, unresolved, [pair for pair in unresolved if pair in shed]
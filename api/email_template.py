@@ -0,0 +1,291 @@
+import functools
+import html
+import logging
+import os
+import re
+from email.utils import formataddr
+
+logger = logging.getLogger(__name__)
+
+LOGO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets', 'images', 'EatRealLogo.png')
+SUBJECT = "Your Personalized Nutrition Plan"
+
+EMAIL_CSS = """
+body {
+    font-family: Arial, sans-serif;
+    line-height: 1.6;
+    color: #333;
+    margin: 0;
+    padding: 0;
+    background-color: #f5f5f5;
+}
+
+.container {
+    max-width: 600px;
+    margin: 0 auto;
+    background-color: #ffffff;
+}
+
+.header {
+    background-color: #45B26B;
+    padding: 20px;
+    text-align: center;
+}
+
+.logo {
+    width: 120px;
+    height: auto;
+    margin-bottom: 20px;
+}
+
+.header h1 {
+    color: white;
+    margin: 0;
+    font-size: 24px;
+    font-weight: 600;
+}
+
+.content {
+    padding: 40px 20px;
+}
+
+.section {
+    margin-bottom: 30px;
+}
+
+.section-title {
+    color: #45B26B;
+    font-size: 20px;
+    font-weight: 600;
+    margin-bottom: 15px;
+    border-bottom: 2px solid #45B26B;
+    padding-bottom: 5px;
+}
+
+.meal-day {
+    background: white;
+    border-radius: 12px;
+    box-shadow: 0 2px 8px rgba(0,0,0,0.1);
+    padding: 25px;
+    margin-bottom: 30px;
+}
+
+.day-intro {
+    color: #666;
+    font-style: italic;
+    margin-bottom: 15px;
+    padding: 10px;
+    background: #f8f9fa;
+    border-radius: 6px;
+}
+
+.macro-badge {
+    display: inline-block;
+    padding: 4px 8px;
+    border-radius: 12px;
+    font-size: 12px;
+    margin-right: 8px;
+    background: #e9ecef;
+    color: #495057;
+}
+
+.meal-emoji {
+    font-size: 20px;
+    margin-right: 8px;
+}
+
+.category-title {
+    color: #45B26B;
+    font-size: 18px;
+    margin: 15px 0 10px;
+    display: flex;
+    align-items: center;
+}
+
+.meal-title {
+    color: #45B26B;
+    font-weight: 600;
+    margin-bottom: 10px;
+}
+
+.meal-warning {
+    background: #fdecea;
+    color: #b3261e;
+    border-radius: 4px;
+    padding: 8px 10px;
+    font-weight: 600;
+}
+
+.meal-table {
+    width: 100%;
+    border-collapse: collapse;
+    margin-bottom: 20px;
+}
+
+.meal-table th {
+    background: #45B26B;
+    color: white;
+    padding: 10px;
+    text-align: left;
+}
+
+.meal-table td {
+    padding: 10px;
+    border-bottom: 1px solid #eee;
+}
+
+.macros-box {
+    background: #f0f7f1;
+    border-radius: 8px;
+    padding: 15px;
+    margin-bottom: 20px;
+}
+
+.grocery-list {
+    background: white;
+    border: 1px solid #ddd;
+    border-radius: 8px;
+    padding: 20px;
+}
+
+.tips {
+    background: #fff5e6;
+    border-radius: 8px;
+    padding: 20px;
+    margin-top: 30px;
+}
+
+.footer {
+    background: #333;
+    color: white;
+    text-align: center;
+    padding: 20px;
+    font-size: 12px;
+}
+
+.intro-section {
+    background: #f8f9fa;
+    border-left: 4px solid #45B26B;
+    padding: 20px;
+    margin: 20px 0;
+    border-radius: 8px;
+    line-height: 1.6;
+}
+
+.intro-section p {
+    color: #666;
+    margin: 10px 0;
+}
+
+.highlight {
+    color: #45B26B;
+    font-weight: 600;
+}
+"""
+
+
+def minify_html(markup):
+    """Drop comments and the whitespace between tags and CSS tokens"""
+    markup = re.sub(r"<!--.*?-->", "", markup, flags=re.S)
+    markup = re.sub(r">\s+<", "><", markup)
+    markup = re.sub(r"\s*([{};:,])\s*", r"\1", markup)
+    return re.sub(r"\s+", " ", markup).strip()
+
+
+# Static shell, built once at import; rendering only joins the dynamic sections into it
+HTML_HEAD = minify_html(f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="utf-8">
+        <style>{EMAIL_CSS}</style>
+    </head>
+    <body>
+        <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
+            <div style="text-align: center; margin-bottom: 20px;">
+                <img src="cid:logo" alt="Eat Real Logo" style="width: 120px; height: auto;">
+            </div>
+            <h1 style="color: #8B4513; text-align: center;">Your Personalized Nutrition Plan</h1>
+            <div class="container">
+                <div class="content">
+""")
+HTML_TAIL = "</div></div></div></body></html>"
+SECTION_OPEN = '<div class="section"><h2 class="section-title">'
+SECTION_TITLE_CLOSE = "</h2>"
+SECTION_CLOSE = "</div>"
+
+
+@functools.lru_cache(maxsize=None)
+def logo_part():
+    """The inline logo, read from disk on first use; the same part is attached to every message"""
+    from email.mime.image import MIMEImage
+    try:
+        with open(LOGO_PATH, 'rb') as f:
+            img = MIMEImage(f.read())
+    except OSError as e:
+        logger.error(f"Error loading email logo: {str(e)}")
+        return None
+    img.add_header('Content-ID', '<logo>')
+    img.add_header('Content-Disposition', 'inline', filename='EatRealLogo.png')
+    return img
+
+
+def _profile_value(user_profile, key):
+    return html.escape(str(user_profile.get(key) or '').replace('_', ' '))
+
+
+def render_intro(user_profile):
+    """Personalised introduction block"""
+    return "".join((
+        '<div class="intro-section">',
+        "<p>Welcome to your personalized nutrition journey! Based on your profile, we've created a meal plan that:</p>",
+        '<p>🎯 Supports your <span class="highlight">weight goal</span> from ',
+        _profile_value(user_profile, 'current_weight'), 'kg to ', _profile_value(user_profile, 'target_weight'), 'kg</p>',
+        '<p>💪 Matches your <span class="highlight">', _profile_value(user_profile, 'activity'),
+        '</span> activity level</p>',
+        '<p>🍽️ Follows your <span class="highlight">', _profile_value(user_profile, 'diet_preference'),
+        '</span> dietary preference</p>',
+        '<p>⏰ Fits within your <span class="highlight">', _profile_value(user_profile, 'cooking_time'),
+        '</span> cooking time preference</p>',
+        '<p>🔄 Includes ', _profile_value(user_profile, 'meal_prep'), ' meal prep options</p>',
+        '</div>',
+    ))
+
+
+def render_html(user_profile, sections):
+    """Render the full email from (title, html) sections in a single join"""
+    parts = [HTML_HEAD, render_intro(user_profile)]
+    for title, body in sections:
+        parts.extend((SECTION_OPEN, title, SECTION_TITLE_CLOSE, body, SECTION_CLOSE))
+    parts.append(HTML_TAIL)
+    return "".join(parts)
+
+
+def render_text(sections):
+    """Plain-text alternative from (title, text) sections"""
+    parts = [SUBJECT, "=" * len(SUBJECT), ""]
+    for title, body in sections:
+        parts.extend((title, "-" * len(title), body.strip(), ""))
+    return "\n".join(parts)
+
+
+def build_message(sender, recipient, html_content, text_content=None):
+    """multipart/related message with one HTML part, a text alternative and the inline logo"""
+    # email.mime costs ~30 ms to import, so it waits until the first message
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    msg = MIMEMultipart('related')
+    msg['Subject'] = SUBJECT
+    msg['From'] = formataddr(("Eat Real", sender))
+    msg['To'] = recipient
+
+    body = MIMEMultipart('alternative')
+    if text_content:
+        body.attach(MIMEText(text_content, 'plain', 'utf-8'))
+    body.attach(MIMEText(html_content, 'html', 'utf-8'))
+    msg.attach(body)
+    logo = logo_part()
+    if logo is not None:
+        msg.attach(logo)
+    return msg
@@ -1,25 +1,48 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-import openai
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import smtplib
 import os
-from dotenv import find_dotenv, load_dotenv
+from dotenv import load_dotenv
 import logging
-import base64
-from email.utils import formataddr
+import functools
+import hashlib
 import traceback
-import sys
-import flask
-from email.mime.image import MIMEImage
+import time
+import re
+import uuid
+import contextvars
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from api import email_template
+from api.cache import PromptCache, make_key, profile_key
+from api.metrics import TOKEN_BUCKETS, Metrics
+from api.grocery import build_grocery_list, grocery_list_text
+from api.jobs import JobQueue, QueueFullError
+from api.llm import create_backend
+from api.per_day import CUISINE_THEMES, generate_days
+from api.pipeline import Stage, StageError, arun_stages, run_stages, stage_cancelled, stage_time_left
+from api.scheduler import (BATCH, CallCancelled, LLMScheduler, SchedulerOverloaded, SharedRateLimiter,
+                           priority_scope)
+from api.singleflight import FlightError, SingleFlight
+from api.plan_model import MEAL_SLOTS, Plan
+from api.plan_store import PlanStore
+from api.meal_library import MealLibrary, cooking_level
+from api.swap import macro_budget, normalize_slot, replace_meal, target_grams
+from api.compliance import (RepairShed, check_meal, check_plan, flagged_meals, meal_warnings, profile_restrictions,
+                            repair_meals)
+from api.plan_schema import DOCUMENT_SHAPE, SchemaError, parse_plan_document
+from api.plan_parser import (parse_daily_targets, parse_grocery_list, parse_meal_plan,
+                             parse_plan, parse_prep_tips)
+from api.renderers import (html_sections, render_day_html, render_grocery_html, render_meal_plan_html,
+                           render_model_text, render_targets_html, render_tips_html, text_sections)
+from api.tracing import Tracer
+from api.streaming import MealPlanStreamFormatter, sse_event
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
+# Set up logging; request details go to sampled traces, not the log
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
 logger = logging.getLogger(__name__)
 
-# Add this debug line
-dotenv_path = find_dotenv()
+# .env at the repository root; a fixed path instead of find_dotenv's directory walk
+dotenv_path = os.getenv('DOTENV_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.env'))
 logger.debug(f"Loading .env from: {dotenv_path}")
 
 # Load environment variables without setting keys
@@ -30,27 +53,22 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 EMAIL_USERNAME = os.getenv('EMAIL_USERNAME')
 EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
 
-# Debug print to check values
-logger.debug(f"OPENAI_API_KEY: {OPENAI_API_KEY[:5]}..." if OPENAI_API_KEY else "None")
-logger.debug(f"EMAIL_USERNAME: {EMAIL_USERNAME}")
-logger.debug(f"EMAIL_PASSWORD: {'*' * len(EMAIL_PASSWORD) if EMAIL_PASSWORD else 'None'}")
+def require_settings(**settings):
+    """Raise ValueError naming any of ``settings`` that are unset"""
+    missing_vars = [name for name, value in settings.items() if not value]
+    if missing_vars:
+        raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
 
-# Verify environment variables are loaded
-if not all([OPENAI_API_KEY, EMAIL_USERNAME, EMAIL_PASSWORD]):
-    missing_vars = []
-    if not OPENAI_API_KEY:
-        missing_vars.append("OPENAI_API_KEY")
-    if not EMAIL_USERNAME:
-        missing_vars.append("EMAIL_USERNAME")
-    if not EMAIL_PASSWORD:
-        missing_vars.append("EMAIL_PASSWORD")
-    logger.error(f"Missing environment variables: {', '.join(missing_vars)}")
-    raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
+# Secrets are checked where they are used (the OpenAI client, send_email), so the module
+# still imports without them for tooling, the batch CLI and gunicorn --preload
+try:
+    require_settings(OPENAI_API_KEY=OPENAI_API_KEY, EMAIL_USERNAME=EMAIL_USERNAME, EMAIL_PASSWORD=EMAIL_PASSWORD)
+except ValueError as e:
+    logger.warning(str(e))
 
-logger.debug(f"API Key loaded (first 5 chars): {OPENAI_API_KEY[:5] if OPENAI_API_KEY else 'None'}")
-
-# Make sure we're setting it for the openai client
-client = openai.OpenAI()  # It will automatically use OPENAI_API_KEY from environment
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo-16k')
+OPENAI_TEMPERATURE = 0.2
+SYSTEM_PROMPT = "You are a precise nutritionist. Respond only in the exact format requested."
 
 # Define prompts
 targets_prompt = """
@@ -124,6 +142,243 @@ IMPORTANT:
 6. No summarizing or referencing other days. Each day must have its own meal details and macronutrient breakdown.
 """
 
+day_plan_prompt = """
+Create the meal plan for {days} only, with this EXACT format for each day:
+DAY [number]:
+
+Breakfast
+[meal name]
+- [2-3 sentence description of the meal and ingredients]
+| protein: [X]g, carbs: [X]g, fats: [X]g
+
+Lunch
+[meal name]
+- [2-3 sentence description of the meal and ingredients]
+| protein: [X]g, carbs: [X]g, fats: [X]g
+
+Dinner
+[meal name]
+- [2-3 sentence description of the meal and ingredients]
+| protein: [X]g, carbs: [X]g, fats: [X]g
+
+Snacks
+[meal name]
+- [2-3 sentence description of the meal and ingredients]
+| protein: [X]g, carbs: [X]g, fats: [X]g
+
+Meal Prep Tips:
+- [3-4 specific preparation instructions for the day's meals]
+
+Give the meals a {theme} style. Every day must include Breakfast, Lunch, Dinner and Snacks,
+each with a name, a description line starting with "-" and a macros line starting with "|".
+"""
+
+grocery_classify_prompt = (
+    "Classify these meal ingredients for a grocery list. Skip anything that is not a grocery item.\n"
+    "Format as:\nPRODUCE:\n- [item]\nPROTEINS:\n- [item]\nPANTRY:\n- [item]\n\n"
+    "Ingredients:\n"
+)
+
+prep_tips_prompt = (
+    "Create 5 specific meal prep tips for this meal plan. "
+    "Format each tip on a new line starting with a number. "
+    "Focus on time-saving and storage tips."
+)
+
+swap_meal_prompt = """
+Create one new {slot} for DAY {day} of their meal plan to replace "{current}".
+It must be different from the other meals that day and from this week's other {slot} meals: {avoid}.
+{budget}{exclude}{note}
+Respond with only the meal, in this EXACT format:
+{slot}
+[meal name]
+- [2-3 sentence description of the meal and ingredients]
+| protein: [X]g, carbs: [X]g, fats: [X]g
+"""
+
+structured_plan_prompt = f"""
+Create their daily nutritional targets, a 7-day meal plan, a categorized grocery list for the whole plan
+and 5 meal prep tips. Respond with one JSON object and nothing else, in this EXACT shape:
+{DOCUMENT_SHAPE}
+"days" must contain all 7 days, each with all four meals: Breakfast, Lunch, Dinner and Snacks.
+Macros are plain numbers of grams. Do not summarize or reference other days.
+"""
+
+# 'local' computes targets from the profile (Mifflin-St Jeor); 'llm' asks the model
+TARGETS_SOURCE = os.getenv('TARGETS_SOURCE', 'local').lower()
+
+# 'local' aggregates ingredients from the parsed plan; 'llm' sends the whole plan back to the model
+GROCERY_SOURCE = os.getenv('GROCERY_SOURCE', 'local').lower()
+
+# 'single' asks for the whole week in one completion; 'per_day' generates days concurrently;
+# 'library' fills slots with meals from past plans and asks the model only for the rest
+MEAL_PLAN_MODE = os.getenv('MEAL_PLAN_MODE', 'single').lower()
+PER_DAY_MAX_TOKENS = int(os.getenv('PER_DAY_MAX_TOKENS', 900))
+
+# 'text' runs the stage pipeline above; 'json' gets targets, plan, groceries and tips from one JSON-mode
+# completion (needs a model with response_format support, e.g. gpt-4-1106-preview). Local targets still
+# win when TARGETS_SOURCE=local; MEAL_PLAN_MODE and GROCERY_SOURCE don't apply.
+PLAN_FORMAT = os.getenv('PLAN_FORMAT', 'text').lower()
+STRUCTURED_PLAN_TIMEOUT = float(os.getenv('STRUCTURED_PLAN_TIMEOUT', 150))
+STRUCTURED_PLAN_MAX_TOKENS = int(os.getenv('STRUCTURED_PLAN_MAX_TOKENS', 4000))
+JSON_FORMAT = {"type": "json_object"}
+
+# Library mode: with more gaps than MEAL_LIBRARY_MAX_GAPS the plan is generated per day instead;
+# MEAL_LIBRARY_FRESH_MEALS slots per plan are always written by the model
+MEAL_LIBRARY_MAX_GAPS = int(os.getenv('MEAL_LIBRARY_MAX_GAPS', 8))
+MEAL_LIBRARY_CHOICES = int(os.getenv('MEAL_LIBRARY_CHOICES', 3))
+MEAL_LIBRARY_FRESH_MEALS = int(os.getenv('MEAL_LIBRARY_FRESH_MEALS', 2))
+
+# Per-stage timeouts in seconds, measured from when the stage starts
+STAGE_TIMEOUTS = {
+    'daily_targets': float(os.getenv('TARGETS_TIMEOUT', 30)),
+    'meal_plan': float(os.getenv('MEAL_PLAN_TIMEOUT', 120)),
+    'grocery_list': float(os.getenv('GROCERY_LIST_TIMEOUT', 60)),
+    'prep_tips': float(os.getenv('PREP_TIPS_TIMEOUT', 60)),
+}
+
+# A meal swap is one short completion
+SWAP_TIMEOUT = float(os.getenv('SWAP_TIMEOUT', 30))
+SWAP_MAX_TOKENS = int(os.getenv('SWAP_MAX_TOKENS', 300))
+
+# Meals that break the profile's allergies or diet are regenerated individually before the email goes out.
+# A plan that still breaks an allergy is stored but not emailed; meals that only break the diet are flagged.
+COMPLIANCE_ENABLED = os.getenv('COMPLIANCE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+COMPLIANCE_MAX_REPAIRS = int(os.getenv('COMPLIANCE_MAX_REPAIRS', 7))
+COMPLIANCE_REPAIR_ATTEMPTS = int(os.getenv('COMPLIANCE_REPAIR_ATTEMPTS', 2))
+
+# Days whose macros miss the daily targets by more than MACRO_TOLERANCE (relative) are regenerated, worst first.
+# The meal prompts carry the local targets, so with TARGETS_SOURCE=local this is the exception, not a routine call.
+MACRO_CHECK_ENABLED = os.getenv('MACRO_CHECK_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+MACRO_TOLERANCE = float(os.getenv('MACRO_TOLERANCE', 0.15))
+MACRO_MAX_DAYS = int(os.getenv('MACRO_MAX_DAYS', 2))
+
+# Local state (job queue, caches) lives here; must be shared by all gunicorn workers
+DATA_DIR = os.getenv('DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+
+# Everything below that keeps SQLite state in DATA_DIR is built on first use, so importing this module
+# (tooling, tests, the batch CLI) doesn't create or open any of it
+
+@functools.lru_cache(maxsize=None)
+def prompt_cache():
+    """Completions cached by normalized prompt, so identical questionnaire answers skip the model"""
+    return PromptCache(
+        os.path.join(DATA_DIR, 'prompt_cache.sqlite3'),
+        max_entries=int(os.getenv('PROMPT_CACHE_SIZE', 256)),
+        disk_max_entries=int(os.getenv('PROMPT_CACHE_DISK_SIZE', 5000)),
+        ttl=float(os.getenv('PROMPT_CACHE_TTL', 24 * 3600)),
+        enabled=os.getenv('PROMPT_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    )
+
+@functools.lru_cache(maxsize=None)
+def plan_store():
+    """Generated plans, so they can be re-rendered and resent without regenerating"""
+    return PlanStore(
+        os.path.join(DATA_DIR, 'plans.sqlite3'),
+        retention_seconds=float(os.getenv('PLAN_STORE_RETENTION', 30 * 24 * 3600)),
+        enabled=os.getenv('PLAN_STORE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    )
+
+@functools.lru_cache(maxsize=None)
+def meal_library():
+    """Complete meals of delivered plans, indexed for library mode; filled whatever the mode"""
+    return MealLibrary(
+        os.path.join(DATA_DIR, 'meal_library.sqlite3'),
+        max_meals=int(os.getenv('MEAL_LIBRARY_SIZE', 20000)),
+        refresh_interval=float(os.getenv('MEAL_LIBRARY_REFRESH', 60)),
+        enabled=os.getenv('MEAL_LIBRARY_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    )
+
+@functools.lru_cache(maxsize=None)
+def single_flight():
+    """Identical profiles generated at the same time share one set of LLM calls, across threads and workers"""
+    return SingleFlight(
+        os.path.join(DATA_DIR, 'flights.sqlite3'),
+        lease_seconds=float(os.getenv('COALESCING_LEASE', 300)),
+        is_cancellation=cancelled_stage_error,
+        enabled=os.getenv('COALESCING_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    )
+
+SCHEDULER_ENABLED = os.getenv('LLM_SCHEDULER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+@functools.lru_cache(maxsize=None)
+def llm_scheduler():
+    """Every worker shares one request/token budget and concurrency cap; interactive calls go first"""
+    return LLMScheduler(
+        SharedRateLimiter(
+            os.path.join(DATA_DIR, 'ratelimit.sqlite3'),
+            requests_per_minute=float(os.getenv('OPENAI_RPM', 3500)),
+            tokens_per_minute=float(os.getenv('OPENAI_TPM', 90000)),
+            max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', 16))
+        ),
+        max_queue=int(os.getenv('LLM_MAX_QUEUE', 32)),
+        max_retries=int(os.getenv('LLM_MAX_RETRIES', 4)),
+        backoff_base=float(os.getenv('LLM_BACKOFF_BASE', 1)),
+        backoff_max=float(os.getenv('LLM_BACKOFF_MAX', 30)),
+        batch_reserve=float(os.getenv('LLM_BATCH_RESERVE', 0.5)),
+        enabled=SCHEDULER_ENABLED
+    )
+
+BUSY_ERROR = "Error: Service busy, please try again shortly"
+CANCELLED_ERROR = "Error: Cancelled"
+
+# 'openai' (default), 'fake' for the local stand-in server (python -m bench.fake_openai),
+# 'replay' to serve recorded completions, 'record' to record misses from OpenAI
+llm_backend = create_backend(
+    os.getenv('LLM_BACKEND', 'openai'),
+    replay_path=os.getenv('LLM_REPLAY_PATH', os.path.join(DATA_DIR, 'llm_recordings.jsonl')),
+    base_url=os.getenv('LLM_BASE_URL'),
+    # The scheduler does the retrying, so the client shouldn't as well
+    max_retries=0 if SCHEDULER_ENABLED else None
+)
+
+# USD per 1K (prompt, completion) tokens, for the estimated cost counter
+OPENAI_PRICES = {
+    'gpt-3.5-turbo-16k': (0.003, 0.004),
+    'gpt-3.5-turbo': (0.0015, 0.002),
+    'gpt-4': (0.03, 0.06),
+    'gpt-4-1106-preview': (0.01, 0.03),
+}
+OPENAI_PRICE = (
+    float(os.getenv('OPENAI_PROMPT_PRICE_PER_1K', OPENAI_PRICES.get(OPENAI_MODEL, (0.0, 0.0))[0])),
+    float(os.getenv('OPENAI_COMPLETION_PRICE_PER_1K', OPENAI_PRICES.get(OPENAI_MODEL, (0.0, 0.0))[1]))
+)
+
+@functools.lru_cache(maxsize=None)
+def metrics():
+    """Aggregated across gunicorn workers through DATA_DIR; served on /metrics"""
+    registry = Metrics(
+        os.path.join(DATA_DIR, 'metrics.sqlite3'),
+        flush_interval=float(os.getenv('METRICS_FLUSH_INTERVAL', 5)),
+        enabled=os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    )
+    registry.histogram('eatreal_http_request_duration_seconds', 'Time to produce a response, by route and status')
+    registry.histogram('eatreal_stage_duration_seconds', 'Duration of each plan generation stage')
+    registry.histogram('eatreal_openai_request_duration_seconds', 'Duration of completions sent to the LLM backend')
+    registry.histogram('eatreal_openai_request_tokens', 'Tokens per completion', TOKEN_BUCKETS)
+    registry.counter('eatreal_openai_tokens_total', 'Tokens used, by model and type')
+    registry.counter('eatreal_openai_cost_usd_total', 'Estimated LLM spend in USD')
+    registry.counter('eatreal_prompt_cache_requests_total', 'Prompt cache lookups, by result')
+    registry.counter('eatreal_errors_total', 'Errors, by component')
+    registry.counter('eatreal_coalesced_stages_total', 'Stages served by an identical in-flight generation, by source')
+    registry.counter('eatreal_compliance_violations_total',
+                     'Meals breaking the profile\'s allergies or diet, by category')
+    registry.counter('eatreal_meal_repairs_total', 'Meals regenerated for allergies or diet, by outcome')
+    registry.counter('eatreal_macro_days_total', 'Plan days checked against the daily targets, by result')
+    registry.counter('eatreal_library_slots_total', 'Meal slots of library-mode plans, by source')
+    registry.histogram('eatreal_smtp_connect_duration_seconds', 'SMTP connect, STARTTLS and login time')
+    registry.histogram('eatreal_email_send_duration_seconds', 'Outbox delivery attempts, by outcome')
+    return registry
+
+# Sampled per-request traces, written as JSONL by a background thread
+tracer = Tracer(
+    os.getenv('TRACE_SINK', os.path.join(DATA_DIR, 'traces.jsonl')),
+    sample_rate=float(os.getenv('TRACE_SAMPLE_RATE', 0.01)),
+    capture_bytes=int(os.getenv('TRACE_CAPTURE_BYTES', 2048)),
+    enabled=os.getenv('TRACING_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+)
+TRACE_ID = re.compile(r'[0-9a-f]{16,32}')
+
 app = Flask(__name__)
 # Update CORS configuration to be more permissive
 CORS(app, resources={
@@ -134,38 +389,399 @@ CORS(app, resources={
     }
 })
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    # Callers can pass X-Trace-Id to join a trace, and X-Trace-Sampled: 1 to force sampling
+    trace_id = request.headers.get('X-Trace-Id', '').lower()
+    g.trace_span = tracer.start_trace(
+        f"{request.method} {request.path}",
+        trace_id=trace_id if TRACE_ID.fullmatch(trace_id) else None,
+        sampled=True if request.headers.get('X-Trace-Sampled') == '1' else None
+    )
+    g.trace_token = tracer.activate(g.trace_span)
+
+@app.after_request
+def record_request_metrics(response):
+    if 'request_started' in g and request.method != 'OPTIONS':
+        metrics().observe('eatreal_http_request_duration_seconds', time.perf_counter() - g.request_started,
+                          route=request.url_rule.rule if request.url_rule else 'unmatched',
+                          status=str(response.status_code))
+    if 'trace_span' in g:
+        response.headers['X-Trace-Id'] = g.trace_span.trace_id
+        g.trace_span.set(status=response.status_code)
+    return response
+
+@app.teardown_request
+def end_request_trace(error=None):
+    # Runs after a streamed response has finished, so the trace covers the whole stream
+    if 'trace_span' in g:
+        g.trace_span.end(error=error)
+        try:
+            tracer.deactivate(g.trace_token)
+        except ValueError:
+            pass
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics().render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/', methods=['GET', 'OPTIONS'])
 def root():
     if request.method == 'OPTIONS':
         return jsonify({"status": "ok"}), 200
-    return jsonify({"status": "healthy", "message": "API is running"})
+    return jsonify({"status": "healthy", "message": "API is running", "cache": prompt_cache().stats(),
+                    "scheduler": llm_scheduler().stats(), "coalescing": single_flight().stats(),
+                    "plans": plan_store().stats()})
+
+def busy_response():
+    """503 for requests turned away because the LLM queue is already too deep"""
+    metrics().inc('eatreal_errors_total', component='scheduler')
+    response = jsonify({"success": False, "error": BUSY_ERROR[len('Error: '):]})
+    response.headers['Retry-After'] = '1'
+    return response, 503
 
 @app.route('/api/generate-meal-plan', methods=['POST', 'OPTIONS'])
 def generate_meal_plan():
-    logger.debug(f"Request received: {request.method}")
-    logger.debug(f"Request headers: {dict(request.headers)}")
-    
     if request.method == 'OPTIONS':
-        logger.debug("Handling OPTIONS request")
         return jsonify({"status": "ok"}), 200
         
     try:
-        logger.debug(f"Request body: {request.get_data()}")
         data = request.json
-        logger.debug(f"Parsed JSON data: {data}")
-        
         user_profile = data.get('userProfile', {})
         user_email = data.get('email')
-        logger.debug(f"User profile: {user_profile}")
-        logger.debug(f"User email: {user_email}")
-        
-        # Generate each component separately with appropriate token limits
-        daily_targets = get_openai_response(targets_prompt, max_tokens=500)
-        if daily_targets.startswith('Error:'):
-            return jsonify({"success": False, "error": daily_targets}), 500
+        trace_request(user_profile)
+
+        validation_error = validate_meal_plan_request(user_profile, user_email)
+        if validation_error:
+            return jsonify({"success": False, "error": validation_error}), 400
+
+        plan_id = uuid.uuid4().hex
+
+        # Job mode: accept immediately and generate in the background worker pool
+        if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+            try:
+                job_id = job_queue().enqueue({"userProfile": user_profile, "email": user_email, "plan_id": plan_id,
+                                              "trace_id": g.trace_span.trace_id, "trace_sampled": g.trace_span.sampled})
+            except QueueFullError as e:
+                return jsonify({"success": False, "error": str(e)}), 503
+            return jsonify({
+                "success": True,
+                "job_id": job_id,
+                "plan_id": plan_id,
+                "status_url": f"/api/jobs/{job_id}"
+            }), 202
+
+        if llm_scheduler().overloaded():
+            return busy_response()
+        plan, error, unresolved = deliver_meal_plan(user_profile, user_email, plan_id=plan_id)
+        if error == BUSY_ERROR:
+            return busy_response()
+        if error:
+            # A plan that was generated but not emailed is stored and can be resent
+            return jsonify({"success": False, "error": error, **plan_reference(plan, plan_id),
+                            **unresolved_reference(unresolved)}), 500
+        return jsonify({"success": True, "plan": plan.to_dict(), **plan_reference(plan, plan_id),
+                        **unresolved_reference(unresolved)})
+
+    except Exception as e:
+        logger.error(f"Error in generate_meal_plan: {str(e)}")
+        logger.error(f"Error traceback: {traceback.format_exc()}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET', 'OPTIONS'])
+def get_job_status(job_id):
+    if request.method == 'OPTIONS':
+        return jsonify({"status": "ok"}), 200
+
+    job_queue().start()
+    job = job_queue().get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+    return jsonify({"success": True, "job": job})
+
+@app.route('/api/meal-plan/<plan_id>', methods=['GET', 'OPTIONS'])
+def get_meal_plan(plan_id):
+    """A stored plan as JSON, or as the email's HTML with ?format=html"""
+    if request.method == 'OPTIONS':
+        return jsonify({"status": "ok"}), 200
+
+    stored = plan_store().get(plan_id)
+    if stored is None:
+        return jsonify({"success": False, "error": "Plan not found"}), 404
+    if request.args.get('format') == 'html' or (request.args.get('format') is None and
+                                                 request.accept_mimetypes.best == 'text/html'):
+        return Response(email_template.render_html(stored.profile, html_sections(stored.plan)),
+                        mimetype='text/html')
+    # Deferred: api.macros pulls in numpy
+    from api.macros import verify_plan
+    return jsonify({"success": True, "plan_id": stored.id, "created_at": stored.created_at,
+                    "plan": stored.plan.to_dict(), "macros": verify_plan(stored.plan, MACRO_TOLERANCE)})
+
+@app.route('/api/meal-plan/<plan_id>/resend', methods=['POST', 'OPTIONS'])
+def resend_meal_plan(plan_id):
+    """Email a stored plan again to the address it was generated for, without regenerating"""
+    if request.method == 'OPTIONS':
+        return jsonify({"status": "ok"}), 200
+
+    stored = plan_store().get(plan_id)
+    if stored is None:
+        return jsonify({"success": False, "error": "Plan not found"}), 404
+    if not stored.email:
+        return jsonify({"success": False, "error": "Plan has no email address"}), 400
+    if not send_plan_email(stored.email, stored.profile, stored.plan):
+        return jsonify({"success": False, "error": "Failed to send email"}), 500
+    return jsonify({"success": True, "plan_id": stored.id})
+
+@app.route('/api/meal-plan/<plan_id>/swap', methods=['POST', 'OPTIONS'])
+def swap_meal(plan_id):
+    """Regenerate one meal of a stored plan: {"day": 3, "slot": "Dinner", "note": optional, "resend": optional}"""
+    if request.method == 'OPTIONS':
+        return jsonify({"status": "ok"}), 200
+
+    data = request.get_json(silent=True) or {}
+    slot = normalize_slot(data.get('slot'))
+    if slot is None:
+        return jsonify({"success": False, "error": f"slot must be one of {', '.join(MEAL_SLOTS)}"}), 400
+    try:
+        day_number = int(data.get('day'))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "day must be a day number"}), 400
+    note = data.get('note')
+    if note is not None and (not isinstance(note, str) or len(note) > 200):
+        return jsonify({"success": False, "error": "note must be a string of at most 200 characters"}), 400
+
+    stored = plan_store().get(plan_id)
+    if stored is None:
+        return jsonify({"success": False, "error": "Plan not found"}), 404
+    day = next((day for day in stored.plan.days if day.number == day_number), None)
+    if day is None:
+        return jsonify({"success": False, "error": f"Plan has no day {day_number}"}), 400
+    if llm_scheduler().overloaded():
+        return busy_response()
+
+    budget = macro_budget(stored.plan, day, slot)
+    restrictions = profile_restrictions(stored.profile) if COMPLIANCE_ENABLED else None
+    exclude = []
+    for attempt in range(max(COMPLIANCE_REPAIR_ATTEMPTS, 1)):
+        meal = generate_swap_meal(stored.profile, stored.plan, day, slot, budget, note, exclude, attempt)
+        violations = check_meal(meal, restrictions, day_number) if restrictions and not isinstance(meal, str) else []
+        if not violations:
+            break
+        exclude += [(violation.term, violation.reason) for violation in violations]
+    else:
+        metrics().inc('eatreal_meal_repairs_total', outcome='failed')
+        return jsonify({"success": False, "error": "Could not create a meal that fits the profile's restrictions",
+                        "violations": [violation.to_dict() for violation in violations]}), 502
+    if isinstance(meal, str):
+        if meal == BUSY_ERROR:
+            return busy_response()
+        return jsonify({"success": False, "error": meal}), 502
+    old, added, removed = replace_meal(stored.plan, day, meal)
+    if plan_store().update(stored, stored.plan) is None:
+        return jsonify({"success": False, "error": "Plan was changed by another request, please retry"}), 409
+
+    response = {"success": True, "plan_id": stored.id, "day": day_number, "meal": meal.to_dict(),
+                "replaced": old.to_dict() if old else None, "budget": budget,
+                "grocery_changes": {"added": added, "removed": removed}, "plan": stored.plan.to_dict()}
+    if data.get('resend'):
+        response["emailed"] = bool(stored.email) and send_plan_email(stored.email, stored.profile, stored.plan)
+    return jsonify(response)
+
+@app.route('/api/generate-meal-plan/stream', methods=['POST', 'OPTIONS'])
+def stream_meal_plan():
+    """Server-Sent Events variant of generate_meal_plan that renders days as they arrive"""
+    if request.method == 'OPTIONS':
+        return jsonify({"status": "ok"}), 200
 
-        # Add user profile context to meal plan prompt
-        personalized_meal_plan_prompt = f"""
+    data = request.json or {}
+    user_profile = data.get('userProfile', {})
+    user_email = data.get('email')
+    trace_request(user_profile)
+    validation_error = validate_meal_plan_request(user_profile, user_email)
+    if validation_error:
+        return jsonify({"success": False, "error": validation_error}), 400
+    if llm_scheduler().overloaded():
+        return busy_response()
+
+    return Response(
+        stream_with_context(stream_meal_plan_events(user_profile, user_email)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def stream_meal_plan_events(user_profile, user_email):
+    """Yield SSE events for the whole pipeline, ending with a done or error event.
+
+    Targets and prep tips run in the background while the meal plan streams;
+    the grocery list still needs the full plan so it runs after the stream.
+    """
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="stream")
+    background = {
+        'daily_targets': executor.submit(contextvars.copy_context().run, get_daily_targets, user_profile,
+                                         STAGE_TIMEOUTS['daily_targets']),
+        'prep_tips': executor.submit(contextvars.copy_context().run, get_openai_response, prep_tips_prompt, 1000,
+                                     STAGE_TIMEOUTS['prep_tips']),
+    }
+    parsers = {'daily_targets': parse_daily_targets, 'prep_tips': parse_prep_tips}
+    renderers = {'daily_targets': render_targets_html, 'prep_tips': render_tips_html}
+    results = {}
+
+    def finished_background(block=False):
+        for name, future in list(background.items()):
+            if block or future.done():
+                result = future.result(timeout=STAGE_TIMEOUTS[name] if block else None)
+                del background[name]
+                if result.startswith('Error:'):
+                    raise StageError(name, result)
+                results[name] = parsers[name](result)
+                yield sse_event(name, {"html": renderers[name](results[name])})
+
+    formatter = MealPlanStreamFormatter()
+    try:
+        yield sse_event('start', {"stages": ['daily_targets', 'meal_plan', 'grocery_list', 'prep_tips']})
+
+        deadline = time.monotonic() + STAGE_TIMEOUTS['meal_plan']
+        parts = []
+        for chunk in get_openai_stream(build_meal_plan_prompt(user_profile), 5000, STAGE_TIMEOUTS['meal_plan']):
+            parts.append(chunk)
+            for event, payload in formatter.feed(chunk):
+                yield sse_event(event, payload)
+            yield from finished_background()
+            if time.monotonic() > deadline:
+                raise StageError('meal_plan', f"Stage meal_plan timed out after {STAGE_TIMEOUTS['meal_plan']}s")
+        for event, payload in formatter.close():
+            yield sse_event(event, payload)
+        meal_plan = "".join(parts).strip()
+
+        with metrics().timer('eatreal_stage_duration_seconds', stage='grocery_list'):
+            grocery_list = get_grocery_list(meal_plan, STAGE_TIMEOUTS['grocery_list'], days=formatter.days)
+        if grocery_list.startswith('Error:'):
+            raise StageError('grocery_list', grocery_list)
+        grocery = parse_grocery_list(grocery_list)
+        yield from finished_background(block=True)
+
+        # The days were parsed while streaming; the email is rendered from those records
+        plan = Plan(results['daily_targets'], formatter.days, grocery, results['prep_tips'])
+        # Rebalanced days and days with repaired or flagged meals are sent again and replace the ones already shown
+        changed, unresolved, shed = review_plan(plan, user_profile)
+        for day in plan.days:
+            if day.number in changed:
+                yield sse_event('day', {"day": day.title, "html": render_day_html(day)})
+        yield sse_event('grocery_list', {"html": render_grocery_html(plan.grocery)})
+        plan_id = uuid.uuid4().hex
+        store_plan(plan_id, plan, user_profile, user_email)
+        error = compliance_error(unresolved, shed)
+        if error is None and not send_plan_email(user_email, user_profile, plan):
+            error = "Failed to send email"
+        if error:
+            yield sse_event('error', {"success": False, "error": error, **plan_reference(plan, plan_id),
+                                      **unresolved_reference(unresolved)})
+            return
+        yield sse_event('done', {"success": True, **plan_reference(plan, plan_id), **unresolved_reference(unresolved)})
+
+    except StageError as e:
+        metrics().inc('eatreal_errors_total', component=e.stage)
+        yield sse_event('error', {"success": False, "error": e.message})
+    except Exception as e:
+        logger.error(f"Error in stream_meal_plan: {str(e)}")
+        logger.error(f"Error traceback: {traceback.format_exc()}")
+        yield sse_event('error', {"success": False, "error": str(e)})
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def trace_request(user_profile, body_bytes=None):
+    """Non-identifying request attributes for the active trace"""
+    span = tracer.current()
+    if span is not None and span.sampled and isinstance(user_profile, dict):
+        span.set(goal=user_profile.get('goal'), diet=user_profile.get('diet_preference'),
+                 allergies=user_profile.get('allergies'),
+                 body_bytes=request.content_length if body_bytes is None else body_bytes)
+
+def validate_meal_plan_request(user_profile, user_email):
+    """Return an error message if the request can't be processed, otherwise None"""
+    if not isinstance(user_profile, dict):
+        return "userProfile must be an object"
+    if not user_email or '@' not in str(user_email):
+        return "A valid email address is required"
+    return None
+
+def plan_reference(plan, plan_id):
+    """``plan_id`` for responses, when the plan was generated and stored"""
+    return {"plan_id": plan_id} if plan is not None and plan_store().enabled else {}
+
+def store_plan(plan_id, plan, user_profile, user_email):
+    """Save a reviewed plan under ``plan_id`` and add its meals to the meal library"""
+    plan_store().save(plan_id, plan, user_profile, user_email)
+    meal_library().add_plan(plan, user_profile)
+
+def deliver_meal_plan(user_profile, user_email, on_progress=None, plan_id=None):
+    """Generate the full plan, store it under ``plan_id`` and email it.
+
+    Returns (plan, error message or None, violations the plan still has). A
+    plan that still breaks an allergy is stored but not emailed.
+    """
+    try:
+        plan = generate_plan(user_profile, on_progress=on_progress)
+    except StageError as e:
+        metrics().inc('eatreal_errors_total', component=e.stage)
+        return None, e.message, []
+
+    _, unresolved, shed = review_plan(plan, user_profile)
+    if plan_id:
+        store_plan(plan_id, plan, user_profile, user_email)
+    error = compliance_error(unresolved, shed)
+    if error:
+        return plan, error, unresolved
+    if not send_plan_email(user_email, user_profile, plan):
+        return plan, "Failed to send email", unresolved
+    if on_progress:
+        on_progress('email')
+    return plan, None, unresolved
+
+async def adeliver_meal_plan(user_profile, user_email, on_progress=None, plan_id=None):
+    """``deliver_meal_plan`` for the ASGI app"""
+    try:
+        plan = await agenerate_plan(user_profile, on_progress=on_progress)
+    except StageError as e:
+        metrics().inc('eatreal_errors_total', component=e.stage)
+        return None, e.message, []
+
+    # Usually sub-millisecond checks; the thread is for the regeneration calls they may trigger
+    _, unresolved, shed = await asyncio.to_thread(review_plan, plan, user_profile)
+    if plan_id:
+        await asyncio.to_thread(store_plan, plan_id, plan, user_profile, user_email)
+    error = compliance_error(unresolved, shed)
+    if error:
+        return plan, error, unresolved
+    # Rendering and the outbox insert are short, but synchronous
+    if not await asyncio.to_thread(send_plan_email, user_email, user_profile, plan):
+        return plan, "Failed to send email", unresolved
+    if on_progress:
+        on_progress('email')
+    return plan, None, unresolved
+
+def process_meal_plan_job(payload, report):
+    """Job queue handler: run the pipeline and report each finished stage"""
+    completed = []
+
+    def on_progress(stage):
+        completed.append(stage)
+        report({"completed": completed, "total": len(STAGE_TIMEOUTS) + 1})
+
+    # Continues the trace of the request that queued the job; queued jobs yield to interactive requests
+    with tracer.trace('job meal_plan', trace_id=payload.get('trace_id'), sampled=payload.get('trace_sampled')), \
+            priority_scope(BATCH):
+        _, error, _ = deliver_meal_plan(payload['userProfile'], payload['email'], on_progress=on_progress,
+                                        plan_id=payload.get('plan_id'))
+    if error:
+        # Includes plans that still break an allergy; the queue retries the job (JOB_MAX_ATTEMPTS in all)
+        # and then marks it failed
+        raise RuntimeError(error)
+
+def build_profile_context(user_profile):
+    """Profile block shared by the full-week and per-day meal plan prompts"""
+    return f"""
         Based on a profile of:
         - Goal: {user_profile.get('goal', '').replace('_', ' ')}
         - Gender: {user_profile.get('gender', '')}
@@ -178,9 +794,10 @@ def generate_meal_plan():
         - Allergies: {user_profile.get('allergies', '')}
         - Cooking Time: {user_profile.get('cooking_time', '')}
         - Meal Prep: {user_profile.get('meal_prep', '')}
+"""
 
-        {meal_plan_prompt}
-
+def build_profile_requirements(user_profile):
+    return f"""
         Make sure each meal:
         1. Supports their {user_profile.get('goal', '').replace('_', ' ')} goal
         2. Fits within their {user_profile.get('cooking_time', '')} cooking time preference
@@ -189,367 +806,739 @@ def generate_meal_plan():
         5. Includes meal prep suggestions if they selected 'yes'
 """
 
-        meal_plan = get_openai_response(personalized_meal_plan_prompt, max_tokens=5000)
-        if meal_plan.startswith('Error:'):
-            return jsonify({"success": False, "error": meal_plan}), 500
-
-        # Only generate grocery list if meal plan was successful
-        grocery_list = get_openai_response(
-            f"Based on this meal plan, create a categorized grocery list:\n{meal_plan}\n\n"
-            "Format as:\nPRODUCE:\n- [item] (quantity)\nPROTEINS:\n- [item] (quantity)\n"
-            "PANTRY:\n- [item] (quantity)",
-            max_tokens=1000
-        )
-        if grocery_list.startswith('Error:'):
-            return jsonify({"success": False, "error": grocery_list}), 500
-
-        # Generate prep tips
-        prep_tips = get_openai_response(
-            "Create 5 specific meal prep tips for this meal plan. "
-            "Format each tip on a new line starting with a number. "
-            "Focus on time-saving and storage tips.",
-            max_tokens=1000
-        )
-        if prep_tips.startswith('Error:'):
-            return jsonify({"success": False, "error": prep_tips}), 500
-
-        # Generate email content
-        html_content = generate_html_email(
-            daily_targets=daily_targets,
-            meal_plan=meal_plan,
-            grocery_list=grocery_list,
-            prep_tips=prep_tips,
-            user_profile=user_profile
-        )
-
-        if send_email(user_email, html_content):
-            return jsonify({"success": True})
+def build_targets_requirement(user_profile):
+    """The local daily targets for meal prompts, so days are written to them rather than rebalanced afterwards.
+
+    Empty when TARGETS_SOURCE=llm, since those targets come from a call that runs alongside the meal plan.
+    """
+    if TARGETS_SOURCE == 'llm':
+        return ""
+    # Deferred: api.targets pulls in numpy
+    from api.targets import daily_targets_text
+    return ("Use exactly these daily targets, and plan each day's meals to add up to them:\n"
+            f"{daily_targets_text(user_profile)}\n")
+
+def build_meal_plan_prompt(user_profile):
+    """Add user profile context and the daily targets to the meal plan prompt"""
+    return f"""{build_profile_context(user_profile)}
+        {meal_plan_prompt}{build_targets_requirement(user_profile)}
+{build_profile_requirements(user_profile)}"""
+
+def build_day_prompt(user_profile, day_numbers, theme):
+    """Prompt for one day (or a small group of days) of the per-day generation mode"""
+    days = ", ".join(f"DAY {number}" for number in day_numbers)
+    return f"""{build_profile_context(user_profile)}
+        {day_plan_prompt.format(days=days, theme=theme)}{build_targets_requirement(user_profile)}
+{build_profile_requirements(user_profile)}"""
+
+def generate_meal_plan_per_day(user_profile):
+    """Meal plan text assembled from concurrent per-day completions"""
+    def complete(prompt, day_numbers, seed):
+        response = get_openai_response(prompt, max_tokens=PER_DAY_MAX_TOKENS * len(day_numbers),
+                                       timeout=STAGE_TIMEOUTS['meal_plan'], seed=seed)
+        if response.startswith('Error:'):
+            raise StageError('meal_plan', response)
+        return response
+
+    days = generate_days(
+        lambda day_numbers, theme: build_day_prompt(user_profile, day_numbers, theme),
+        complete,
+        group_size=int(os.getenv('MEAL_PLAN_DAYS_PER_REQUEST', 1)),
+        timeout=STAGE_TIMEOUTS['meal_plan']
+    )
+    return render_model_text(days)
+
+def generate_meal_plan_from_library(user_profile):
+    """Meal plan text assembled from the meal library, with the model writing only the slots it can't fill"""
+    # Deferred: api.meal_index and api.targets pull in numpy
+    from api.meal_index import assemble_days, gap_budgets
+    from api.targets import daily_targets_text
+
+    # Meals are picked against the local targets whatever TARGETS_SOURCE says
+    targets = parse_daily_targets(daily_targets_text(user_profile))
+    with tracer.span('library_assembly') as span:
+        index = meal_library().index()
+        days, gaps = assemble_days(index, target_grams(targets), profile_restrictions(user_profile),
+                                   cooking_level(user_profile.get('cooking_time')), tolerance=MACRO_TOLERANCE,
+                                   choices=MEAL_LIBRARY_CHOICES, fresh=MEAL_LIBRARY_FRESH_MEALS,
+                                   seed=int(profile_key(user_profile)[:8], 16))
+        span.set(library_meals=len(index), gaps=len(gaps))
+    if len(gaps) > MEAL_LIBRARY_MAX_GAPS:
+        metrics().inc('eatreal_library_slots_total', len(days) * len(MEAL_SLOTS), source='fallback')
+        return generate_meal_plan_per_day(user_profile)
+
+    plan = Plan(targets, days)
+    by_number = {day.number: day for day in days}
+    budgets = {number: gap_budgets(day, target_grams(targets)) for number, day in by_number.items()}
+    pending = gaps
+    for attempt in range(2):
+        if not pending:
+            break
+        stages = [Stage(f"gap_{number}_{slot}",
+                        lambda number=number, slot=slot, attempt=attempt: generate_swap_meal(
+                            user_profile, plan, by_number[number], slot, budgets[number][slot], attempt=attempt),
+                        timeout=SWAP_TIMEOUT)
+                  for number, slot in pending]
+        results = run_stages(stages)
+        failed = []
+        for stage, (number, slot) in zip(stages, pending):
+            meal = results[stage.name]
+            if isinstance(meal, str):
+                failed.append((number, slot))
+            else:
+                replace_meal(plan, by_number[number], meal)
+        pending = failed
+    if pending:
+        raise StageError('meal_plan', f"Could not fill {len(pending)} meals missing from the library")
+    metrics().inc('eatreal_library_slots_total', len(days) * len(MEAL_SLOTS) - len(gaps), source='library')
+    metrics().inc('eatreal_library_slots_total', len(gaps), source='model')
+    return render_model_text(plan.days)
+
+def build_grocery_list_prompt(meal_plan):
+    """Prompt for a categorized grocery list based on a generated meal plan"""
+    return (
+        f"Based on this meal plan, create a categorized grocery list:\n{meal_plan}\n\n"
+        "Format as:\nPRODUCE:\n- [item] (quantity)\nPROTEINS:\n- [item] (quantity)\n"
+        "PANTRY:\n- [item] (quantity)"
+    )
+
+def build_swap_prompt(user_profile, plan, day, slot, budget=None, note=None, exclude=()):
+    """Prompt for a single replacement meal; only names of the other meals are sent, not the plan.
+
+    ``exclude`` is a list of (ingredient, reason) pairs a previous attempt got wrong.
+    """
+    current = day.meal(slot)
+    avoid = [meal.name for meal in day.meals if meal.name and meal.slot != slot]
+    avoid += [other.meal(slot).name for other in plan.days if other.meal(slot) and other.meal(slot).name]
+    budget_line = note_line = exclude_line = ""
+    if budget:
+        budget_line = (f"Aim for about {budget['protein']}g protein, {budget['carbs']}g carbs and "
+                       f"{budget['fats']}g fats, so the day still meets its targets.\n")
+    if note:
+        note_line = f"They asked for: {note.strip()}\n"
+    if exclude:
+        exclude_line = ("It must not contain " + ", ".join(f"{term} ({reason})" for term, reason in exclude) +
+                        ", not even as a garnish or in a sauce.\n")
+    prompt = swap_meal_prompt.format(slot=slot, day=day.number, current=current.name if current else "nothing",
+                                     avoid="; ".join(dict.fromkeys(avoid)) or "none", budget=budget_line,
+                                     exclude=exclude_line, note=note_line)
+    return f"""{build_profile_context(user_profile)}
+        {prompt}
+{build_profile_requirements(user_profile)}"""
+
+def generate_swap_meal(user_profile, plan, day, slot, budget=None, note=None, exclude=(), attempt=0):
+    """The replacement Meal, or an "Error: ..." string; retries skip the cache and use a new seed"""
+    response = get_openai_response(build_swap_prompt(user_profile, plan, day, slot, budget, note, exclude),
+                                   max_tokens=SWAP_MAX_TOKENS, timeout=SWAP_TIMEOUT, use_cache=attempt == 0,
+                                   seed=attempt or None)
+    if response.startswith('Error:'):
+        metrics().inc('eatreal_errors_total', component='swap')
+        return response
+    # Parsed with the plan parser, under a header for the day being patched
+    lines = response.strip().splitlines()
+    if lines and lines[0].strip().rstrip(':').lower() == slot.lower():
+        lines = lines[1:]
+    parsed = parse_meal_plan("\n".join([f"DAY {day.number}:", slot] + lines))
+    meal = parsed[0].meal(slot) if parsed else None
+    if meal is None or not meal.name or not meal.description or not meal.has_macros:
+        metrics().inc('eatreal_errors_total', component='swap')
+        return "Error: The model did not return a complete meal"
+    return meal
+
+def build_rebalance_prompt(user_profile, day_number, targets):
+    """Per-day prompt for one day, with the totals its meals must add up to"""
+    theme = CUISINE_THEMES[(day_number - 1) % len(CUISINE_THEMES)]
+    return (f"{build_day_prompt(user_profile, [day_number], theme)}\n"
+            f"        The four meals of DAY {day_number} must add up to about {targets['calories']} kcal: "
+            f"{targets['protein']}g protein, {targets['carbs']}g carbs and {targets['fats']}g fats.\n")
+
+def rebalance_plan(plan, user_profile):
+    """Regenerate the days whose macros are furthest off the daily targets; returns their numbers"""
+    if not MACRO_CHECK_ENABLED:
+        return []
+    # Deferred: api.macros pulls in numpy
+    from api.macros import rebalance_days
+
+    def generate_day(day_number, targets):
+        response = get_openai_response(build_rebalance_prompt(user_profile, day_number, targets),
+                                       max_tokens=PER_DAY_MAX_TOKENS, timeout=STAGE_TIMEOUTS['meal_plan'])
+        if response.startswith('Error:'):
+            raise ValueError(response)
+        days = parse_meal_plan(response)
+        return days[0] if days else None
+
+    with tracer.span('macro_check') as span:
+        report, replaced = rebalance_days(plan, generate_day, tolerance=MACRO_TOLERANCE, max_days=MACRO_MAX_DAYS,
+                                          timeout=STAGE_TIMEOUTS['meal_plan'])
+        span.set(off_target=len(report['off_target']), rebalanced=len(replaced))
+    metrics().inc('eatreal_macro_days_total', len(report['days']) - len(report['off_target']), result='within')
+    metrics().inc('eatreal_macro_days_total', len(report['off_target']), result='off_target')
+    metrics().inc('eatreal_macro_days_total', len(replaced), result='rebalanced')
+    return replaced
+
+def review_plan(plan, user_profile):
+    """Rebalance off-target days, then repair meals that break the profile's restrictions.
+
+    Runs before a plan is stored or emailed. Returns (numbers of the days
+    that changed, violations still in the plan, (day, slot) pairs whose
+    repair was shed); see ``compliance_error`` for what blocks delivery.
+    """
+    changed = set(rebalance_plan(plan, user_profile))
+    violations, unresolved, shed = enforce_compliance(plan, user_profile)
+    changed.update(violation.day for violation in violations)
+    return changed, unresolved, shed
+
+def enforce_compliance(plan, user_profile):
+    """Check every meal against the profile's allergies and diet and regenerate only the ones that break them.
+
+    Patches ``plan`` in place and returns (violations found, violations
+    still in the plan, (day, slot) pairs whose repair the scheduler shed).
+    Meals that keep a violation get a ``warning`` the email shows.
+    """
+    if not COMPLIANCE_ENABLED:
+        return [], [], []
+    restrictions = profile_restrictions(user_profile)
+    with tracer.span('compliance_check'):
+        violations = check_plan(plan, restrictions)
+    if not violations:
+        return violations, [], []
+    for violation in violations:
+        metrics().inc('eatreal_compliance_violations_total',
+                      category='OTHER' if violation.category.startswith('allergy:') else violation.category)
+
+    def generate(day, slot, exclude, attempt):
+        meal = generate_swap_meal(user_profile, plan, day, slot, macro_budget(plan, day, slot),
+                                  exclude=exclude, attempt=attempt)
+        if meal == BUSY_ERROR:
+            raise RepairShed(meal)
+        if isinstance(meal, str):
+            raise ValueError(meal)
+        return meal
+
+    with tracer.span('compliance_repair') as span:
+        span.set(violations=len(violations))
+        repaired, unresolved, shed = repair_meals(plan, restrictions, violations, generate,
+                                                  max_meals=COMPLIANCE_MAX_REPAIRS,
+                                                  max_attempts=COMPLIANCE_REPAIR_ATTEMPTS, timeout=SWAP_TIMEOUT)
+        remaining = check_plan(plan, restrictions) if unresolved else []
+        span.set(repaired=len(repaired), unresolved=len(unresolved), shed=len(shed))
+    # Meals past COMPLIANCE_MAX_REPAIRS aren't tried
+    skipped = max(0, len(flagged_meals(violations)) - COMPLIANCE_MAX_REPAIRS)
+    metrics().inc('eatreal_meal_repairs_total', len(repaired), outcome='repaired')
+    metrics().inc('eatreal_meal_repairs_total', len(unresolved) - len(shed) - skipped, outcome='failed')
+    metrics().inc('eatreal_meal_repairs_total', len(shed), outcome='shed')
+    metrics().inc('eatreal_meal_repairs_total', skipped, outcome='skipped')
+    days = {day.number: day for day in plan.days}
+    for (day_number, slot), warning in meal_warnings(remaining).items():
+        days[day_number].meal(slot).warning = warning
+    return violations, remaining, shed
+
+def compliance_error(unresolved, shed):
+    """Error message for a plan that still breaks an allergy (it isn't emailed), or None.
+
+    ``BUSY_ERROR`` when every such meal's repair was shed, so the caller
+    answers as it does for any overload and the user can retry.
+    """
+    allergens = [violation for violation in unresolved if violation.allergen]
+    if not allergens:
+        return None
+    metrics().inc('eatreal_errors_total', component='compliance')
+    if all((violation.day, violation.slot) in shed for violation in allergens):
+        return BUSY_ERROR
+    # "day 1 Snacks contains almond butter (nuts allergy)"
+    meals = ", ".join(f"day {day} {slot} {warning[0].lower()}{warning[1:]}"
+                      for (day, slot), warning in meal_warnings(allergens).items())
+    return f"Could not replace meals that break the profile's allergies: {meals}"
+
+def unresolved_reference(unresolved):
+    """``unresolved`` for responses: the violations a delivered or stored plan still has"""
+    return {"unresolved": [violation.to_dict() for violation in unresolved]} if unresolved else {}
+
+def openai_stage(name, build_prompt, max_tokens, deps=()):
+    """Pipeline stage for a single OpenAI call, raising StageError on an error response"""
+    timeout = STAGE_TIMEOUTS[name]
+
+    def run(**results):
+        response = get_openai_response(build_prompt(**results), max_tokens=max_tokens, timeout=timeout)
+        if response.startswith('Error:'):
+            raise StageError(name, response)
+        return response
+
+    return Stage(name, run, deps=deps, timeout=timeout)
+
+def aopenai_stage(name, build_prompt, max_tokens, deps=()):
+    """``openai_stage`` for the async pipeline"""
+    timeout = STAGE_TIMEOUTS[name]
+
+    async def run(**results):
+        response = await aget_openai_response(build_prompt(**results), max_tokens=max_tokens, timeout=timeout)
+        if response.startswith('Error:'):
+            raise StageError(name, response)
+        return response
+
+    return Stage(name, run, deps=deps, timeout=timeout)
+
+def timed_stage(stage):
+    """Record the stage's duration in the stage histogram"""
+    func = stage.func
+
+    def run(**results):
+        with tracer.span(f"stage {stage.name}"), metrics().timer('eatreal_stage_duration_seconds', stage=stage.name):
+            return func(**results)
+
+    async def arun(**results):
+        with tracer.span(f"stage {stage.name}"), metrics().timer('eatreal_stage_duration_seconds', stage=stage.name):
+            return await func(**results)
+
+    stage.func = arun if asyncio.iscoroutinefunction(func) else run
+    return stage
+
+def cancelled_stage_error(error):
+    """True for a stage that stopped because its own request gave up, not because generation failed"""
+    return isinstance(error, CallCancelled) or (isinstance(error, StageError) and error.message == CANCELLED_ERROR)
+
+def coalesced_stage(stage, flight_key):
+    """Share the stage's result with identical generations already in flight.
+
+    The key covers the stage's dependency results too, so a coalesced grocery
+    list always belongs to the meal plan this request got.
+    """
+    func = stage.func
+
+    def flight(results):
+        deps = hashlib.sha256("\0".join(results[dep] for dep in stage.deps).encode('utf-8')).hexdigest()
+        return f"{stage.name}:{flight_key}:{deps}"
+
+    def shared_result(result, shared):
+        if shared:
+            metrics().inc('eatreal_coalesced_stages_total', stage=stage.name, source=shared)
+        return result
+
+    def run(**results):
+        try:
+            return shared_result(*single_flight().do(flight(results), lambda: func(**results), timeout=stage.timeout))
+        except FlightError as e:
+            raise StageError(stage.name, str(e))
+
+    async def arun(**results):
+        try:
+            return shared_result(*await single_flight().ado(flight(results), lambda: func(**results),
+                                                            timeout=stage.timeout))
+        except FlightError as e:
+            raise StageError(stage.name, str(e))
+
+    stage.func = arun if asyncio.iscoroutinefunction(func) else run
+    return stage
+
+def generate_plan_components(user_profile, on_progress=None):
+    """Generate targets, meal plan, grocery list and prep tips concurrently.
+
+    Targets, the meal plan and the prep tips don't depend on each other, so
+    they run in parallel; only the grocery list waits for the meal plan.
+    """
+    def daily_targets():
+        targets = get_daily_targets(user_profile, STAGE_TIMEOUTS['daily_targets'])
+        if targets.startswith('Error:'):
+            raise StageError('daily_targets', targets)
+        return targets
+
+    def grocery_list(meal_plan):
+        groceries = get_grocery_list(meal_plan, STAGE_TIMEOUTS['grocery_list'])
+        if groceries.startswith('Error:'):
+            raise StageError('grocery_list', groceries)
+        return groceries
+
+    flight_key = f"{profile_key(user_profile)}:{MEAL_PLAN_MODE}:{TARGETS_SOURCE}"
+    return run_stages([timed_stage(coalesced_stage(stage, flight_key)) for stage in (
+        Stage('daily_targets', daily_targets, timeout=STAGE_TIMEOUTS['daily_targets']),
+        Stage('meal_plan', lambda: generate_meal_plan_per_day(user_profile), timeout=STAGE_TIMEOUTS['meal_plan'])
+        if MEAL_PLAN_MODE == 'per_day' else
+        Stage('meal_plan', lambda: generate_meal_plan_from_library(user_profile),
+              timeout=STAGE_TIMEOUTS['meal_plan'])
+        if MEAL_PLAN_MODE == 'library' else
+        openai_stage('meal_plan', lambda: build_meal_plan_prompt(user_profile), 5000),
+        Stage('grocery_list', grocery_list, deps=['meal_plan'], timeout=STAGE_TIMEOUTS['grocery_list']),
+        openai_stage('prep_tips', lambda: prep_tips_prompt, 1000),
+    )], on_complete=on_progress)
+
+async def agenerate_plan_components(user_profile, on_progress=None):
+    """``generate_plan_components`` on the event loop, for the ASGI app.
+
+    Completions are awaited on the shared async client. Work that is local
+    or still thread based (per-day and library generation, local grocery
+    aggregation with its classification fallback) runs in the default
+    thread pool.
+    """
+    async def daily_targets():
+        if TARGETS_SOURCE == 'llm':
+            targets = await aget_openai_response(targets_prompt, max_tokens=500,
+                                                 timeout=STAGE_TIMEOUTS['daily_targets'])
         else:
-            return jsonify({"success": False, "error": "Failed to send email"}), 500
+            from api.targets import daily_targets_text
+            targets = daily_targets_text(user_profile)
+        if targets.startswith('Error:'):
+            raise StageError('daily_targets', targets)
+        return targets
 
-    except Exception as e:
-        logger.error(f"Error in generate_meal_plan: {str(e)}")
-        logger.error(f"Error traceback: {traceback.format_exc()}")
-        return jsonify({"success": False, "error": str(e)}), 500
+    async def meal_plan_per_day():
+        return await asyncio.to_thread(generate_meal_plan_per_day, user_profile)
 
-def get_openai_response(prompt, max_tokens=5000):
-    """Helper function to get OpenAI API response with error handling"""
+    async def meal_plan_from_library():
+        return await asyncio.to_thread(generate_meal_plan_from_library, user_profile)
+
+    async def grocery_list(meal_plan):
+        if GROCERY_SOURCE == 'llm':
+            groceries = await aget_openai_response(build_grocery_list_prompt(meal_plan), max_tokens=1000,
+                                                   timeout=STAGE_TIMEOUTS['grocery_list'])
+        else:
+            groceries = await asyncio.to_thread(get_grocery_list, meal_plan, STAGE_TIMEOUTS['grocery_list'])
+        if groceries.startswith('Error:'):
+            raise StageError('grocery_list', groceries)
+        return groceries
+
+    flight_key = f"{profile_key(user_profile)}:{MEAL_PLAN_MODE}:{TARGETS_SOURCE}"
+    return await arun_stages([timed_stage(coalesced_stage(stage, flight_key)) for stage in (
+        Stage('daily_targets', daily_targets, timeout=STAGE_TIMEOUTS['daily_targets']),
+        Stage('meal_plan', meal_plan_per_day, timeout=STAGE_TIMEOUTS['meal_plan'])
+        if MEAL_PLAN_MODE == 'per_day' else
+        Stage('meal_plan', meal_plan_from_library, timeout=STAGE_TIMEOUTS['meal_plan'])
+        if MEAL_PLAN_MODE == 'library' else
+        aopenai_stage('meal_plan', lambda: build_meal_plan_prompt(user_profile), 5000),
+        Stage('grocery_list', grocery_list, deps=['meal_plan'], timeout=STAGE_TIMEOUTS['grocery_list']),
+        aopenai_stage('prep_tips', lambda: prep_tips_prompt, 1000),
+    )], on_complete=on_progress)
+
+def build_structured_plan_prompt(user_profile):
+    """Prompt for the whole plan as one JSON document, with the local targets when TARGETS_SOURCE=local"""
+    return f"""{build_profile_context(user_profile)}
+        {structured_plan_prompt}{build_targets_requirement(user_profile)}
+{build_profile_requirements(user_profile)}"""
+
+def structured_plan_stage(user_profile, attempt, complete):
+    """Coalesced, timed stage for one structured completion; a retry (``attempt`` > 0) uses a new seed"""
+    prompt = build_structured_plan_prompt(user_profile)
+    seed = attempt or None
+    flight_key = f"{profile_key(user_profile)}:json:{TARGETS_SOURCE}:{attempt}"
+
+    def run():
+        return complete(prompt, seed)
+
+    async def arun():
+        return await complete(prompt, seed)
+
+    stage = Stage('structured_plan', arun if asyncio.iscoroutinefunction(complete) else run,
+                  timeout=STRUCTURED_PLAN_TIMEOUT)
+    return timed_stage(coalesced_stage(stage, flight_key))
+
+def parse_structured_plan(response, user_profile, attempt):
+    """The validated Plan, or None if the document doesn't match the schema and a retry is left"""
+    if response.startswith('Error:'):
+        raise StageError('structured_plan', response)
     try:
-        logger.debug(f"Sending prompt to OpenAI (length: {len(prompt)})")
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo-16k",
-            messages=[
-                {"role": "system", "content": "You are a precise nutritionist. Respond only in the exact format requested."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.2,
-            max_tokens=max_tokens
-        )
-        
-        # Add error checking for the response
-        if not response or not hasattr(response, 'choices') or len(response.choices) == 0:
-            logger.error("OpenAI API returned invalid response structure")
-            return "Error: Invalid API response structure"
-            
-        content = response.choices[0].message.content.strip()
-        if not content:
-            logger.error("OpenAI API returned empty content")
-            return "Error: Empty response from API"
-            
-        logger.debug(f"Received response from OpenAI (length: {len(content)})")
-        return content
-        
-    except Exception as e:
-        logger.error(f"OpenAI API error: {str(e)}")
-        return f"Error: {str(e)}"
+        plan = parse_plan_document(response)
+    except SchemaError as e:
+        logger.warning(f"Structured plan rejected: {str(e)}")
+        metrics().inc('eatreal_errors_total', component='structured_plan')
+        if attempt:
+            raise StageError('structured_plan', f"The model returned an invalid plan: {str(e)}")
+        return None
+    if TARGETS_SOURCE != 'llm':
+        # Deferred: api.targets pulls in numpy
+        from api.targets import daily_targets_text
+        plan.targets = parse_daily_targets(daily_targets_text(user_profile))
+    return plan
+
+def generate_structured_plan(user_profile, on_progress=None):
+    """Targets, meal plan, grocery list and prep tips from one JSON-mode completion, validated into a Plan.
+
+    A document that fails validation is requested once more with another seed.
+    """
+    def complete(prompt, seed):
+        return get_openai_response(prompt, max_tokens=STRUCTURED_PLAN_MAX_TOKENS, timeout=STRUCTURED_PLAN_TIMEOUT,
+                                   seed=seed, json_mode=True)
+
+    for attempt in range(2):
+        response = run_stages([structured_plan_stage(user_profile, attempt, complete)])['structured_plan']
+        plan = parse_structured_plan(response, user_profile, attempt)
+        if plan is not None:
+            break
+    if on_progress:
+        for stage in STAGE_TIMEOUTS:
+            on_progress(stage)
+    return plan
+
+async def agenerate_structured_plan(user_profile, on_progress=None):
+    """``generate_structured_plan`` on the event loop, for the ASGI app"""
+    async def complete(prompt, seed):
+        return await aget_openai_response(prompt, max_tokens=STRUCTURED_PLAN_MAX_TOKENS,
+                                          timeout=STRUCTURED_PLAN_TIMEOUT, seed=seed, json_mode=True)
+
+    for attempt in range(2):
+        response = (await arun_stages([structured_plan_stage(user_profile, attempt, complete)]))['structured_plan']
+        plan = parse_structured_plan(response, user_profile, attempt)
+        if plan is not None:
+            break
+    if on_progress:
+        for stage in STAGE_TIMEOUTS:
+            on_progress(stage)
+    return plan
+
+def generate_plan(user_profile, on_progress=None):
+    """The unreviewed Plan for a profile, from the stage pipeline or one structured completion (PLAN_FORMAT)"""
+    if PLAN_FORMAT == 'json':
+        return generate_structured_plan(user_profile, on_progress=on_progress)
+    components = generate_plan_components(user_profile, on_progress=on_progress)
+    return parse_plan(components['daily_targets'], components['meal_plan'],
+                      components['grocery_list'], components['prep_tips'])
+
+async def agenerate_plan(user_profile, on_progress=None):
+    """``generate_plan`` for the ASGI app"""
+    if PLAN_FORMAT == 'json':
+        return await agenerate_structured_plan(user_profile, on_progress=on_progress)
+    components = await agenerate_plan_components(user_profile, on_progress=on_progress)
+    return parse_plan(components['daily_targets'], components['meal_plan'],
+                      components['grocery_list'], components['prep_tips'])
+
+def get_daily_targets(user_profile, timeout=None):
+    """Daily targets text; computed locally from the profile unless TARGETS_SOURCE=llm"""
+    if TARGETS_SOURCE == 'llm':
+        return get_openai_response(targets_prompt, max_tokens=500, timeout=timeout)
+    # Deferred: api.targets pulls in numpy
+    from api.targets import daily_targets_text
+    return daily_targets_text(user_profile)
+
+def get_grocery_list(meal_plan, timeout=None, days=None):
+    """Grocery list text; aggregated locally from the plan unless GROCERY_SOURCE=llm.
+
+    ``days`` can pass an already parsed plan to skip re-parsing ``meal_plan``.
+    """
+    if GROCERY_SOURCE == 'llm':
+        return get_openai_response(build_grocery_list_prompt(meal_plan), max_tokens=1000, timeout=timeout)
+    if days is None:
+        days = parse_meal_plan(meal_plan)
+    categories = build_grocery_list(days, classify_unknown=lambda phrases: classify_grocery_items(phrases, timeout))
+    return grocery_list_text(categories)
+
+def classify_grocery_items(phrases, timeout=None):
+    """Fallback for ingredients the local lexicon doesn't know; returns GroceryCategory records"""
+    response = get_openai_response(
+        grocery_classify_prompt + "\n".join(f"- {phrase}" for phrase in phrases),
+        max_tokens=300,
+        timeout=timeout
+    )
+    if response.startswith('Error:'):
+        raise ValueError(response)
+    return parse_grocery_list(response)
+
+def completion_cache_key(prompt, max_tokens, seed=None, json_mode=False):
+    """Prompt cache key covering everything that affects the completion"""
+    return make_key(prompt, OPENAI_MODEL, max_tokens, system=SYSTEM_PROMPT, temperature=OPENAI_TEMPERATURE,
+                    seed=seed, **({"response_format": JSON_FORMAT} if json_mode else {}))
+
+def record_usage(kind, prompt_tokens, completion_tokens):
+    """Token histograms, token totals and estimated cost for one completion"""
+    metrics().observe('eatreal_openai_request_tokens', prompt_tokens, kind=kind, type='prompt')
+    metrics().observe('eatreal_openai_request_tokens', completion_tokens, kind=kind, type='completion')
+    metrics().inc('eatreal_openai_tokens_total', prompt_tokens, model=OPENAI_MODEL, type='prompt')
+    metrics().inc('eatreal_openai_tokens_total', completion_tokens, model=OPENAI_MODEL, type='completion')
+    metrics().inc('eatreal_openai_cost_usd_total',
+                  (prompt_tokens * OPENAI_PRICE[0] + completion_tokens * OPENAI_PRICE[1]) / 1000,
+                  model=OPENAI_MODEL)
+
+def estimate_tokens(prompt):
+    """Rough prompt size (~4 characters per token) for budgeting before usage is known"""
+    return (len(SYSTEM_PROMPT) + len(prompt)) // 4
+
+def chat_messages(prompt):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+def get_openai_response(prompt, max_tokens=5000, timeout=None, use_cache=True, seed=None, json_mode=False):
+    """Helper function to get OpenAI API response with error handling; ``json_mode`` asks for a JSON object"""
+    with tracer.span('llm complete') as span:
+        span.set(backend=llm_backend.name, model=OPENAI_MODEL, max_tokens=max_tokens, seed=seed, json_mode=json_mode)
+        span.capture('prompt', prompt)
+        cache_key = completion_cache_key(prompt, max_tokens, seed, json_mode)
+        if use_cache:
+            cached = prompt_cache().get(cache_key)
+            if cached is not None:
+                metrics().inc('eatreal_prompt_cache_requests_total', result='hit')
+                span.set(cache='hit')
+                return cached
+            metrics().inc('eatreal_prompt_cache_requests_total', result='miss')
+            span.set(cache='miss')
+
+        # A pipeline stage that already failed or timed out no longer wants the answer
+        if stage_cancelled():
+            span.set(error="cancelled")
+            return CANCELLED_ERROR
+        timeout = stage_time_left(timeout)
+
+        # Rate limits count max_tokens up front; the unused part is credited back afterwards
+        estimate = estimate_tokens(prompt) + max_tokens
+        try:
+            with metrics().timer('eatreal_openai_request_duration_seconds', kind='complete'):
+                completion = llm_scheduler().call(
+                    lambda: llm_backend.complete(chat_messages(prompt), OPENAI_MODEL, max_tokens,
+                                                 OPENAI_TEMPERATURE, timeout=timeout, seed=seed,
+                                                 response_format=JSON_FORMAT if json_mode else None),
+                    estimate,
+                    timeout=timeout,
+                    retry_policy=llm_backend.retry_policy,
+                    used_tokens=lambda c: (c.prompt_tokens + c.completion_tokens) or estimate,
+                    cancelled=stage_cancelled
+                )
+            record_usage('complete', completion.prompt_tokens, completion.completion_tokens)
+            span.set(prompt_tokens=completion.prompt_tokens, completion_tokens=completion.completion_tokens)
+            span.capture('response', completion.text)
+
+            content = completion.text.strip()
+            if not content:
+                logger.error("OpenAI API returned empty content")
+                metrics().inc('eatreal_errors_total', component='openai')
+                span.set(error="Empty response from API")
+                return "Error: Empty response from API"
+
+            if use_cache:
+                prompt_cache().set(cache_key, content)
+            return content
+
+        except CallCancelled:
+            span.set(error="cancelled")
+            return CANCELLED_ERROR
+        except SchedulerOverloaded as e:
+            logger.warning(f"LLM call shed: {str(e)}")
+            span.set(error=str(e))
+            return BUSY_ERROR
+        except Exception as e:
+            logger.error(f"OpenAI API error: {str(e)}")
+            metrics().inc('eatreal_errors_total', component='openai')
+            span.set(error=str(e))
+            return f"Error: {str(e)}"
+
+async def aget_openai_response(prompt, max_tokens=5000, timeout=None, use_cache=True, seed=None, json_mode=False):
+    """``get_openai_response`` for the async pipeline: same cache, scheduler and error strings"""
+    with tracer.span('llm complete') as span:
+        span.set(backend=llm_backend.name, model=OPENAI_MODEL, max_tokens=max_tokens, seed=seed, mode='async',
+                 json_mode=json_mode)
+        span.capture('prompt', prompt)
+        cache_key = completion_cache_key(prompt, max_tokens, seed, json_mode)
+        if use_cache:
+            cached = await asyncio.to_thread(prompt_cache().get, cache_key)
+            if cached is not None:
+                metrics().inc('eatreal_prompt_cache_requests_total', result='hit')
+                span.set(cache='hit')
+                return cached
+            metrics().inc('eatreal_prompt_cache_requests_total', result='miss')
+            span.set(cache='miss')
+
+        estimate = estimate_tokens(prompt) + max_tokens
+        try:
+            with metrics().timer('eatreal_openai_request_duration_seconds', kind='complete'):
+                completion = await llm_scheduler().acall(
+                    lambda: llm_backend.acomplete(chat_messages(prompt), OPENAI_MODEL, max_tokens,
+                                                  OPENAI_TEMPERATURE, timeout=timeout, seed=seed,
+                                                  response_format=JSON_FORMAT if json_mode else None),
+                    estimate,
+                    timeout=timeout,
+                    retry_policy=llm_backend.retry_policy,
+                    used_tokens=lambda c: (c.prompt_tokens + c.completion_tokens) or estimate
+                )
+            record_usage('complete', completion.prompt_tokens, completion.completion_tokens)
+            span.set(prompt_tokens=completion.prompt_tokens, completion_tokens=completion.completion_tokens)
+            span.capture('response', completion.text)
+
+            content = completion.text.strip()
+            if not content:
+                logger.error("OpenAI API returned empty content")
+                metrics().inc('eatreal_errors_total', component='openai')
+                span.set(error="Empty response from API")
+                return "Error: Empty response from API"
+
+            if use_cache:
+                await asyncio.to_thread(prompt_cache().set, cache_key, content)
+            return content
+
+        except SchedulerOverloaded as e:
+            logger.warning(f"LLM call shed: {str(e)}")
+            span.set(error=str(e))
+            return BUSY_ERROR
+        except Exception as e:
+            logger.error(f"OpenAI API error: {str(e)}")
+            metrics().inc('eatreal_errors_total', component='openai')
+            span.set(error=str(e))
+            return f"Error: {str(e)}"
+
+def get_openai_stream(prompt, max_tokens=5000, timeout=None):
+    """Stream an OpenAI completion, yielding content deltas as they arrive.
+
+    Raises on API errors. A cached completion is yielded as a single chunk and
+    a finished stream is added to the prompt cache.
+    """
+    cache_key = completion_cache_key(prompt, max_tokens)
+    cached = prompt_cache().get(cache_key)
+    if cached is not None:
+        metrics().inc('eatreal_prompt_cache_requests_total', result='hit')
+        yield cached
+        return
+    metrics().inc('eatreal_prompt_cache_requests_total', result='miss')
+
+    # Not activated: the generator may be resumed from a different context
+    span = tracer.start_span('llm stream')
+    span.set(backend=llm_backend.name, model=OPENAI_MODEL, max_tokens=max_tokens)
+    span.capture('prompt', prompt)
+    parts = []
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        # Closing this generator early (client disconnect) closes the backend stream and frees the permit
+        with llm_scheduler().permit(estimate_tokens(prompt) + max_tokens, timeout=timeout):
+            for delta in llm_backend.stream(chat_messages(prompt), OPENAI_MODEL, max_tokens, OPENAI_TEMPERATURE,
+                                            timeout=timeout):
+                parts.append(delta)
+                yield delta
+        outcome = 'ok'
+    except GeneratorExit:
+        outcome = 'cancelled'
+        raise
+    finally:
+        metrics().observe('eatreal_openai_request_duration_seconds', time.perf_counter() - start,
+                          kind='stream', outcome=outcome)
+        if outcome == 'error':
+            metrics().inc('eatreal_errors_total', component='openai')
+        if span.sampled:
+            span.set(outcome=outcome)
+            span.capture('response', "".join(parts))
+            span.end()
+
+    content = "".join(parts).strip()
+    # Streamed chunks carry no usage, so estimate at ~4 characters per token
+    record_usage('stream', estimate_tokens(prompt), len(content) // 4)
+    if not content:
+        raise ValueError("Empty response from API")
+    prompt_cache().set(cache_key, content)
 
 def generate_html_email(daily_targets, meal_plan, grocery_list, prep_tips, user_profile):
     """Generate HTML email with structured sections"""
-    return f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="utf-8">
-        <style>
-            body {{
-                font-family: Arial, sans-serif;
-                line-height: 1.6;
-                color: #333;
-                margin: 0;
-                padding: 0;
-                background-color: #f5f5f5;
-            }}
-            
-            .container {{
-                max-width: 600px;
-                margin: 0 auto;
-                background-color: #ffffff;
-            }}
-            
-            .header {{
-                background-color: #45B26B;
-                padding: 20px;
-                text-align: center;
-            }}
-            
-            .logo {{
-                width: 120px;
-                height: auto;
-                margin-bottom: 20px;
-            }}
-            
-            .header h1 {{
-                color: white;
-                margin: 0;
-                font-size: 24px;
-                font-weight: 600;
-            }}
-            
-            .content {{
-                padding: 40px 20px;
-            }}
-            
-            .section {{
-                margin-bottom: 30px;
-            }}
-            
-            .section-title {{
-                color: #45B26B;
-                font-size: 20px;
-                font-weight: 600;
-                margin-bottom: 15px;
-                border-bottom: 2px solid #45B26B;
-                padding-bottom: 5px;
-            }}
-            
-            .meal-day {{
-                background: white;
-                border-radius: 12px;
-                box-shadow: 0 2px 8px rgba(0,0,0,0.1);
-                padding: 25px;
-                margin-bottom: 30px;
-            }}
-            
-            .day-intro {{
-                color: #666;
-                font-style: italic;
-                margin-bottom: 15px;
-                padding: 10px;
-                background: #f8f9fa;
-                border-radius: 6px;
-            }}
-            
-            .macro-badge {{
-                display: inline-block;
-                padding: 4px 8px;
-                border-radius: 12px;
-                font-size: 12px;
-                margin-right: 8px;
-                background: #e9ecef;
-                color: #495057;
-            }}
-            
-            .meal-emoji {{
-                font-size: 20px;
-                margin-right: 8px;
-            }}
-            
-            .category-title {{
-                color: #45B26B;
-                font-size: 18px;
-                margin: 15px 0 10px;
-                display: flex;
-                align-items: center;
-            }}
-            
-            .meal-title {{
-                color: #45B26B;
-                font-weight: 600;
-                margin-bottom: 10px;
-            }}
-            
-            .meal-table {{
-                width: 100%;
-                border-collapse: collapse;
-                margin-bottom: 20px;
-            }}
-            
-            .meal-table th {{
-                background: #45B26B;
-                color: white;
-                padding: 10px;
-                text-align: left;
-            }}
-            
-            .meal-table td {{
-                padding: 10px;
-                border-bottom: 1px solid #eee;
-            }}
-            
-            .macros-box {{
-                background: #f0f7f1;
-                border-radius: 8px;
-                padding: 15px;
-                margin-bottom: 20px;
-            }}
-            
-            .grocery-list {{
-                background: white;
-                border: 1px solid #ddd;
-                border-radius: 8px;
-                padding: 20px;
-            }}
-            
-            .tips {{
-                background: #fff5e6;
-                border-radius: 8px;
-                padding: 20px;
-                margin-top: 30px;
-            }}
-            
-            .footer {{
-                background: #333;
-                color: white;
-                text-align: center;
-                padding: 20px;
-                font-size: 12px;
-            }}
-            
-            .intro-section {{
-                background: #f8f9fa;
-                border-left: 4px solid #45B26B;
-                padding: 20px;
-                margin: 20px 0;
-                border-radius: 8px;
-                line-height: 1.6;
-            }}
-            
-            .intro-section p {{
-                color: #666;
-                margin: 10px 0;
-            }}
-            
-            .highlight {{
-                color: #45B26B;
-                font-weight: 600;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="content">
-                <div class="intro-section">
-                    <p>Welcome to your personalized nutrition journey! Based on your profile, we've created a meal plan that:</p>
-                    <p>🎯 Supports your <span class="highlight">weight goal</span> from {user_profile.get('current_weight')}kg to {user_profile.get('target_weight')}kg</p>
-                    <p>💪 Matches your <span class="highlight">{user_profile.get('activity').replace('_', ' ')}</span> activity level</p>
-                    <p>🍽️ Follows your <span class="highlight">{user_profile.get('diet_preference').replace('_', ' ')}</span> dietary preference</p>
-                    <p>⏰ Fits within your <span class="highlight">{user_profile.get('cooking_time')}</span> cooking time preference</p>
-                    <p>🔄 Includes {user_profile.get('meal_prep')} meal prep options</p>
-                </div>
-
-                <div class="section">
-                    <h2 class="section-title">Daily Targets</h2>
-                    {format_daily_targets(daily_targets)}
-                </div>
-
-                <div class="section">
-                    <h2 class="section-title">Your 7-Day Meal Plan</h2>
-                    {format_meal_plan(meal_plan)}
-                </div>
-
-                <div class="section">
-                    <h2 class="section-title">Grocery List</h2>
-                    {format_grocery_list(grocery_list)}
-                </div>
-
-                <div class="section">
-                    <h2 class="section-title">Meal Prep Tips</h2>
-                    {format_prep_tips(prep_tips)}
-                </div>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
+    plan = parse_plan(daily_targets, meal_plan, grocery_list, prep_tips)
+    return email_template.render_html(user_profile, html_sections(plan))
 
-#def get_base64_logo():
-#    """Return the pre-encoded logo from file"""
-#    try:
-#        current_dir = os.path.dirname(os.path.abspath(__file__))
-#        logo_path = os.path.join(current_dir, 'encoded_logo.txt')
-#        
-#        with open(logo_path, 'r') as file:
-#            content = file.read()
-#            logger.debug("Reading encoded logo file")
-#            encoded_logo = content.replace("ENCODED_LOGO = '''", "").replace("'''", "").strip()
-#            logger.debug(f"Encoded logo length: {len(encoded_logo)}")
-#            return encoded_logo
-#    except Exception as e:
-#        logger.error(f"Error loading encoded logo: {str(e)}")
-#        return ""
+def send_plan_email(user_email, user_profile, plan):
+    """Render a parsed plan as HTML plus a plain-text alternative and queue the email"""
+    with tracer.span('format_email'), metrics().timer('eatreal_stage_duration_seconds', stage='format_email'):
+        html_content = email_template.render_html(user_profile, html_sections(plan))
+        text_content = email_template.render_text(text_sections(plan))
+    with tracer.span('send_email'), metrics().timer('eatreal_stage_duration_seconds', stage='send_email'):
+        return send_email(user_email, html_content, text_content)
 
 def format_meal_plan(meal_plan_text):
     """Format the meal plan text into structured HTML"""
     try:
-        logger.debug(f"Formatting meal plan: {meal_plan_text}")
         if not meal_plan_text:
             return "<p>Error: Empty meal plan</p>"
-
-        formatted_html = "<div class='meal-plan'>"
-        current_day = None
-        current_meal = None
-        meal_description = None
-        
-        for line in meal_plan_text.splitlines():
-            line = line.strip()
-            if not line:
-                continue
-                
-            if line.startswith("DAY"):
-                if current_day:
-                    if current_meal and meal_description:
-                        formatted_html += f"<p>{meal_description}</p>"
-                    formatted_html += "</div>"
-                current_day = line
-                current_meal = None
-                meal_description = None
-                formatted_html += f"""
-                    <div class="meal-day">
-                        <h3>{current_day}</h3>
-                """
-            elif line in ["Breakfast", "Lunch", "Dinner", "Snacks"]:
-                if current_meal and meal_description:
-                    formatted_html += f"<p>{meal_description}</p>"
-                current_meal = line
-                meal_description = None
-                formatted_html += f"""
-                    <div class="meal-item">
-                        <h4>{current_meal}</h4>
-                """
-            elif line.startswith("-"):
-                meal_description = line[1:].strip()
-            elif line.startswith("|"):
-                formatted_html += f"""
-                    <p>{meal_description}</p>
-                    <p class="macros">{line.strip()}</p>
-                    </div>
-                """
-                current_meal = None
-                meal_description = None
-            elif "Meal Prep Tips:" in line:
-                if current_meal and meal_description:
-                    formatted_html += f"<p>{meal_description}</p>"
-                formatted_html += "<h4>Meal Prep Tips:</h4>"
-            elif line.startswith("-") and "Meal Prep Tips:" in formatted_html:
-                formatted_html += f"<p>{line[1:].strip()}</p>"
-        
-        if current_day:  # Close the last day div if exists
-            if current_meal and meal_description:
-                formatted_html += f"<p>{meal_description}</p>"
-            formatted_html += "</div>"
-        formatted_html += "</div>"
-        return formatted_html
-            
+        return render_meal_plan_html(parse_meal_plan(meal_plan_text))
     except Exception as e:
         logger.error(f"Error formatting meal plan: {str(e)}")
         return "<p>Error formatting meal plan</p>"
@@ -566,34 +1555,9 @@ def format_macro_badges(macros):
 def format_grocery_list(grocery_list):
     """Format the grocery list with categories"""
     try:
-        logger.debug(f"Formatting grocery list: {grocery_list}")
         if not grocery_list:
             return "<p>Error: Empty grocery list</p>"
-
-        formatted_html = '<div class="grocery-list">'
-        current_category = None
-        
-        for line in grocery_list.splitlines():
-            line = line.strip()
-            if not line:
-                continue
-                
-            if line.endswith(':'):  # Category header
-                if current_category:
-                    formatted_html += "</ul>"
-                current_category = line
-                formatted_html += f"""
-                    <h3>{current_category}</h3>
-                    <ul>
-                """
-            elif line.startswith('-'):
-                formatted_html += f"<li>{line[1:].strip()}</li>"
-        
-        if current_category:  # Close the last category if exists
-            formatted_html += "</ul>"
-        formatted_html += "</div>"
-        return formatted_html
-            
+        return render_grocery_html(parse_grocery_list(grocery_list))
     except Exception as e:
         logger.error(f"Error formatting grocery list: {str(e)}")
         return "<p>Error formatting grocery list</p>"
@@ -601,66 +1565,24 @@ def format_grocery_list(grocery_list):
 def format_prep_tips(tips_text):
     """Format the meal prep tips"""
     try:
-        logger.debug(f"Formatting prep tips: {tips_text}")
         if not tips_text:
             return "<p>Error: Empty prep tips</p>"
-
-        formatted_html = '<div class="prep-tips"><ol>'
-        for line in tips_text.splitlines():
-            line = line.strip()
-            if line and (line[0].isdigit() or line.startswith('-')):
-                formatted_html += f"<li>{line.lstrip('123456789.- ')}</li>"
-        formatted_html += '</ol></div>'
-        return formatted_html
-            
+        return render_tips_html(parse_prep_tips(tips_text))
     except Exception as e:
         logger.error(f"Error formatting prep tips: {str(e)}")
         return "<p>Error formatting prep tips</p>"
 
-def send_email(user_email, html_content):
+def send_email(user_email, html_content, text_content=None):
     try:
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = "Your Personalized Nutrition Plan"
-        msg['From'] = formataddr(("Eat Real", EMAIL_USERNAME))
-        msg['To'] = user_email
+        require_settings(EMAIL_USERNAME=EMAIL_USERNAME, EMAIL_PASSWORD=EMAIL_PASSWORD)
+        msg = email_template.build_message(EMAIL_USERNAME, user_email, html_content, text_content)
 
-        # Add the HTML content
-        msg.attach(MIMEText(html_content, 'html'))
-
-        # Add logo as inline attachment
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        logo_path = os.path.join(current_dir, '..', 'assets', 'images', 'EatRealLogo.png')
-        
-        with open(logo_path, 'rb') as f:
-            img = MIMEImage(f.read())
-            img.add_header('Content-ID', '<logo>')
-            img.add_header('Content-Disposition', 'inline', filename='EatRealLogo.png')
-            msg.attach(img)
-
-        # Update the HTML template to use the inline image
-        html_template = f"""
-            <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
-                <div style="text-align: center; margin-bottom: 20px;">
-                    <img src="cid:logo" alt="Eat Real Logo" style="width: 120px; height: auto;">
-                </div>
-                <h1 style="color: #8B4513; text-align: center;">Your Personalized Nutrition Plan</h1>
-                
-                <!-- Rest of your email content -->
-                {html_content}
-            </div>
-        """
-        
-        msg.attach(MIMEText(html_template, 'html'))
-
-        # Send the email
-        with smtplib.SMTP('smtp.gmail.com', 587) as server:
-            server.starttls()
-            server.login(EMAIL_USERNAME, EMAIL_PASSWORD)
-            server.send_message(msg)
-            logger.debug("Email sent successfully")
+        # Queue for background delivery; the outbox retries on transient SMTP failures
+        outbox().enqueue(msg, EMAIL_USERNAME, user_email)
         return True
     except Exception as e:
         logger.error(f"Email sending error: {str(e)}")
+        metrics().inc('eatreal_errors_total', component='email')
         return False
 
 
@@ -668,39 +1590,64 @@ def send_email(user_email, html_content):
 def format_daily_targets(targets_text):
     """Format the daily targets section"""
     try:
-        logger.debug(f"Formatting daily targets: {targets_text}")
-        if not targets_text or "CALORIES:" not in targets_text:
-            return "<p>Error: Invalid daily targets format</p>"
-
-        # Split the text into lines and find the relevant lines
-        lines = targets_text.split('\n')
-        calories = next((line.split('CALORIES:')[1].strip() for line in lines if 'CALORIES:' in line), 'N/A')
-        protein = next((line.split('PROTEIN:')[1].strip() for line in lines if 'PROTEIN:' in line), 'N/A')
-        carbs = next((line.split('CARBS:')[1].strip() for line in lines if 'CARBS:' in line), 'N/A')
-        fats = next((line.split('FATS:')[1].strip() for line in lines if 'FATS:' in line), 'N/A')
-        
-        return f"""
-        <div class="macros-box">
-            <table class="meal-table">
-                <tr>
-                    <th>Calories</th>
-                    <th>Protein</th>
-                    <th>Carbs</th>
-                    <th>Fats</th>
-                </tr>
-                <tr>
-                    <td>{calories}</td>
-                    <td>{protein}</td>
-                    <td>{carbs}</td>
-                    <td>{fats}</td>
-                </tr>
-            </table>
-        </div>
-        """
+        return render_targets_html(parse_daily_targets(targets_text))
     except Exception as e:
         logger.error(f"Error formatting daily targets: {str(e)}")
         return "<p>Error formatting daily targets</p>"
 
+@functools.lru_cache(maxsize=None)
+def job_queue():
+    """Queued /generate-meal-plan requests, run by worker threads started per process"""
+    return JobQueue(
+        os.path.join(DATA_DIR, 'jobs.sqlite3'),
+        handler=process_meal_plan_job,
+        workers=int(os.getenv('JOB_WORKERS', 2)),
+        max_queued=int(os.getenv('JOB_QUEUE_LIMIT', 100)),
+        max_attempts=int(os.getenv('JOB_MAX_ATTEMPTS', 3)),
+        retry_delay=float(os.getenv('JOB_RETRY_DELAY', 30))
+    )
+
+@functools.lru_cache(maxsize=None)
+def outbox():
+    """Plan emails, delivered over pooled SMTP connections by sender threads started per process"""
+    # Deferred: api.mailer pulls in smtplib
+    from api.mailer import Outbox, SMTPConnectionPool
+    return Outbox(
+        os.path.join(DATA_DIR, 'outbox.sqlite3'),
+        pool_factory=lambda: SMTPConnectionPool(
+            os.getenv('SMTP_HOST', 'smtp.gmail.com'),
+            int(os.getenv('SMTP_PORT', 587)),
+            EMAIL_USERNAME,
+            EMAIL_PASSWORD,
+            starttls=os.getenv('SMTP_STARTTLS', 'true').lower() in ('1', 'true', 'yes'),
+            size=int(os.getenv('SMTP_POOL_SIZE', 2)),
+            on_connect=lambda seconds: metrics().observe('eatreal_smtp_connect_duration_seconds', seconds)
+        ),
+        workers=int(os.getenv('SMTP_POOL_SIZE', 2)),
+        max_attempts=int(os.getenv('EMAIL_MAX_ATTEMPTS', 6)),
+        on_send=lambda outcome, seconds: metrics().observe('eatreal_email_send_duration_seconds', seconds,
+                                                           outcome=outcome)
+    )
+
+def warm_up():
+    """Do the lazily deferred imports and loads up front.
+
+    Called in the gunicorn master with --preload (see gunicorn.conf.py), so
+    every forked worker starts with them done and shares the pages.
+    """
+    import openai  # noqa: F401
+    from api import targets  # noqa: F401
+    email_template.logo_part()
+    # Create the SQLite files and tables once here, not on every worker's first request
+    for subsystem in (prompt_cache, plan_store, meal_library, single_flight, llm_scheduler, metrics, job_queue, outbox):
+        subsystem()
+
+@app.before_first_request
+def start_background_workers():
+    # Started per process after gunicorn forks, so every worker drains the shared queues
+    job_queue().start()
+    outbox().start()
+
 if __name__ == '__main__':
     # Add debug logging for startup
     logger.info("Starting Flask server...")
@@ -0,0 +1,395 @@
+import logging
+import re
+from collections import Counter
+
+from api.plan_model import GroceryCategory
+
+logger = logging.getLogger(__name__)
+
+CATEGORIES = ("PRODUCE", "PROTEINS", "PANTRY")
+
+# canonical name -> (category, synonyms); synonyms are matched singular or plural. A phrase is matched
+# whole before its words are, so compounds ("rice noodle", "bean sprout") need their own entry or their
+# words are read as separate ingredients
+INGREDIENTS = {
+    # PRODUCE
+    "Apples": ("PRODUCE", ["apple"]),
+    "Avocados": ("PRODUCE", ["avocado", "guacamole"]),
+    "Bananas": ("PRODUCE", ["banana"]),
+    "Mixed berries": ("PRODUCE", ["mixed berry", "berry", "berries"]),
+    "Blueberries": ("PRODUCE", ["blueberry", "blueberries"]),
+    "Strawberries": ("PRODUCE", ["strawberry", "strawberries"]),
+    "Raspberries": ("PRODUCE", ["raspberry", "raspberries"]),
+    "Lemons": ("PRODUCE", ["lemon", "lemon juice", "lemon zest"]),
+    "Limes": ("PRODUCE", ["lime", "lime juice"]),
+    "Oranges": ("PRODUCE", ["orange"]),
+    "Mango": ("PRODUCE", ["mango", "mangoes"]),
+    "Pineapple": ("PRODUCE", ["pineapple"]),
+    "Grapes": ("PRODUCE", ["grape"]),
+    "Pears": ("PRODUCE", ["pear"]),
+    "Peaches": ("PRODUCE", ["peach", "peaches"]),
+    "Mixed greens": ("PRODUCE", ["mixed green", "salad green", "leafy green"]),
+    "Spinach": ("PRODUCE", ["spinach", "baby spinach"]),
+    "Kale": ("PRODUCE", ["kale"]),
+    "Romaine lettuce": ("PRODUCE", ["romaine", "lettuce"]),
+    "Arugula": ("PRODUCE", ["arugula", "rocket"]),
+    "Broccoli": ("PRODUCE", ["broccoli"]),
+    "Cauliflower": ("PRODUCE", ["cauliflower", "cauliflower rice", "riced cauliflower"]),
+    "Carrots": ("PRODUCE", ["carrot"]),
+    "Celery": ("PRODUCE", ["celery"]),
+    "Cucumbers": ("PRODUCE", ["cucumber"]),
+    "Tomatoes": ("PRODUCE", ["tomato", "tomatoes", "cherry tomato", "cherry tomatoes"]),
+    "Bell peppers": ("PRODUCE", ["bell pepper", "red pepper", "green pepper", "pepper strip"]),
+    "Onions": ("PRODUCE", ["onion", "red onion", "shallot"]),
+    "Green onions": ("PRODUCE", ["green onion", "scallion", "spring onion"]),
+    "Garlic": ("PRODUCE", ["garlic", "garlic clove"]),
+    "Ginger": ("PRODUCE", ["ginger"]),
+    "Zucchini": ("PRODUCE", ["zucchini", "courgette", "zucchini noodle", "zoodle"]),
+    "Mushrooms": ("PRODUCE", ["mushroom"]),
+    "Sweet potatoes": ("PRODUCE", ["sweet potato", "sweet potatoes", "yam"]),
+    "Potatoes": ("PRODUCE", ["potato", "potatoes"]),
+    "Asparagus": ("PRODUCE", ["asparagus"]),
+    "Green beans": ("PRODUCE", ["green bean"]),
+    "Brussels sprouts": ("PRODUCE", ["brussels sprout"]),
+    "Bean sprouts": ("PRODUCE", ["bean sprout", "mung bean sprout"]),
+    "Cabbage": ("PRODUCE", ["cabbage", "coleslaw"]),
+    "Corn": ("PRODUCE", ["corn"]),
+    "Peas": ("PRODUCE", ["pea", "snap pea"]),
+    "Eggplant": ("PRODUCE", ["eggplant", "aubergine"]),
+    "Butternut squash": ("PRODUCE", ["butternut squash", "squash"]),
+    "Beets": ("PRODUCE", ["beet", "beetroot"]),
+    "Fresh herbs": ("PRODUCE", ["herb", "parsley", "basil", "cilantro", "coriander", "mint", "dill", "rosemary",
+                                "thyme"]),
+    "Mixed vegetables": ("PRODUCE", ["mixed vegetable", "vegetable", "veggie", "roasted vegetable"]),
+    # PROTEINS
+    "Chicken breast": ("PROTEINS", ["chicken breast", "chicken", "grilled chicken"]),
+    "Chicken thighs": ("PROTEINS", ["chicken thigh"]),
+    "Turkey": ("PROTEINS", ["turkey", "ground turkey", "turkey breast"]),
+    "Lean beef": ("PROTEINS", ["beef", "ground beef", "steak", "sirloin"]),
+    "Pork tenderloin": ("PROTEINS", ["pork", "pork tenderloin", "pork chop"]),
+    "Lamb": ("PROTEINS", ["lamb"]),
+    "Bacon": ("PROTEINS", ["bacon"]),
+    "Salmon": ("PROTEINS", ["salmon", "salmon fillet", "smoked salmon"]),
+    "Tuna": ("PROTEINS", ["tuna"]),
+    "Cod": ("PROTEINS", ["cod", "white fish", "tilapia", "halibut"]),
+    "Shrimp": ("PROTEINS", ["shrimp", "prawn"]),
+    "Sardines": ("PROTEINS", ["sardine"]),
+    "Eggs": ("PROTEINS", ["egg", "egg white", "hard-boiled egg", "omelette", "omelet"]),
+    "Tofu": ("PROTEINS", ["tofu"]),
+    "Tempeh": ("PROTEINS", ["tempeh"]),
+    "Edamame": ("PROTEINS", ["edamame"]),
+    "Chickpeas": ("PROTEINS", ["chickpea", "garbanzo bean", "hummus"]),
+    "Lentils": ("PROTEINS", ["lentil"]),
+    "Black beans": ("PROTEINS", ["black bean"]),
+    "Kidney beans": ("PROTEINS", ["kidney bean"]),
+    "Beans": ("PROTEINS", ["bean"]),
+    "Greek yogurt": ("PROTEINS", ["greek yogurt", "yogurt", "yoghurt"]),
+    "Cottage cheese": ("PROTEINS", ["cottage cheese"]),
+    "Protein powder": ("PROTEINS", ["protein powder", "whey"]),
+    # PANTRY
+    "Rolled oats": ("PANTRY", ["oat", "oatmeal", "rolled oat", "steel-cut oat", "overnight oat"]),
+    "Quinoa": ("PANTRY", ["quinoa"]),
+    "Brown rice": ("PANTRY", ["rice", "brown rice", "wild rice"]),
+    "Whole grain bread": ("PANTRY", ["bread", "toast", "whole grain bread", "sourdough"]),
+    "Rice noodles": ("PANTRY", ["rice noodle", "rice vermicelli", "vermicelli"]),
+    "Rice cakes": ("PANTRY", ["rice cake"]),
+    "Whole wheat tortillas": ("PANTRY", ["tortilla", "wrap", "corn tortilla"]),
+    "Whole wheat pasta": ("PANTRY", ["pasta", "spaghetti", "noodle", "egg noodle", "chickpea pasta", "lentil pasta"]),
+    "Whole grain crackers": ("PANTRY", ["cracker"]),
+    "Granola": ("PANTRY", ["granola"]),
+    "Olive oil": ("PANTRY", ["olive oil", "extra virgin olive oil"]),
+    "Coconut oil": ("PANTRY", ["coconut oil"]),
+    "Honey": ("PANTRY", ["honey"]),
+    "Maple syrup": ("PANTRY", ["maple syrup"]),
+    "Balsamic vinegar": ("PANTRY", ["balsamic", "balsamic vinaigrette", "balsamic vinegar", "vinaigrette"]),
+    "Rice vinegar": ("PANTRY", ["rice vinegar", "rice wine vinegar"]),
+    "Apple cider vinegar": ("PANTRY", ["apple cider vinegar", "cider vinegar"]),
+    "Soy sauce": ("PANTRY", ["soy sauce", "tamari"]),
+    "Almonds": ("PANTRY", ["almond", "sliced almond"]),
+    "Walnuts": ("PANTRY", ["walnut"]),
+    "Peanuts": ("PANTRY", ["peanut"]),
+    "Mixed nuts": ("PANTRY", ["mixed nut", "nut", "trail mix"]),
+    "Peanut butter": ("PANTRY", ["peanut butter"]),
+    "Almond flour": ("PANTRY", ["almond flour"]),
+    "Almond butter": ("PANTRY", ["almond butter"]),
+    "Chia seeds": ("PANTRY", ["chia seed", "chia"]),
+    "Flaxseeds": ("PANTRY", ["flaxseed", "flax seed", "ground flax"]),
+    "Pumpkin seeds": ("PANTRY", ["pumpkin seed", "pepita"]),
+    "Almond milk": ("PANTRY", ["almond milk", "plant milk", "oat milk", "soy milk"]),
+    "Milk": ("PANTRY", ["milk"]),
+    "Cheese": ("PANTRY", ["cheese", "feta", "parmesan", "mozzarella", "cheddar"]),
+    "Butter": ("PANTRY", ["butter"]),
+    "Dark chocolate": ("PANTRY", ["dark chocolate", "cocoa", "cacao"]),
+    "Spices": ("PANTRY", ["spice", "cumin", "paprika", "turmeric", "chili powder", "cinnamon", "curry powder",
+                          "oregano", "black pepper", "salt and pepper", "seasoning"]),
+    "Tahini": ("PANTRY", ["tahini"]),
+    "Salsa": ("PANTRY", ["salsa"]),
+    "Vegetable broth": ("PANTRY", ["broth", "stock"]),
+    "Canned tomatoes": ("PANTRY", ["canned tomato", "diced tomato", "tomato sauce", "marinara"]),
+    "Coconut milk": ("PANTRY", ["coconut milk"]),
+}
+
+# Words that show up in descriptions but aren't groceries on their own
+NON_INGREDIENTS = frozenset("""
+a an the and or with of in on for to on top topped served side sides serving bowl plate hearty fresh freshly
+mixed drizzle drizzled splash sprinkle sprinkled handful dash pinch perfect protein-rich afternoon morning
+snack meal dish delicious healthy light quick easy simple tasty savory sweet crunchy creamy homemade whole
+grain grains baked grilled roasted steamed sauteed sautéed oven-baked pan-seared seared stir-fried fried
+boiled poached scrambled chopped diced sliced shredded cooked raw seasoned marinated layered stuffed filled
+tossed blended smoothie salad soup stew curry wrap sandwich bake skillet stir fry parfait toast bites
+combination mix blend variety selection choice lean low-fat nutritious satisfying filling flavorful
+energy boost source packed great rich high fiber healthy fats carbs fat carb complex them it its their
+this that these those your you some few little bit small large medium cup cups tablespoon teaspoon slice
+slices piece pieces fillet fillets portion portions breast breasts thigh thighs cut cuts along plus alongside
+over under into onto from by dressing sauce glaze topping toppings garnish garnished spicy zesty tangy crispy
+warm cold chilled hot seasonal made scramble hash bites base mixture batch leftover leftovers style inspired
+""".split())
+
+TOKEN = re.compile(r"[a-z][a-z'-]*|[,;.:!()]")
+# Tokens that end a candidate phrase
+BOUNDARIES = frozenset([",", ";", ".", ":", "!", "(", ")", "and", "with", "or", "over", "on", "in", "of", "plus"])
+# Items written by build_grocery_list without measured quantities: "Name (N meals)"
+COUNTED_ITEM = re.compile(r"^(.*) \((\d+) meals?\)$")
+# unit as written -> (unit it's totalled in, factor)
+UNITS = {
+    "g": ("g", 1), "gram": ("g", 1), "grams": ("g", 1), "kg": ("g", 1000),
+    "ml": ("ml", 1), "l": ("ml", 1000), "liter": ("ml", 1000), "liters": ("ml", 1000),
+    "oz": ("oz", 1), "ounce": ("oz", 1), "ounces": ("oz", 1),
+    "lb": ("lb", 1), "lbs": ("lb", 1), "pound": ("lb", 1), "pounds": ("lb", 1),
+    "cup": ("cup", 1), "cups": ("cup", 1),
+    "tbsp": ("tbsp", 1), "tablespoon": ("tbsp", 1), "tablespoons": ("tbsp", 1),
+    "tsp": ("tsp", 1), "teaspoon": ("tsp", 1), "teaspoons": ("tsp", 1),
+}
+# "150g", "1/2 cup of", "2 large" (a count; the unit is "")
+QUANTITY = re.compile(r"\b(\d+/\d+|\d+(?:\.\d+)?)\s*(" + "|".join(sorted(UNITS, key=len, reverse=True)) +
+                      r")?\b\s*(?:of\s+)?", re.IGNORECASE)
+
+
+def _build_terms():
+    terms = {}
+    for canonical, (_, synonyms) in INGREDIENTS.items():
+        for synonym in synonyms:
+            terms[tuple(synonym.lower().split())] = canonical
+    return terms, max(len(term) for term in terms)
+
+
+TERMS, MAX_TERM_WORDS = _build_terms()
+
+
+def _singular(word):
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith("oes") or word.endswith("ches"):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def _lookup(words):
+    canonical = TERMS.get(words)
+    if canonical is None:
+        canonical = TERMS.get(words[:-1] + (_singular(words[-1]),))
+    return canonical
+
+
+def extract_ingredients(text):
+    """Return (known canonical ingredients, leftover candidate phrases) found in a meal description.
+
+    Tokens are matched against the lexicon as 1..MAX_TERM_WORDS word n-grams,
+    longest first, so "greek yogurt" wins over "yogurt". Runs of unmatched,
+    non-filler words between separators become candidate phrases.
+    """
+    tokens = TOKEN.findall(text.lower())
+    known = set()
+    unknown = set()
+    run = []
+
+    def end_run():
+        if run and len(run) <= 3:
+            unknown.add(" ".join(run))
+        run.clear()
+
+    i = 0
+    count = len(tokens)
+    while i < count:
+        token = tokens[i]
+        if token in BOUNDARIES:
+            end_run()
+            i += 1
+            continue
+        for size in range(min(MAX_TERM_WORDS, count - i), 0, -1):
+            words = tuple(tokens[i:i + size])
+            if BOUNDARIES.intersection(words):
+                continue
+            canonical = _lookup(words)
+            if canonical:
+                known.add(canonical)
+                end_run()
+                i += size
+                break
+        else:
+            if token not in NON_INGREDIENTS:
+                run.append(token)
+            i += 1
+    end_run()
+    return known, unknown
+
+
+def _measured(tokens):
+    """The ingredient the words right after a quantity name: "grilled chicken breast" -> Chicken breast"""
+    i = 0
+    while i < len(tokens) and tokens[i] in NON_INGREDIENTS and tokens[i] not in BOUNDARIES:
+        i += 1
+    for size in range(min(MAX_TERM_WORDS, len(tokens) - i), 0, -1):
+        words = tuple(tokens[i:i + size])
+        if not BOUNDARIES.intersection(words):
+            canonical = _lookup(words)
+            if canonical:
+                return canonical
+    return None
+
+
+def extract_quantities(text):
+    """Measured ingredients in a meal description, e.g. "150g chicken breast, 2 eggs" ->
+    {"Chicken breast": {"g": 150.0}, "Eggs": {"": 2.0}}. Ingredients written without an amount are left out.
+    """
+    measured = {}
+    for match in QUANTITY.finditer(text):
+        number, unit = match.groups()
+        numerator, _, denominator = number.partition("/")
+        amount = float(numerator) / float(denominator) if denominator else float(number)
+        unit, factor = UNITS[unit.lower()] if unit else ("", 1)
+        canonical = _measured(TOKEN.findall(text[match.end():match.end() + 60].lower())[:MAX_TERM_WORDS + 3])
+        if canonical and amount > 0:
+            amounts = measured.setdefault(canonical, {})
+            amounts[unit] = amounts.get(unit, 0.0) + amount * factor
+    return measured
+
+
+def _amount(amount, unit):
+    if unit in ("g", "ml") and amount >= 1000:
+        amount, unit = amount / 1000, "kg" if unit == "g" else "l"
+    amount = f"{round(amount, 2):g}"
+    if unit in ("", "g", "kg", "ml", "l"):
+        return f"{amount}{unit}"
+    if unit == "cup" and amount != "1":
+        unit = "cups"
+    return f"{amount} {unit}"
+
+
+def _quantity(meals, amounts=None):
+    """"450g, 2 cups", with meals that didn't say how much counted as "N more meals" (or "N meals" alone)"""
+    parts = [_amount(amount, unit) for unit, amount in sorted((amounts or {}).items())]
+    if meals:
+        parts.append(f"{meals} {'more ' if parts else ''}meal{'s' if meals != 1 else ''}")
+    return ", ".join(parts)
+
+
+def build_grocery_list(days, classify_unknown=None, max_unknown=40):
+    """Aggregate ingredients across every meal of the parsed plan.
+
+    Amounts written in the descriptions ("150g chicken", "1/2 cup oats") are
+    totalled per unit; meals that use an ingredient without saying how much
+    are counted instead, so an item reads "450g, 1 more meal" or "3 meals".
+    Phrases that aren't
+    in the lexicon are passed to ``classify_unknown`` (if given), which must
+    return a list of GroceryCategory records; anything it can't place is
+    dropped. Returns GroceryCategory records in PRODUCE/PROTEINS/PANTRY order.
+    """
+    counts = Counter()
+    amounts = {}
+    unknown = Counter()
+    for day in days:
+        for meal in day.meals:
+            text = f"{meal.name or ''}. {meal.description or ''}"
+            known, leftovers = extract_ingredients(text)
+            measured = extract_quantities(text)
+            for canonical in known | measured.keys():
+                if canonical in measured:
+                    totals = amounts.setdefault(canonical, {})
+                    for unit, amount in measured[canonical].items():
+                        totals[unit] = totals.get(unit, 0.0) + amount
+                    counts.setdefault(canonical, 0)
+                else:
+                    counts[canonical] += 1
+            unknown.update(leftovers)
+
+    categories = {name: GroceryCategory(name) for name in CATEGORIES}
+    for canonical, meals in sorted(counts.items()):
+        categories[INGREDIENTS[canonical][0]].items.append(f"{canonical} ({_quantity(meals, amounts.get(canonical))})")
+
+    if unknown and classify_unknown is not None:
+        phrases = [phrase for phrase, _ in unknown.most_common(max_unknown)]
+        try:
+            classified = classify_unknown(phrases)
+        except Exception as e:
+            logger.error(f"Error classifying grocery items: {str(e)}")
+            classified = []
+        seen = {item.split(" (")[0].lower() for category in categories.values() for item in category.items}
+        for category in classified:
+            target = categories.get(category.name.upper())
+            if target is None:
+                continue
+            for item in category.items:
+                name = item.split(" (")[0].strip()
+                if name.lower() not in seen:
+                    seen.add(name.lower())
+                    target.items.append(f"{name} ({_quantity(unknown.get(name.lower(), 1))})")
+
+    return [category for category in categories.values() if category.items]
+
+
+def grocery_list_text(categories):
+    """Render records in the ``CATEGORY:`` / ``- item (quantity)`` format the LLM stage returned"""
+    lines = []
+    for category in categories:
+        lines.append(f"{category.name}:")
+        lines.extend(f"- {item}" for item in category.items)
+    return "\n".join(lines)
+
+
+def update_grocery_list(categories, old_text, new_text):
+    """Patch aggregated GroceryCategory records in place for one meal changing from ``old_text`` to ``new_text``.
+
+    Only lexicon ingredients are diffed: ones the old meal used and the new one
+    doesn't lose a meal from their count (and are dropped at zero), new ones
+    gain a meal or are added with the amount the new meal gives. Items whose
+    quantity isn't a meal count (measured amounts, an LLM grocery list) are
+    left as they are. Returns (added, removed) canonical names.
+    """
+    old, _ = extract_ingredients(old_text) if old_text else (set(), set())
+    new, _ = extract_ingredients(new_text)
+    measured = extract_quantities(new_text)
+    removed, added = old - new, new - old
+    if not removed and not added:
+        return [], []
+
+    by_name = {name: GroceryCategory(name) for name in CATEGORIES}
+    by_name.update((category.name.upper(), category) for category in categories)
+    positions = {}
+    for category in by_name.values():
+        for index, item in enumerate(category.items):
+            positions[item.split(" (")[0].lower()] = (category, index)
+
+    for canonical in sorted(removed):
+        found = positions.get(canonical.lower())
+        match = found and COUNTED_ITEM.match(found[0].items[found[1]])
+        if match:
+            meals = int(match.group(2)) - 1
+            found[0].items[found[1]] = f"{canonical} ({_quantity(meals)})" if meals > 0 else None
+    for canonical in sorted(added):
+        found = positions.get(canonical.lower())
+        if found is None:
+            quantity = _quantity(0, measured[canonical]) if canonical in measured else _quantity(1)
+            by_name[INGREDIENTS[canonical][0]].items.append(f"{canonical} ({quantity})")
+            continue
+        match = COUNTED_ITEM.match(found[0].items[found[1]])
+        if match:
+            found[0].items[found[1]] = f"{canonical} ({_quantity(int(match.group(2)) + 1)})"
+
+    for category in by_name.values():
+        category.items[:] = [item for item in category.items if item is not None]
+    categories[:] = [by_name[name] for name in CATEGORIES if by_name[name].items] + \
+        [category for category in categories if category.name.upper() not in CATEGORIES and category.items]
+    return sorted(added), sorted(removed)
@@ -0,0 +1,188 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue is too deep to accept more work"""
+
+
+class JobQueue:
+    """Persistent job queue backed by SQLite with a bounded worker pool.
+
+    Jobs are claimed with a lease. If a worker dies mid-job (gunicorn restart,
+    OOM kill) the lease expires and any process sharing the database picks the
+    job up again. A job whose handler raises goes back in the queue and is
+    retried after ``retry_delay`` seconds. Either way a job runs at most
+    ``max_attempts`` times before it is marked failed.
+    """
+
+    def __init__(self, db_path, handler, workers=2, max_queued=100,
+                 lease_seconds=600, max_attempts=3, retry_delay=30.0, retention_seconds=7 * 24 * 3600,
+                 poll_interval=1.0):
+        self.db_path = db_path
+        self.handler = handler
+        self.workers = workers
+        self.max_queued = max_queued
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.retention_seconds = retention_seconds
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+        self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    payload TEXT,
+                    progress TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    -- Running: when the lease runs out. Queued for a retry: when it may run again
+                    lease_expires REAL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def start(self):
+        """Start the worker threads for this process (idempotent, fork-safe)"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            logger.info(f"Started {self.workers} job workers in process {self._pid}")
+
+    def enqueue(self, payload):
+        """Persist a new job and return its id"""
+        self.start()
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= self.max_queued:
+                conn.execute("ROLLBACK")
+                raise QueueFullError(f"Job queue is full ({queued} jobs waiting)")
+            conn.execute(
+                "INSERT INTO jobs (id, status, payload, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?)",
+                (job_id, json.dumps(payload), now, now)
+            )
+            conn.execute("DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND updated_at < ?",
+                         (now - self.retention_seconds,))
+            conn.execute("COMMIT")
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """Return the public status of a job, or None if it doesn't exist"""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT id, status, progress, error, attempts, created_at, updated_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "status": row[1],
+            "progress": json.loads(row[2]) if row[2] else None,
+            "error": row[3],
+            "attempts": row[4],
+            "created_at": row[5],
+            "updated_at": row[6],
+        }
+
+    def _claim(self):
+        """Atomically claim the oldest runnable job, including ones whose lease expired"""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Job abandoned too many times', "
+                "payload = NULL, updated_at = ? "
+                "WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts)
+            )
+            row = conn.execute(
+                "SELECT id, payload, attempts FROM jobs "
+                "WHERE (status = 'queued' AND (lease_expires IS NULL OR lease_expires <= ?)) "
+                "OR (status = 'running' AND lease_expires < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (now, now)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_expires = ?, updated_at = ? "
+                "WHERE id = ?",
+                (now + self.lease_seconds, now, row[0])
+            )
+            conn.execute("COMMIT")
+        return row[0], json.loads(row[1]), row[2] + 1
+
+    def _update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with closing(self._connect()) as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def _work(self):
+        while True:
+            try:
+                claimed = self._claim()
+            except sqlite3.Error as e:
+                logger.error(f"Job queue error: {str(e)}")
+                claimed = None
+
+            if claimed is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            job_id, payload, attempt = claimed
+            logger.info(f"Running job {job_id} (attempt {attempt}/{self.max_attempts})")
+
+            def report(progress, job_id=job_id):
+                self._update(job_id, progress=json.dumps(progress),
+                             lease_expires=time.time() + self.lease_seconds)
+
+            try:
+                self.handler(payload, report)
+            except Exception as e:
+                if attempt < self.max_attempts:
+                    logger.warning(f"Job {job_id} failed, retrying in {self.retry_delay:g}s: {str(e)}")
+                    self._update(job_id, status='queued', error=str(e), progress=None,
+                                 lease_expires=time.time() + self.retry_delay)
+                else:
+                    logger.error(f"Job {job_id} failed: {str(e)}")
+                    self._update(job_id, status='failed', error=str(e), payload=None, lease_expires=None)
+            else:
+                logger.info(f"Job {job_id} succeeded")
+                self._update(job_id, status='succeeded', payload=None, lease_expires=None)
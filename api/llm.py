@@ -0,0 +1,305 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from api.cache import make_key
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("openai", "fake", "replay", "record")
+FAKE_OPENAI_URL = "http://127.0.0.1:8089/v1"
+RETRYABLE_STATUS = frozenset((408, 409, 429, 500, 502, 503, 504))
+DEFAULT_RETRY_AFTER = 1.0
+
+
+def retry_after(headers):
+    """Seconds from ``retry-after-ms`` or ``retry-after`` (seconds or an HTTP date)"""
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    return DEFAULT_RETRY_AFTER
+
+
+class Completion:
+    """Text of a finished completion plus the token usage reported for it"""
+
+    __slots__ = ("text", "prompt_tokens", "completion_tokens")
+
+    def __init__(self, text, prompt_tokens=0, completion_tokens=0):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+
+class LLMBackend:
+    """Interface behind ``get_openai_response`` and ``get_openai_stream``.
+
+    ``complete`` returns a Completion and ``stream`` yields content deltas;
+    both raise on failure and leave error reporting to the caller.
+    """
+
+    name = "base"
+
+    def retry_policy(self, error):
+        """``(retryable, retry_after seconds or None)`` for a failed call"""
+        return isinstance(error, (TimeoutError, ConnectionError)), None
+
+    def complete(self, messages, model, max_tokens, temperature, timeout=None, seed=None, response_format=None):
+        raise NotImplementedError
+
+    async def acomplete(self, messages, model, max_tokens, temperature, timeout=None, seed=None,
+                        response_format=None):
+        """``complete`` for the async serving path; runs the sync call in a thread unless overridden"""
+        return await asyncio.to_thread(self.complete, messages, model, max_tokens, temperature, timeout, seed,
+                                       response_format)
+
+    def stream(self, messages, model, max_tokens, temperature, timeout=None):
+        raise NotImplementedError
+
+    async def aclose(self):
+        pass
+
+
+class OpenAIBackend(LLMBackend):
+    """The chat-completions API, or anything that speaks it at ``base_url``.
+
+    The sync client is built on first use and the async one on first
+    ``acomplete``, each per process, so gunicorn workers never share a
+    connection pool inherited over fork. The async client runs on an httpx
+    pool with keep-alive and HTTP/2 (when the ``h2`` package is installed),
+    so one event loop can multiplex many in-flight completions.
+    """
+
+    name = "openai"
+
+    def __init__(self, client=None, max_connections=100, max_keepalive=20, keepalive_expiry=30.0,
+                 **client_options):
+        self._client = client
+        self._client_pid = os.getpid() if client is not None else None
+        self._async_client = None
+        self._async_pid = None
+        self.client_options = client_options
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+
+    @property
+    def _openai(self):
+        # Importing openai costs a few hundred ms, so it waits for the first call
+        import openai
+        return openai
+
+    @property
+    def client(self):
+        if self._client is None or self._client_pid != os.getpid():
+            self._client = self._openai.OpenAI(**self.client_options)
+            self._client_pid = os.getpid()
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None or self._async_pid != os.getpid():
+            import httpx
+            try:
+                import h2  # noqa: F401
+                http2 = True
+            except ImportError:
+                http2 = False
+            http_client = httpx.AsyncClient(
+                http2=http2,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_keepalive,
+                                    keepalive_expiry=self.keepalive_expiry),
+                timeout=httpx.Timeout(600.0, connect=10.0),
+                follow_redirects=True
+            )
+            self._async_client = self._openai.AsyncOpenAI(http_client=http_client, **self.client_options)
+            self._async_pid = os.getpid()
+        return self._async_client
+
+    def retry_policy(self, error):
+        openai = self._openai
+        if isinstance(error, openai.APIConnectionError):  # includes timeouts
+            return True, None
+        if not isinstance(error, openai.APIStatusError):
+            return False, None
+        retryable = error.status_code in RETRYABLE_STATUS
+        return retryable, retry_after(error.response.headers) if error.status_code == 429 else None
+
+    def complete(self, messages, model, max_tokens, temperature, timeout=None, seed=None, response_format=None):
+        response = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout,
+            **self._options(seed, response_format)
+        )
+        return self._completion(response)
+
+    async def acomplete(self, messages, model, max_tokens, temperature, timeout=None, seed=None,
+                        response_format=None):
+        response = await self.async_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout,
+            **self._options(seed, response_format)
+        )
+        return self._completion(response)
+
+    @staticmethod
+    def _options(seed, response_format):
+        options = {}
+        if seed is not None:
+            options["seed"] = seed
+        if response_format is not None:
+            # e.g. {"type": "json_object"}; needs a model that supports JSON mode
+            options["response_format"] = response_format
+        return options
+
+    @staticmethod
+    def _completion(response):
+        if not response or not getattr(response, "choices", None):
+            raise ValueError("Invalid API response structure")
+        usage = response.usage
+        return Completion(
+            response.choices[0].message.content or "",
+            usage.prompt_tokens if usage else 0,
+            usage.completion_tokens if usage else 0,
+        )
+
+    async def aclose(self):
+        if self._async_client is not None and self._async_pid == os.getpid():
+            await self._async_client.close()
+            self._async_client = None
+
+    def stream(self, messages, model, max_tokens, temperature, timeout=None):
+        stream = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout,
+            stream=True
+        )
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        finally:
+            # Also runs when the consumer stops early, so the connection isn't left streaming
+            stream.response.close()
+
+
+class ReplayBackend(LLMBackend):
+    """Serves completions recorded in a JSONL file.
+
+    With ``record_to`` set, misses are forwarded to that backend and the
+    result is appended to the file, so a session against the real API can be
+    replayed offline later. Without it a miss raises LookupError.
+    """
+
+    name = "replay"
+
+    def __init__(self, path, record_to=None, chunk_size=64):
+        self.path = path
+        self.record_to = record_to
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._recordings = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._recordings[record["key"]] = record
+        logger.info(f"Loaded {len(self._recordings)} recorded completions from {path}")
+
+    def retry_policy(self, error):
+        if self.record_to is not None:
+            return self.record_to.retry_policy(error)
+        return super().retry_policy(error)
+
+    @staticmethod
+    def key(messages, model, max_tokens, temperature, seed=None, response_format=None):
+        # Only set when used, so earlier recordings keep their keys
+        extra = {"response_format": response_format} if response_format is not None else {}
+        return make_key(json.dumps(messages, sort_keys=True), model, max_tokens, temperature=temperature, seed=seed,
+                        **extra)
+
+    def complete(self, messages, model, max_tokens, temperature, timeout=None, seed=None, response_format=None):
+        key = self.key(messages, model, max_tokens, temperature, seed, response_format)
+        record = self._recordings.get(key)
+        if record is not None:
+            return Completion(record["text"], record.get("prompt_tokens", 0), record.get("completion_tokens", 0))
+        if self.record_to is None:
+            raise LookupError(f"No recorded completion for key {key[:12]}")
+
+        completion = self.record_to.complete(messages, model, max_tokens, temperature, timeout=timeout, seed=seed,
+                                             response_format=response_format)
+        record = {
+            "key": key,
+            "model": model,
+            "prompt": messages[-1]["content"],
+            "text": completion.text,
+            "prompt_tokens": completion.prompt_tokens,
+            "completion_tokens": completion.completion_tokens,
+        }
+        with self._lock:
+            self._recordings[key] = record
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+        return completion
+
+    async def aclose(self):
+        if self.record_to is not None:
+            await self.record_to.aclose()
+
+    def stream(self, messages, model, max_tokens, temperature, timeout=None):
+        text = self.complete(messages, model, max_tokens, temperature, timeout=timeout).text
+        for start in range(0, len(text), self.chunk_size):
+            yield text[start:start + self.chunk_size]
+
+
+def create_backend(name="openai", replay_path=None, base_url=None, max_retries=None):
+    """Build a backend by name: ``openai``, ``fake`` (local stand-in server),
+    ``replay`` (recordings only) or ``record`` (replay, recording misses from OpenAI).
+
+    ``max_retries`` overrides the OpenAI client's own retries, e.g. 0 when
+    the scheduler retries instead.
+    """
+    name = name.lower()
+    options = {"max_retries": max_retries} if max_retries is not None else {}
+    if name == "openai":
+        return OpenAIBackend(**options, **({"base_url": base_url} if base_url else {}))
+    if name == "fake":
+        # The stand-in doesn't check keys; client retries stay as in production
+        return OpenAIBackend(base_url=base_url or FAKE_OPENAI_URL, api_key=os.getenv("OPENAI_API_KEY") or "fake",
+                             **options)
+    if name in ("replay", "record"):
+        if not replay_path:
+            raise ValueError(f"LLM backend '{name}' needs a recordings path")
+        return ReplayBackend(replay_path, record_to=OpenAIBackend(**options) if name == "record" else None)
+    raise ValueError(f"Unknown LLM backend '{name}', expected one of: {', '.join(BACKENDS)}")
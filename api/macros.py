@@ -0,0 +1,248 @@
+"""Macro verification for parsed plans, vectorized with NumPy.
+
+Meal macros are packed into a plans x days x meals x (protein, carbs, fats)
+array of grams (NaN where a meal or its macros line is missing). Calories are
+derived from the grams, and daily totals and their relative deviation from
+the plan's CALORIES/PROTEIN/CARBS/FATS targets are computed in one pass, for
+one plan or thousands of stored ones.
+
+Usage: python -m api.macros [--tolerance 0.15] [--limit N] [--worst 10]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+
+from api.pipeline import Stage, StageError, run_stages
+from api.plan_model import MEAL_SLOTS, Day, Plan
+from api.swap import replace_day, target_calories, target_grams
+from api.targets import KCAL_PER_GRAM
+
+logger = logging.getLogger(__name__)
+
+MACROS = ("protein", "carbs", "fats")
+# Columns of the totals, targets and deviation arrays
+TOTALS = ("calories",) + MACROS
+SLOT_INDEX = {slot: index for index, slot in enumerate(MEAL_SLOTS)}
+DEFAULT_TOLERANCE = 0.15
+
+
+def plan_arrays(plans, day_count=7):
+    """Meal grams (plans x days x meals x 3) and targets (plans x 4: calories and grams, NaN if unknown)"""
+    meals = np.full((len(plans), day_count, len(MEAL_SLOTS), len(MACROS)), np.nan)
+    targets = np.full((len(plans), len(TOTALS)), np.nan)
+    index, values = [], []
+    for p, plan in enumerate(plans):
+        for day in plan.days:
+            if not 1 <= day.number <= day_count:
+                continue
+            for meal in day.meals:
+                slot = SLOT_INDEX.get(meal.slot)
+                if slot is not None and meal.has_macros:
+                    index.append((p, day.number - 1, slot))
+                    values.append((meal.protein, meal.carbs, meal.fats))
+        grams = target_grams(plan.targets)
+        calories = target_calories(plan.targets)
+        if grams:
+            targets[p, 1:] = [grams[macro] for macro in MACROS]
+        if calories:
+            targets[p, 0] = calories
+    if index:
+        p, d, s = np.array(index).T
+        meals[p, d, s] = values
+    return meals, targets
+
+
+def verify_arrays(meals, targets, tolerance=DEFAULT_TOLERANCE):
+    """Daily totals and deviations for a batch of plans.
+
+    Returns a dict of arrays: ``totals`` (plans x days x 4: calories, protein,
+    carbs, fats), ``deviation`` (same shape, relative to the target, NaN
+    where the target is unknown), ``complete`` (plans x days: every slot has
+    macros), ``within`` (complete and every known deviation within
+    ``tolerance``), ``error`` (plans x days: the largest absolute deviation)
+    and per plan ``score`` (share of days within tolerance) and
+    ``mean_abs_deviation`` (plans x 4).
+    """
+    present = ~np.isnan(meals).any(axis=-1)
+    grams = np.nansum(meals, axis=2)
+    totals = np.concatenate(((grams @ KCAL_PER_GRAM)[..., None], grams), axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        deviation = (totals - targets[:, None, :]) / targets[:, None, :]
+    magnitude = np.abs(deviation)
+    known = ~np.isnan(magnitude)
+    error = np.where(known, magnitude, 0.0).max(axis=-1)
+    complete = present.all(axis=-1)
+    within = complete & (error <= tolerance)
+    # Days without any meal (a short plan) don't count towards the score
+    scored = present.any(axis=-1)
+    days = np.maximum(scored.sum(axis=-1), 1)
+    mean_abs_deviation = _nanmean(np.where(scored[..., None], magnitude, np.nan), axis=1)
+    return {
+        "totals": totals,
+        "deviation": deviation,
+        "complete": complete,
+        "within": within,
+        "error": np.where(complete, error, np.inf),
+        "score": (within & scored).sum(axis=-1) / days,
+        "mean_abs_deviation": mean_abs_deviation,
+    }
+
+
+def _nanmean(values, axis):
+    """np.nanmean without the warning for all-NaN slices"""
+    known = ~np.isnan(values)
+    count = known.sum(axis=axis)
+    total = np.where(known, values, 0.0).sum(axis=axis)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(count > 0, total / count, np.nan)
+
+
+def _rounded(value, digits):
+    return None if np.isnan(value) else round(float(value), digits)
+
+
+def verify_plan(plan, tolerance=DEFAULT_TOLERANCE):
+    """Per-day totals and deviations for one plan, as plain values"""
+    day_count = max([day.number for day in plan.days] + [1])
+    meals, targets = plan_arrays([plan], day_count)
+    result = verify_arrays(meals, targets, tolerance)
+    days = []
+    for day in plan.days:
+        i = day.number - 1
+        days.append({
+            "day": day.number,
+            "totals": {name: round(float(value)) for name, value in zip(TOTALS, result["totals"][0, i])},
+            "deviation": {name: _rounded(value, 3) for name, value in zip(TOTALS, result["deviation"][0, i])},
+            "complete": bool(result["complete"][0, i]),
+            "within": bool(result["within"][0, i]),
+            # None for an incomplete day
+            "error": _rounded(result["error"][0, i], 3) if result["complete"][0, i] else None,
+        })
+    return {
+        "targets": {name: _rounded(value, 1) for name, value in zip(TOTALS, targets[0])},
+        "tolerance": tolerance,
+        "days": days,
+        "off_target": [day["day"] for day in days if not day["within"]],
+        "score": float(result["score"][0]),
+    }
+
+
+def day_targets(plan):
+    """The plan's daily targets as {"calories", "protein", "carbs", "fats"}, or None"""
+    grams = target_grams(plan.targets)
+    calories = target_calories(plan.targets)
+    if not grams:
+        return None
+    targets = {macro: round(grams[macro]) for macro in MACROS}
+    targets["calories"] = round(calories if calories else float(np.dot(list(targets.values()), KCAL_PER_GRAM)))
+    return targets
+
+
+def rebalance_days(plan, generate_day, tolerance=DEFAULT_TOLERANCE, max_days=2, timeout=None):
+    """Regenerate only the days outside ``tolerance``, concurrently, and patch them into ``plan``.
+
+    Days are taken worst first, up to ``max_days``. ``generate_day(day_number,
+    targets)`` returns a Day (or raises); it replaces the old one only if it's
+    complete and closer to the targets. Returns (report before, replaced day numbers).
+    """
+    report = verify_plan(plan, tolerance)
+    targets = day_targets(plan)
+    if targets is None or not report["off_target"]:
+        return report, []
+    errors = {day["day"]: float("inf") if day["error"] is None else day["error"] for day in report["days"]}
+    worst = sorted(report["off_target"], key=lambda number: -errors[number])[:max_days]
+
+    def run(number):
+        try:
+            return generate_day(number, targets)
+        except Exception as e:
+            logger.error(f"Error regenerating day {number}: {str(e)}")
+            return None
+
+    stages = [Stage(f"rebalance_{number}", lambda number=number: run(number), timeout=timeout) for number in worst]
+    try:
+        results = run_stages(stages)
+    except StageError as e:
+        logger.error(f"Day rebalancing stopped: {e.message}")
+        return report, []
+
+    candidates = [(number, results.get(f"rebalance_{number}")) for number in worst]
+    candidates = [(number, day) for number, day in candidates if day is not None and not day.missing_slots]
+    if not candidates:
+        return report, []
+    # Score every candidate day in one pass, as one-day plans with the same targets
+    meals, candidate_targets = plan_arrays([Plan(plan.targets, [Day(1, meals=day.meals)]) for _, day in candidates],
+                                           1)
+    new_errors = verify_arrays(meals, candidate_targets, tolerance)["error"][:, 0]
+    replaced = []
+    for (number, day), new_error in zip(candidates, new_errors):
+        if new_error < errors[number]:
+            day.number, day.title = number, f"DAY {number}:"
+            replace_day(plan, day)
+            replaced.append(number)
+    return report, replaced
+
+
+def score_plans(plans, tolerance=DEFAULT_TOLERANCE, day_count=7):
+    """``verify_arrays`` for a list of plans"""
+    meals, targets = plan_arrays(plans, day_count)
+    return verify_arrays(meals, targets, tolerance)
+
+
+def score_store(store, tolerance=DEFAULT_TOLERANCE, chunk_size=1000, limit=None, worst=10):
+    """Score every stored plan, ``chunk_size`` plans per vectorized pass; returns a summary dict"""
+    scores, deviations, ids = [], [], []
+    chunk = []
+
+    def flush():
+        if chunk:
+            result = score_plans([stored.plan for stored in chunk], tolerance)
+            scores.append(result["score"])
+            deviations.append(result["mean_abs_deviation"])
+            ids.extend(stored.id for stored in chunk)
+            chunk.clear()
+
+    for count, stored in enumerate(store.iter_plans(), 1):
+        chunk.append(stored)
+        if len(chunk) >= chunk_size:
+            flush()
+        if limit and count >= limit:
+            break
+    flush()
+    if not ids:
+        return {"plans": 0}
+    scores = np.concatenate(scores)
+    deviations = np.concatenate(deviations)
+    mean_deviation = _nanmean(deviations, axis=0)
+    order = np.argsort(scores, kind="stable")[:worst]
+    return {
+        "plans": len(ids),
+        "tolerance": tolerance,
+        "mean_score": round(float(scores.mean()), 4),
+        "plans_fully_within": int((scores == 1.0).sum()),
+        "mean_abs_deviation": {name: _rounded(value, 4) for name, value in zip(TOTALS, mean_deviation)},
+        "worst": [{"plan_id": ids[i], "score": round(float(scores[i]), 4)} for i in order],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score stored plans' daily macros against their targets")
+    parser.add_argument("--tolerance", type=float, default=float(os.getenv('MACRO_TOLERANCE', DEFAULT_TOLERANCE)),
+                        help="allowed relative deviation per day")
+    parser.add_argument("--limit", type=int, help="only score this many plans")
+    parser.add_argument("--worst", type=int, default=10, help="list this many lowest-scoring plans")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
+    # The app's configuration decides where plans are stored
+    from api.generate_meal_plan import plan_store
+    print(json.dumps(score_store(plan_store(), args.tolerance, limit=args.limit, worst=args.worst), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,281 @@
+import logging
+import os
+import queue
+import random
+import smtplib
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing, contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Errors that will never succeed on retry
+PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPAuthenticationError)
+
+
+class _PooledConnection:
+    __slots__ = ("server", "last_used", "uses")
+
+    def __init__(self, server):
+        self.server = server
+        self.last_used = time.monotonic()
+        self.uses = 0
+
+
+class SMTPConnectionPool:
+    """Pool of authenticated SMTP connections that are reused between messages.
+
+    Connections idle for longer than ``max_idle`` seconds are checked with a
+    NOOP before reuse and reconnected if the server dropped them. A connection
+    is retired after ``max_uses`` messages or on any connection error.
+    ``on_connect(seconds)`` is called with the time each new connection took
+    to connect, upgrade and log in.
+    """
+
+    def __init__(self, host, port, username=None, password=None, starttls=True,
+                 size=2, max_idle=30, max_uses=100, timeout=30, on_connect=None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.size = size
+        self.max_idle = max_idle
+        self.max_uses = max_uses
+        self.timeout = timeout
+        self.on_connect = on_connect
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        start = time.perf_counter()
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        server.ehlo()
+        if self.starttls:
+            server.starttls()
+            server.ehlo()
+        if self.username and server.has_extn('auth'):
+            server.login(self.username, self.password)
+        logger.debug(f"Opened SMTP connection to {self.host}:{self.port}")
+        if self.on_connect:
+            self.on_connect(time.perf_counter() - start)
+        return _PooledConnection(server)
+
+    def _checkout(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - conn.last_used < self.max_idle:
+                return conn
+            try:
+                if conn.server.noop()[0] == 250:
+                    return conn
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._close(conn)
+
+    def _close(self, conn):
+        try:
+            conn.server.quit()
+        except (smtplib.SMTPException, OSError):
+            conn.server.close()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connected ``smtplib.SMTP`` instance"""
+        self._slots.acquire()
+        conn = None
+        healthy = False
+        try:
+            conn = self._checkout()
+            yield conn.server
+            healthy = True
+        except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+            # The server answered, so the connection itself is still usable
+            healthy = True
+            raise
+        finally:
+            if conn is not None:
+                conn.uses += 1
+                conn.last_used = time.monotonic()
+                if healthy and conn.uses < self.max_uses:
+                    self._idle.put(conn)
+                else:
+                    self._close(conn)
+            self._slots.release()
+
+    def close(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+class Outbox:
+    """Durable SQLite outbox drained by background sender threads.
+
+    Messages are persisted before ``enqueue`` returns, so a request never waits
+    on SMTP and a crash doesn't lose a generated plan. Failed sends are retried
+    with jittered exponential backoff up to ``max_attempts`` times.
+    ``on_send(outcome, seconds)`` is called after every attempt with
+    ``'sent'``, ``'retry'`` or ``'failed'``.
+    """
+
+    def __init__(self, db_path, pool_factory, workers=2, max_attempts=6,
+                 base_delay=5, max_delay=900, lease_seconds=120, poll_interval=1.0,
+                 retention_seconds=7 * 24 * 3600, on_send=None):
+        self.db_path = db_path
+        self.pool_factory = pool_factory
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        self.on_send = on_send
+        self.pool = None
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id TEXT PRIMARY KEY,
+                    sender TEXT NOT NULL,
+                    recipient TEXT NOT NULL,
+                    message BLOB,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+
+    def start(self):
+        """Start the sender threads for this process (idempotent, fork-safe)"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            # Sockets inherited from a parent process must not be shared
+            self.pool = self.pool_factory()
+            for i in range(self.workers):
+                threading.Thread(target=self._work, name=f"outbox-{i}", daemon=True).start()
+
+    def enqueue(self, msg, sender, recipient):
+        """Persist an email.message.Message for delivery and return its id"""
+        self.start()
+        # Serialize with CRLF line endings, as SMTP.send_message would
+        data = msg.as_bytes(policy=msg.policy.clone(linesep='\r\n'))
+        now = time.time()
+        message_id = uuid.uuid4().hex
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO outbox (id, sender, recipient, message, status, next_attempt_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'pending', ?, ?, ?)",
+                (message_id, sender, recipient, data, now, now, now)
+            )
+            conn.execute("DELETE FROM outbox WHERE status IN ('sent', 'failed') AND updated_at < ?",
+                         (now - self.retention_seconds,))
+        self._wakeup.set()
+        return message_id
+
+    def status(self, message_id):
+        """Delivery status of a message, or None if it doesn't exist"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT status, attempts, last_error FROM outbox WHERE id = ?",
+                               (message_id,)).fetchone()
+        if row is None:
+            return None
+        return {"status": row[0], "attempts": row[1], "error": row[2]}
+
+    def _claim(self):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, sender, recipient, message, attempts FROM outbox "
+                "WHERE status IN ('pending', 'sending') AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is not None:
+                # 'sending' rows come back after the lease if the sender died mid-delivery
+                conn.execute(
+                    "UPDATE outbox SET status = 'sending', attempts = attempts + 1, "
+                    "next_attempt_at = ?, updated_at = ? WHERE id = ?",
+                    (now + self.lease_seconds, now, row[0])
+                )
+            conn.execute("COMMIT")
+        return row
+
+    def _finish(self, message_id, status, error=None, next_attempt_at=None):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE outbox SET status = ?, last_error = ?, next_attempt_at = ?, updated_at = ?, "
+                "message = CASE WHEN ? IN ('sent', 'failed') THEN NULL ELSE message END WHERE id = ?",
+                (status, error, next_attempt_at or now, now, status, message_id)
+            )
+
+    def _backoff(self, attempts):
+        delay = min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+        return delay * random.uniform(0.5, 1.0)
+
+    def _work(self):
+        while True:
+            try:
+                row = self._claim()
+            except sqlite3.Error as e:
+                logger.error(f"Outbox error: {str(e)}")
+                row = None
+
+            if row is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            message_id, sender, recipient, message, attempts = row
+            attempts += 1
+            start = time.perf_counter()
+            try:
+                with self.pool.connection() as server:
+                    server.sendmail(sender, [recipient], message)
+            except PERMANENT_ERRORS as e:
+                logger.error(f"Email {message_id} permanently failed: {str(e)}")
+                self._finish(message_id, 'failed', str(e))
+                outcome = 'failed'
+            except Exception as e:
+                if attempts >= self.max_attempts:
+                    logger.error(f"Email {message_id} failed after {attempts} attempts: {str(e)}")
+                    self._finish(message_id, 'failed', str(e))
+                    outcome = 'failed'
+                else:
+                    delay = self._backoff(attempts)
+                    logger.warning(f"Email {message_id} attempt {attempts} failed, retrying in {delay:.0f}s: {str(e)}")
+                    self._finish(message_id, 'pending', str(e), time.time() + delay)
+                    outcome = 'retry'
+            else:
+                logger.debug(f"Email {message_id} sent")
+                self._finish(message_id, 'sent')
+                outcome = 'sent'
+            if self.on_send:
+                self.on_send(outcome, time.perf_counter() - start)
@@ -0,0 +1,163 @@
+"""In-memory index over the meal library, and plan assembly from it.
+
+Each meal is listed under its slot, its cooking level and every lexicon
+category it contains, as sorted position arrays (an inverted index), so the
+meals a profile may eat come from a few set operations. Those are ranked by
+distance from a macro budget (nearest neighbour on the protein/carbs/fats
+vector, relative to the budget), so picking a meal stays a handful of array
+operations however many meals the library holds.
+"""
+import random
+
+import numpy as np
+
+from api.compliance import check_meal
+from api.plan_model import MEAL_SLOTS, Day, Meal
+from api.swap import MACROS, MIN_SHARE
+from api.targets import KCAL_PER_GRAM
+
+# Share of the day's targets each slot aims for
+SLOT_SHARES = {"Breakfast": 0.25, "Lunch": 0.3, "Dinner": 0.3, "Snacks": 0.15}
+# Budgets below this many grams count as this many, so a small fat budget doesn't dominate the distance
+MIN_SCALE = 10.0
+EMPTY = np.empty(0, dtype=np.int64)
+
+
+class MealIndex:
+    """Library meals with their macros as an n x 3 array and an inverted index of tags.
+
+    Tags are ``slot:<slot>``, ``cooking:<level>`` and ``contains:<category>``.
+    ``last_id`` is the library row id the index was loaded up to.
+    """
+    __slots__ = ("meals", "macros", "postings", "last_id")
+
+    def __init__(self, meals, cooking, categories, last_id=0):
+        self.meals = meals
+        self.macros = np.array([(meal.protein, meal.carbs, meal.fats) for meal in meals],
+                               dtype=float).reshape(len(meals), len(MACROS))
+        self.last_id = last_id
+        postings = {}
+        for position, (meal, level, names) in enumerate(zip(meals, cooking, categories)):
+            postings.setdefault(f"slot:{meal.slot}", []).append(position)
+            postings.setdefault(f"cooking:{level}", []).append(position)
+            for name in names:
+                postings.setdefault(f"contains:{name}", []).append(position)
+        self.postings = {tag: np.array(positions, dtype=np.int64) for tag, positions in postings.items()}
+
+    def __len__(self):
+        return len(self.meals)
+
+    def slot_counts(self):
+        return {slot: len(self.postings.get(f"slot:{slot}", EMPTY)) for slot in MEAL_SLOTS}
+
+    def candidates(self, slot, restrictions, level):
+        """Positions of ``slot`` meals free of the restricted categories, written for ``level`` or less cooking"""
+        positions = self.postings.get(f"slot:{slot}", EMPTY)
+        allowed = np.concatenate([self.postings.get(f"cooking:{cooking}", EMPTY) for cooking in range(level + 1)])
+        positions = np.intersect1d(positions, allowed, assume_unique=True)
+        for category in restrictions.categories:
+            excluded = self.postings.get(f"contains:{category}")
+            if excluded is not None:
+                positions = np.setdiff1d(positions, excluded, assume_unique=True)
+        return positions
+
+    def nearest(self, positions, budget, restrictions, count=1):
+        """Up to ``count`` (position, distance) pairs out of ``positions``, closest to ``budget`` first.
+
+        ``budget`` is grams of protein, carbs and fats; ``positions`` usually comes from ``candidates``.
+        """
+        if not len(positions):
+            return []
+        budget = np.asarray(budget, dtype=float)
+        distance = (((self.macros[positions] - budget) / np.maximum(budget, MIN_SCALE)) ** 2).sum(axis=1)
+        if restrictions.extra_terms:
+            # Free-text allergies aren't indexed; check meals nearest first until enough pass
+            order = np.argsort(distance, kind="stable")
+        else:
+            order = np.argpartition(distance, count - 1)[:count] if len(distance) > count else np.arange(len(distance))
+            order = order[np.argsort(distance[order], kind="stable")]
+        found = []
+        for i in order:
+            position = int(positions[i])
+            if restrictions.extra_terms and check_meal(self.meals[position], restrictions):
+                continue
+            found.append((position, float(distance[i])))
+            if len(found) >= count:
+                break
+        return found
+
+
+def _grams(targets):
+    return np.array([targets[macro] for macro in MACROS], dtype=float)
+
+
+def _day_error(grams, target):
+    """Largest relative deviation of the day's calories and macros from the targets"""
+    totals = np.append(grams @ KCAL_PER_GRAM, grams)
+    expected = np.append(target @ KCAL_PER_GRAM, target)
+    return float(np.max(np.abs(totals - expected) / expected))
+
+
+def assemble_days(index, targets, restrictions, level, day_count=7, tolerance=0.15, choices=3, fresh=0, seed=0):
+    """Fill a plan's days from the library, leaving gaps for the model.
+
+    ``targets`` are daily grams of protein, carbs and fats. Each slot's budget
+    is what the day's earlier meals leave of the targets, split by
+    ``SLOT_SHARES`` among the slots still open. One of the ``choices`` nearest
+    meals is picked (seeded, so identical profiles get the same plan) and no
+    meal is used twice in a plan. Slots nothing fits, the worst-fitting meal of
+    a day still more than ``tolerance`` off the targets, and ``fresh`` random
+    slots (for variety, and so the library keeps growing) are left as gaps.
+    Returns (days, gaps as (day number, slot) pairs).
+    """
+    rng = random.Random(seed)
+    target = _grams(targets)
+    candidates = {slot: index.candidates(slot, restrictions, level) for slot in MEAL_SLOTS}
+    available = np.ones(len(index), dtype=bool)
+    days, gaps = [], []
+    for number in range(1, day_count + 1):
+        day = Day(number)
+        remaining = target.copy()
+        open_share = sum(SLOT_SHARES.values())
+        fits = []
+        for slot in MEAL_SLOTS:
+            share = SLOT_SHARES[slot]
+            budget = np.maximum(remaining * share / open_share, target * share * MIN_SHARE)
+            positions = candidates[slot]
+            found = index.nearest(positions[available[positions]], budget, restrictions, choices)
+            if not found:
+                # Its share stays reserved for the meal the model writes
+                gaps.append((number, slot))
+                continue
+            position, distance = rng.choice(found)
+            available[position] = False
+            day.meals.append(Meal.from_dict(index.meals[position].to_dict()))
+            remaining -= index.macros[position]
+            open_share -= share
+            fits.append((distance, slot, position))
+        if len(fits) == len(MEAL_SLOTS) and _day_error(target - remaining, target) > tolerance:
+            _, slot, position = max(fits)
+            day.meals.remove(day.meal(slot))
+            available[position] = True
+            gaps.append((number, slot))
+        days.append(day)
+
+    filled = [(day.number, meal.slot) for day in days for meal in day.meals]
+    for number, slot in rng.sample(filled, min(fresh, len(filled))):
+        days[number - 1].meals.remove(days[number - 1].meal(slot))
+        gaps.append((number, slot))
+    order = {slot: i for i, slot in enumerate(MEAL_SLOTS)}
+    return days, sorted(gaps, key=lambda gap: (gap[0], order[gap[1]]))
+
+
+def gap_budgets(day, targets):
+    """Grams each missing slot of ``day`` should provide: what its meals leave of ``targets``, split by share"""
+    target = _grams(targets)
+    remaining = target - sum((np.array([meal.protein, meal.carbs, meal.fats]) for meal in day.meals
+                              if meal.has_macros), np.zeros(len(MACROS)))
+    missing = [slot for slot in MEAL_SLOTS if day.meal(slot) is None]
+    open_share = sum(SLOT_SHARES[slot] for slot in missing)
+    return {slot: {macro: round(float(grams)) for macro, grams in
+                   zip(MACROS, np.maximum(remaining * SLOT_SHARES[slot] / open_share,
+                                          target * SLOT_SHARES[slot] * MIN_SHARE))}
+            for slot in missing}
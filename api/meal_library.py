@@ -0,0 +1,213 @@
+"""Meals of past plans, kept so new plans can reuse them instead of asking the model.
+
+Every complete meal of a delivered plan is stored once per slot and name in
+SQLite, with the lexicon categories it contains (see ``api.compliance``),
+the cooking time of the profile it was written for, and its macros. Queries
+go through an in-memory ``MealIndex`` (``api.meal_index``) that is rebuilt
+when other workers have added meals.
+
+Usage: python -m api.meal_library [--rebuild]
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import closing
+
+from api.compliance import LEXICON, Restrictions, check_text, meal_text, tokenize
+from api.plan_model import MEAL_SLOTS, Meal
+
+logger = logging.getLogger(__name__)
+
+# Questionnaire answers, shortest first; a meal written for one fits every profile from there on
+COOKING_TIMES = ("minimal", "moderate", "flexible")
+EVERY_CATEGORY = Restrictions(LEXICON)
+
+
+def cooking_level(cooking_time):
+    """Position of a cooking time answer in ``COOKING_TIMES``; unknown answers count as the longest"""
+    answer = str(cooking_time or '').strip().lower()
+    return COOKING_TIMES.index(answer) if answer in COOKING_TIMES else len(COOKING_TIMES) - 1
+
+
+def meal_key(meal):
+    """Slot and normalized name; meals sharing it are stored once"""
+    return f"{meal.slot}:{b' '.join(tokenize(meal.name or '')).decode('utf-8', 'replace')}"
+
+
+def meal_categories(meal):
+    """Lexicon categories the meal contains, e.g. ["DAIRY", "GLUTEN"]"""
+    return sorted({category for category, _ in check_text(meal_text(meal), EVERY_CATEGORY)})
+
+
+class MealLibrary:
+    """Complete meals from past plans in SQLite, plus a lazily built in-memory index.
+
+    ``index()`` reloads at most every ``refresh_interval`` seconds, and only
+    when meals were added since the last load. Beyond ``max_meals`` the
+    oldest meals are evicted.
+    """
+
+    def __init__(self, db_path, max_meals=20000, refresh_interval=60, enabled=True):
+        self.db_path = db_path
+        self.max_meals = max_meals
+        self.refresh_interval = refresh_interval
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._index = None
+        self._checked_at = 0.0
+        self._adds_since_evict = 0
+        self.counters = {"plans": 0, "meals": 0, "loads": 0, "errors": 0}
+        if enabled:
+            self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS meals (
+                    id INTEGER PRIMARY KEY,
+                    key TEXT NOT NULL UNIQUE,
+                    slot TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    description TEXT NOT NULL,
+                    protein REAL NOT NULL,
+                    carbs REAL NOT NULL,
+                    fats REAL NOT NULL,
+                    cooking INTEGER NOT NULL,
+                    categories TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+
+    def add_plan(self, plan, user_profile):
+        """Store the plan's complete meals; returns how many rows changed. Failures are logged, never raised"""
+        if not self.enabled:
+            return 0
+        level = cooking_level(user_profile.get('cooking_time') if isinstance(user_profile, dict) else None)
+        now = time.time()
+        rows = [(meal_key(meal), meal.slot, meal.name, meal.description, meal.protein, meal.carbs, meal.fats,
+                 level, ",".join(meal_categories(meal)), now)
+                for day in plan.days for meal in day.meals
+                if meal.slot in MEAL_SLOTS and meal.name and meal.description and meal.has_macros]
+        if not rows:
+            return 0
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                before = conn.total_changes
+                # A meal seen again from a profile with less cooking time becomes available to that profile too
+                conn.executemany(
+                    "INSERT INTO meals (key, slot, name, description, protein, carbs, fats, cooking, categories, "
+                    "created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET cooking = excluded.cooking "
+                    "WHERE excluded.cooking < meals.cooking",
+                    rows
+                )
+                added = conn.total_changes - before
+                conn.execute("COMMIT")
+                with self._lock:
+                    self.counters["plans"] += 1
+                    self.counters["meals"] += added
+                    self._adds_since_evict += 1
+                    evict = self._adds_since_evict >= 50
+                    if evict:
+                        self._adds_since_evict = 0
+                if evict:
+                    self._evict(conn)
+            return added
+        except sqlite3.Error as e:
+            logger.error(f"Meal library write error: {str(e)}")
+            with self._lock:
+                self.counters["errors"] += 1
+            return 0
+
+    def add_store(self, store):
+        """Add the meals of every plan in a PlanStore; returns (plans, meals added or updated)"""
+        plans = meals = 0
+        for stored in store.iter_plans():
+            plans += 1
+            meals += self.add_plan(stored.plan, stored.profile)
+        return plans, meals
+
+    def _evict(self, conn):
+        conn.execute("DELETE FROM meals WHERE id <= (SELECT MAX(id) FROM meals) - ?", (self.max_meals,))
+
+    @staticmethod
+    def _build(rows, last_id=0):
+        # Deferred: api.meal_index pulls in numpy
+        from api.meal_index import MealIndex
+        meals = [Meal(slot, name, description, protein, carbs, fats)
+                 for slot, name, description, protein, carbs, fats, _, _ in rows]
+        return MealIndex(meals, [row[6] for row in rows], [row[7].split(",") if row[7] else [] for row in rows],
+                         last_id=last_id)
+
+    def _load(self, current):
+        """A new MealIndex, or ``current`` if no meal was added since it was loaded"""
+        with closing(self._connect()) as conn:
+            last_id = conn.execute("SELECT MAX(id) FROM meals").fetchone()[0] or 0
+            if current is not None and last_id == current.last_id:
+                return current
+            rows = conn.execute(
+                "SELECT slot, name, description, protein, carbs, fats, cooking, categories FROM meals "
+                "WHERE id <= ? ORDER BY id", (last_id,)
+            ).fetchall()
+        with self._lock:
+            self.counters["loads"] += 1
+        return self._build(rows, last_id)
+
+    def index(self):
+        """The current MealIndex; empty when the library is disabled or can't be read"""
+        if not self.enabled:
+            return self._build([])
+        now = time.monotonic()
+        with self._lock:
+            index, stale = self._index, now - self._checked_at >= self.refresh_interval
+            if stale:
+                self._checked_at = now
+        if index is not None and not stale:
+            return index
+        try:
+            index = self._load(index)
+        except sqlite3.Error as e:
+            logger.error(f"Meal library read error: {str(e)}")
+            with self._lock:
+                self.counters["errors"] += 1
+            return index if index is not None else self._build([])
+        with self._lock:
+            self._index = index
+        return index
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill the meal library from stored plans and show its size")
+    parser.add_argument("--rebuild", action="store_true", help="add the meals of every stored plan first")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
+    # The app's configuration decides where plans and meals are stored
+    from api.generate_meal_plan import meal_library, plan_store
+    summary = {}
+    if args.rebuild:
+        summary["plans"], summary["changed_meals"] = meal_library().add_store(plan_store())
+    index = meal_library().index()
+    summary["meals"] = len(index)
+    summary["by_slot"] = index.slot_counts()
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
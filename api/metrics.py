@@ -0,0 +1,201 @@
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return f"{value:g}" if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for name, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+class Metrics:
+    """Counters and histograms shared by every gunicorn worker.
+
+    Each process records into memory and a background thread periodically
+    writes a snapshot of it to a SQLite table keyed by pid. ``render`` merges
+    the latest snapshot of every worker (including exited ones, so counters
+    don't go backwards when a worker is recycled) into the Prometheus text
+    format.
+    """
+
+    def __init__(self, db_path, flush_interval=5.0, retention_seconds=7 * 24 * 3600, enabled=True):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.retention_seconds = retention_seconds
+        self.enabled = enabled
+        self._families = {}
+        self._values = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        self._dirty = False
+        if enabled:
+            self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS samples (
+                    pid INTEGER PRIMARY KEY,
+                    snapshot TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    def counter(self, name, documentation):
+        self._families[name] = ("counter", documentation, None)
+
+    def histogram(self, name, documentation, buckets=DURATION_BUCKETS):
+        self._families[name] = ("histogram", documentation, tuple(buckets))
+
+    def _ensure_started(self):
+        # Values inherited from a pre-fork parent belong to the parent's row
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._values = {}
+            self._pid = pid
+            threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        self._ensure_started()
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+            self._dirty = True
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        self._ensure_started()
+        buckets = self._families[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+            self._dirty = True
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the duration of the block, labelled ``outcome="ok"`` or ``"error"``"""
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            yield
+            outcome = "ok"
+        finally:
+            self.observe(name, time.perf_counter() - start, outcome=outcome, **labels)
+
+    def _snapshot(self):
+        with self._lock:
+            self._dirty = False
+            return json.dumps([
+                [name, labels, value if not isinstance(value, list) else [list(value[0]), value[1], value[2]]]
+                for (name, labels), value in self._values.items()
+            ])
+
+    def flush(self):
+        """Write this process's values to the shared table"""
+        if not self.enabled or self._pid != os.getpid():
+            return
+        snapshot = self._snapshot()
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("INSERT OR REPLACE INTO samples (pid, snapshot, updated_at) VALUES (?, ?, ?)",
+                         (self._pid, snapshot, now))
+            conn.execute("DELETE FROM samples WHERE updated_at < ?", (now - self.retention_seconds,))
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.flush_interval)
+            if self._dirty:
+                try:
+                    self.flush()
+                except sqlite3.Error as e:
+                    logger.error(f"Metrics flush error: {str(e)}")
+
+    def collect(self):
+        """Merged values from every worker: {(name, labels): value}"""
+        self.flush()
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT snapshot FROM samples").fetchall()
+        merged = {}
+        for (snapshot,) in rows:
+            for name, labels, value in json.loads(snapshot):
+                if name not in self._families:
+                    continue
+                key = (name, tuple(tuple(pair) for pair in labels))
+                current = merged.get(key)
+                if not isinstance(value, list):
+                    merged[key] = (current or 0) + value
+                elif current is None:
+                    merged[key] = value
+                else:
+                    current[0] = [a + b for a, b in zip(current[0], value[0])]
+                    current[1] += value[1]
+                    current[2] += value[2]
+        return merged
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        if not self.enabled:
+            return ""
+        merged = self.collect()
+        by_family = {}
+        for (name, labels), value in sorted(merged.items()):
+            by_family.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name, (kind, documentation, buckets) in self._families.items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in by_family.get(name, ()):
+                if kind == "counter":
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + (math.inf,), counts + [count - sum(counts)]):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', _format_value(float(bound)))])} "
+                                 f"{cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(float(total))}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
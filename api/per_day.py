@@ -0,0 +1,64 @@
+import logging
+
+from api.pipeline import Stage, StageError, run_stages
+from api.plan_parser import parse_meal_plan
+
+logger = logging.getLogger(__name__)
+
+# Rotated across days so parallel requests with near-identical prompts don't all return the same meals
+CUISINE_THEMES = (
+    "Mediterranean", "Asian-inspired", "Mexican-inspired", "classic comfort food",
+    "Middle Eastern", "Italian-inspired", "fresh and light seasonal",
+)
+
+
+def _groups_of(numbers, size):
+    return [numbers[i:i + size] for i in range(0, len(numbers), size)]
+
+
+def generate_days(build_prompt, complete, day_count=7, group_size=1, max_retries=2, timeout=None, seed=0):
+    """Generate a plan one day (or a small group of days) per request, concurrently.
+
+    ``build_prompt(day_numbers, theme)`` returns the prompt for a group and
+    ``complete(prompt, day_numbers, seed)`` returns the model text, raising on
+    failure. Every day must come back with all four meals; only the days that
+    come back short are regenerated (with a new seed), up to ``max_retries``
+    times. Returns Day records in DAY order.
+    """
+    days = {}
+    missing = list(range(1, day_count + 1))
+    attempt = 0
+
+    while missing:
+        if attempt > max_retries:
+            raise StageError('meal_plan', f"Days {', '.join(map(str, missing))} incomplete after {max_retries} retries")
+
+        def run_group(numbers, attempt=attempt):
+            theme = CUISINE_THEMES[(numbers[0] - 1) % len(CUISINE_THEMES)]
+            text = complete(build_prompt(numbers, theme), numbers, seed + attempt * 1000 + numbers[0])
+            return parse_meal_plan(text)
+
+        group_size_now = group_size if attempt == 0 else 1
+        stages = [
+            Stage(f"days_{'_'.join(map(str, numbers))}", lambda numbers=numbers: run_group(numbers), timeout=timeout)
+            for numbers in _groups_of(missing, group_size_now)
+        ]
+        results = run_stages(stages)
+
+        for stage in stages:
+            numbers = [int(n) for n in stage.name.split('_')[1:]]
+            # The model numbers days itself; trust the position, not the header
+            for number, day in zip(numbers, results[stage.name]):
+                day.number = number
+                day.title = f"DAY {number}:"
+                if not day.missing_slots:
+                    days[number] = day
+
+        short = [number for number in missing if number not in days]
+        if short:
+            logger.warning(f"Regenerating incomplete days: {short}")
+        missing = short
+        attempt += 1
+
+    return [days[number] for number in sorted(days)]
+
@@ -0,0 +1,218 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+logger = logging.getLogger(__name__)
+
+# The pipeline stage the current code runs in, so long calls inside it can give up early
+_stage_scope = contextvars.ContextVar("pipeline_stage", default=None)
+
+
+class StageError(Exception):
+    """Raised when a pipeline stage fails, times out or is cancelled"""
+
+    def __init__(self, stage, message):
+        super().__init__(message)
+        self.stage = stage
+        self.message = message
+
+
+class Stage:
+    """A unit of work in the generation pipeline.
+
+    ``func`` is called with the results of ``deps`` as keyword arguments and
+    must raise (ideally ``StageError``) on failure. ``timeout`` is measured in
+    seconds from the moment the stage starts running.
+    """
+
+    def __init__(self, name, func, deps=(), timeout=None):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.timeout = timeout
+
+
+class _StageScope:
+    """A running stage's deadline and its pipeline's abort flag; ``parent`` is the enclosing stage, if any"""
+    __slots__ = ("deadline", "aborted", "parent")
+
+    def __init__(self, deadline, aborted, parent):
+        self.deadline = deadline
+        self.aborted = aborted
+        self.parent = parent
+
+
+def stage_cancelled():
+    """True when a stage the caller runs in has timed out or its pipeline has aborted.
+
+    ``run_stages`` can't interrupt a thread, so long-running stage code
+    (model calls and their retries) checks this to stop early.
+    """
+    scope = _stage_scope.get()
+    now = time.monotonic()
+    while scope is not None:
+        if scope.aborted.is_set() or (scope.deadline is not None and now >= scope.deadline):
+            return True
+        scope = scope.parent
+    return False
+
+
+def stage_time_left(timeout=None):
+    """``timeout`` capped to what is left of the enclosing stages' timeouts; None when neither bounds it"""
+    scope = _stage_scope.get()
+    now = time.monotonic()
+    while scope is not None:
+        if scope.deadline is not None:
+            left = max(scope.deadline - now, 0.0)
+            timeout = left if timeout is None else min(timeout, left)
+        scope = scope.parent
+    return timeout
+
+
+def run_stages(stages, max_workers=None, on_complete=None):
+    """Run stages concurrently, honouring their dependencies.
+
+    Every stage is started as soon as all of its dependencies have finished.
+    The first failure or timeout cancels everything that has not started yet
+    and is re-raised as a ``StageError`` right away. Threads can't be
+    interrupted, so stages that are already running keep going until they
+    check ``stage_cancelled()`` (model calls do, before every attempt) or
+    return; their results are discarded. ``on_complete`` is called with the name of each
+    stage as it finishes. Stages run in a copy of the caller's context, so
+    context variables (like the active trace span) carry over into them.
+    Returns a dict of stage name -> result.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        missing = [dep for dep in stage.deps if dep not in by_name]
+        if missing:
+            raise ValueError(f"Stage {stage.name} depends on unknown stages: {', '.join(missing)}")
+
+    results = {}
+    running = {}  # future -> (stage, started_at)
+    pending = list(stages)
+    cancelled = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=max_workers or len(stages),
+                                  thread_name_prefix="pipeline")
+
+    def call(stage, kwargs):
+        if cancelled.is_set():
+            raise StageError(stage.name, f"Stage {stage.name} cancelled")
+        deadline = None if stage.timeout is None else time.monotonic() + stage.timeout
+        _stage_scope.set(_StageScope(deadline, cancelled, _stage_scope.get()))
+        result = stage.func(**kwargs)
+        if deadline is not None and time.monotonic() >= deadline:
+            # It may have stopped early because stage_cancelled() said so; don't take that for a result
+            raise StageError(stage.name, f"Stage {stage.name} timed out after {stage.timeout}s")
+        return result
+
+    def submit_ready():
+        for stage in list(pending):
+            if all(dep in results for dep in stage.deps):
+                pending.remove(stage)
+                kwargs = {dep: results[dep] for dep in stage.deps}
+                logger.debug(f"Starting stage {stage.name}")
+                context = contextvars.copy_context()
+                running[executor.submit(context.run, call, stage, kwargs)] = (stage, time.monotonic())
+
+    try:
+        submit_ready()
+        while running:
+            now = time.monotonic()
+            deadlines = [started + stage.timeout - now
+                         for stage, started in running.values() if stage.timeout is not None]
+            done, _ = wait(list(running), timeout=max(min(deadlines), 0) if deadlines else None,
+                           return_when=FIRST_COMPLETED)
+
+            for future in done:
+                stage, started = running.pop(future)
+                try:
+                    results[stage.name] = future.result()
+                except StageError:
+                    raise
+                except Exception as e:
+                    raise StageError(stage.name, f"Stage {stage.name} failed: {str(e)}") from e
+                logger.debug(f"Stage {stage.name} finished in {time.monotonic() - started:.2f}s")
+                if on_complete:
+                    on_complete(stage.name)
+
+            now = time.monotonic()
+            for future, (stage, started) in running.items():
+                if stage.timeout is not None and now - started >= stage.timeout:
+                    raise StageError(stage.name, f"Stage {stage.name} timed out after {stage.timeout}s")
+
+            submit_ready()
+
+        if pending:
+            raise StageError(pending[0].name, f"Stage {pending[0].name} could not be scheduled")
+        return results
+    except StageError as e:
+        logger.error(f"Pipeline aborted: {e.message}")
+        raise
+    finally:
+        cancelled.set()
+        for future in running:
+            future.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def arun_stages(stages, on_complete=None):
+    """``run_stages`` for coroutine stages: ``func`` returns an awaitable.
+
+    Stages are tasks on the running event loop instead of pool threads, and
+    unlike threads they really are cancelled when the pipeline aborts.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        missing = [dep for dep in stage.deps if dep not in by_name]
+        if missing:
+            raise ValueError(f"Stage {stage.name} depends on unknown stages: {', '.join(missing)}")
+
+    results = {}
+    running = {}  # task -> stage
+    pending = list(stages)
+
+    async def call(stage, kwargs):
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(stage.func(**kwargs), stage.timeout)
+        except asyncio.TimeoutError:
+            raise StageError(stage.name, f"Stage {stage.name} timed out after {stage.timeout}s")
+        logger.debug(f"Stage {stage.name} finished in {time.monotonic() - started:.2f}s")
+        return result
+
+    def start_ready():
+        for stage in list(pending):
+            if all(dep in results for dep in stage.deps):
+                pending.remove(stage)
+                logger.debug(f"Starting stage {stage.name}")
+                running[asyncio.ensure_future(call(stage, {dep: results[dep] for dep in stage.deps}))] = stage
+
+    try:
+        start_ready()
+        while running:
+            done, _ = await asyncio.wait(list(running), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                stage = running.pop(task)
+                try:
+                    results[stage.name] = task.result()
+                except StageError:
+                    raise
+                except Exception as e:
+                    raise StageError(stage.name, f"Stage {stage.name} failed: {str(e)}") from e
+                if on_complete:
+                    on_complete(stage.name)
+            start_ready()
+
+        if pending:
+            raise StageError(pending[0].name, f"Stage {pending[0].name} could not be scheduled")
+        return results
+    except StageError as e:
+        logger.error(f"Pipeline aborted: {e.message}")
+        raise
+    finally:
+        for task in running:
+            task.cancel()
@@ -0,0 +1,136 @@
+MEAL_SLOTS = ("Breakfast", "Lunch", "Dinner", "Snacks")
+
+
+class Meal:
+    """One meal of a day; macros are grams, or None when the model omitted them.
+
+    ``warning`` is set on meals that still break the profile's allergies or
+    diet after repair, e.g. "Contains peanut butter (peanut allergy)".
+    """
+    __slots__ = ("slot", "name", "description", "protein", "carbs", "fats", "warning")
+
+    def __init__(self, slot, name=None, description=None, protein=None, carbs=None, fats=None, warning=None):
+        self.slot = slot
+        self.name = name
+        self.description = description
+        self.protein = protein
+        self.carbs = carbs
+        self.fats = fats
+        self.warning = warning
+
+    @property
+    def has_macros(self):
+        return self.protein is not None and self.carbs is not None and self.fats is not None
+
+    def to_dict(self):
+        data = {
+            "slot": self.slot,
+            "name": self.name,
+            "description": self.description,
+            "protein": self.protein,
+            "carbs": self.carbs,
+            "fats": self.fats,
+        }
+        if self.warning:
+            data["warning"] = self.warning
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["slot"], data.get("name"), data.get("description"),
+                   data.get("protein"), data.get("carbs"), data.get("fats"), data.get("warning"))
+
+
+class Day:
+    """A plan day: its meals in the order they were generated plus the day's prep tips"""
+    __slots__ = ("number", "title", "meals", "prep_tips")
+
+    def __init__(self, number, title=None, meals=None, prep_tips=None):
+        self.number = number
+        self.title = title or f"DAY {number}:"
+        self.meals = meals if meals is not None else []
+        self.prep_tips = prep_tips if prep_tips is not None else []
+
+    def meal(self, slot):
+        return next((meal for meal in self.meals if meal.slot == slot), None)
+
+    @property
+    def missing_slots(self):
+        present = {meal.slot for meal in self.meals if meal.description and meal.has_macros}
+        return [slot for slot in MEAL_SLOTS if slot not in present]
+
+    def to_dict(self):
+        return {
+            "number": self.number,
+            "title": self.title,
+            "meals": [meal.to_dict() for meal in self.meals],
+            "prep_tips": list(self.prep_tips),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["number"], data.get("title"),
+                   [Meal.from_dict(meal) for meal in data.get("meals", [])],
+                   list(data.get("prep_tips", [])))
+
+
+class GroceryCategory:
+    __slots__ = ("name", "items")
+
+    def __init__(self, name, items=None):
+        self.name = name
+        self.items = items if items is not None else []
+
+    def to_dict(self):
+        return {"name": self.name, "items": list(self.items)}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["name"], list(data.get("items", [])))
+
+
+class DailyTargets:
+    """Daily calorie range and macro split, kept as display strings"""
+    __slots__ = ("calories", "protein", "carbs", "fats")
+
+    def __init__(self, calories="N/A", protein="N/A", carbs="N/A", fats="N/A"):
+        self.calories = calories
+        self.protein = protein
+        self.carbs = carbs
+        self.fats = fats
+
+    def to_dict(self):
+        return {"calories": self.calories, "protein": self.protein, "carbs": self.carbs, "fats": self.fats}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("calories", "N/A"), data.get("protein", "N/A"),
+                   data.get("carbs", "N/A"), data.get("fats", "N/A"))
+
+
+class Plan:
+    """Everything that goes into a user's email: targets, days, groceries and tips"""
+    __slots__ = ("targets", "days", "grocery", "tips")
+
+    def __init__(self, targets=None, days=None, grocery=None, tips=None):
+        self.targets = targets
+        self.days = days if days is not None else []
+        self.grocery = grocery if grocery is not None else []
+        self.tips = tips if tips is not None else []
+
+    def to_dict(self):
+        return {
+            "targets": self.targets.to_dict() if self.targets else None,
+            "days": [day.to_dict() for day in self.days],
+            "grocery": [category.to_dict() for category in self.grocery],
+            "tips": list(self.tips),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            DailyTargets.from_dict(data["targets"]) if data.get("targets") else None,
+            [Day.from_dict(day) for day in data.get("days", [])],
+            [GroceryCategory.from_dict(category) for category in data.get("grocery", [])],
+            list(data.get("tips", [])),
+        )
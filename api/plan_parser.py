@@ -0,0 +1,167 @@
+import re
+
+from api.plan_model import MEAL_SLOTS, DailyTargets, Day, GroceryCategory, Meal, Plan
+
+DAY_NUMBER = re.compile(r"DAY\s*(\d+)", re.I)
+MACRO = re.compile(r"(protein|carbs|fats)\s*:\s*(\d+(?:\.\d+)?)", re.I)
+# The order the prompt asks for; anything else falls back to MACRO
+MACRO_LINE = re.compile(r"\|\s*protein:\s*(\d+(?:\.\d+)?)g?,\s*carbs:\s*(\d+(?:\.\d+)?)g?,"
+                        r"\s*fats:\s*(\d+(?:\.\d+)?)")
+MEAL_SLOT_SET = frozenset(MEAL_SLOTS)
+TIP_PREFIX = re.compile(r"^(?:\d+\s*[.)]|[-*•])\s*")
+TARGET_KEYS = (("CALORIES:", "calories"), ("PROTEIN:", "protein"), ("CARBS:", "carbs"), ("FATS:", "fats"))
+
+
+def parse_macros(line):
+    """Return (protein, carbs, fats) in grams from a ``| protein: Xg, ...`` line"""
+    match = MACRO_LINE.match(line)
+    if match:
+        return float(match.group(1)), float(match.group(2)), float(match.group(3))
+    found = {name.lower(): float(value) for name, value in MACRO.findall(line)}
+    return found.get("protein"), found.get("carbs"), found.get("fats")
+
+
+class MealPlanParser:
+    """Single-pass, incremental parser for the meal plan format.
+
+    ``feed`` accepts arbitrary chunks of model output and returns the events
+    completed by that chunk: ``("meal", day, meal)`` when a meal's macros line
+    arrives and ``("day", day, None)`` when the next ``DAY`` header or the end
+    of the text closes a day. Finished days accumulate in ``days``.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._day = None
+        self._meal = None
+        self._in_tips = False
+        self.days = []
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        if "\n" not in self._buffer:
+            return []
+        *lines, self._buffer = self._buffer.split("\n")
+        events = []
+        self._consume(lines, events)
+        return events
+
+    def close(self):
+        """Flush the trailing partial line and the last open day"""
+        events = []
+        if self._buffer:
+            self._consume((self._buffer,), events)
+            self._buffer = ""
+        self._finish_day(events)
+        return events
+
+    def _consume(self, lines, events):
+        # Hot loop: parser state lives in locals and is written back at the end
+        day, meal, in_tips = self._day, self._meal, self._in_tips
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            # Dispatch on the first character; most lines are descriptions or macros
+            first = line[0]
+            if first == "-":
+                if in_tips:
+                    day.prep_tips.append(line[1:].strip())
+                elif meal is not None:
+                    meal.description = line[1:].strip()
+            elif first == "|":
+                if meal is not None:
+                    match = MACRO_LINE.match(line)
+                    if match:
+                        meal.protein = float(match.group(1))
+                        meal.carbs = float(match.group(2))
+                        meal.fats = float(match.group(3))
+                    else:
+                        meal.protein, meal.carbs, meal.fats = parse_macros(line)
+                    events.append(("meal", day, meal))
+                    meal = None
+            elif first == "D" and line.startswith("DAY"):
+                self._day = day
+                self._finish_day(events)
+                match = DAY_NUMBER.match(line)
+                day = Day(int(match.group(1)) if match else len(self.days) + 1, line)
+                meal, in_tips = None, False
+            elif day is None:
+                continue
+            elif line in MEAL_SLOT_SET:
+                in_tips = False
+                meal = Meal(line)
+                day.meals.append(meal)
+            elif "Meal Prep Tips:" in line:
+                in_tips = True
+                meal = None
+            elif meal is not None and meal.name is None:
+                meal.name = line
+        self._day, self._meal, self._in_tips = day, meal, in_tips
+
+    def _finish_day(self, events):
+        if self._day is None:
+            return
+        self.days.append(self._day)
+        events.append(("day", self._day, None))
+        self._day = None
+        self._meal = None
+        self._in_tips = False
+
+
+def parse_meal_plan(text):
+    """Parse a complete meal plan into a list of Day records"""
+    parser = MealPlanParser()
+    parser.feed(text)
+    parser.close()
+    return parser.days
+
+
+def parse_grocery_list(text):
+    """Parse ``CATEGORY:`` headers and ``- item`` lines into GroceryCategory records"""
+    categories = []
+    current = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.endswith(":"):
+            current = GroceryCategory(line[:-1].strip())
+            categories.append(current)
+        elif line.startswith("-") and current is not None:
+            current.items.append(line[1:].strip())
+    return categories
+
+
+def parse_prep_tips(text):
+    """Parse numbered or bulleted tips into a list of strings"""
+    tips = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and (line[0].isdigit() or line[0] in "-*•"):
+            tip = TIP_PREFIX.sub("", line)
+            if tip:
+                tips.append(tip)
+    return tips
+
+
+def parse_daily_targets(text):
+    """Parse the CALORIES/PROTEIN/CARBS/FATS block, or None if it isn't there"""
+    if not text or "CALORIES:" not in text:
+        return None
+    targets = DailyTargets()
+    for line in text.splitlines():
+        for key, attr in TARGET_KEYS:
+            if key in line and getattr(targets, attr) == "N/A":
+                setattr(targets, attr, line.split(key, 1)[1].strip())
+    return targets
+
+
+def parse_plan(daily_targets, meal_plan, grocery_list, prep_tips):
+    """Build a Plan from the raw text of the four pipeline stages"""
+    return Plan(
+        targets=parse_daily_targets(daily_targets),
+        days=parse_meal_plan(meal_plan or ""),
+        grocery=parse_grocery_list(grocery_list or ""),
+        tips=parse_prep_tips(prep_tips or ""),
+    )
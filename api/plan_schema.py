@@ -0,0 +1,161 @@
+"""The structured plan document: every section of the email from one JSON completion.
+
+``parse_plan_document`` validates the model's JSON against the shape
+``DOCUMENT_SHAPE`` describes and builds the Plan the renderers take, so
+nothing is scraped out of free text. A document missing a day, a meal or a
+macro is rejected as a whole rather than silently shortened.
+"""
+try:
+    import orjson
+    _loads = orjson.loads
+    JSONDecodeError = orjson.JSONDecodeError
+except ImportError:
+    # Optional; the standard library parser is a few times slower on a full plan
+    import json
+    _loads = json.loads
+    JSONDecodeError = json.JSONDecodeError
+
+from api.plan_model import MEAL_SLOTS, DailyTargets, Day, GroceryCategory, Meal, Plan
+from api.swap import MACROS, normalize_slot
+
+# Shown to the model; keep in step with the checks below
+DOCUMENT_SHAPE = """{
+  "targets": {"calories": "[daily range, e.g. 1800-2000]", "protein": "[percentage]",
+              "carbs": "[percentage]", "fats": "[percentage]"},
+  "days": [
+    {"day": 1,
+     "meals": [
+       {"slot": "Breakfast", "name": "[meal name]",
+        "description": "[2-3 sentence description of the meal and ingredients]",
+        "protein": [grams], "carbs": [grams], "fats": [grams]},
+       ...the same for "Lunch", "Dinner" and "Snacks"
+     ],
+     "prep_tips": ["[3-4 specific preparation instructions for the day's meals]"]},
+    ...the same for days 2 to 7
+  ],
+  "grocery": [{"category": "PRODUCE", "items": ["[item] ([quantity])"]},
+              {"category": "PROTEINS", "items": [...]}, {"category": "PANTRY", "items": [...]}],
+  "tips": ["[5 time-saving and storage meal prep tips]"]
+}"""
+TARGET_FIELDS = ("calories", "protein", "carbs", "fats")
+
+
+class SchemaError(ValueError):
+    """The document doesn't match the schema; ``path`` locates the problem, e.g. ``days[2].meals[1].fats``"""
+
+    def __init__(self, path, message):
+        super().__init__(f"{path}: {message}" if path else message)
+        self.path = path
+
+
+def _object(value, path):
+    if not isinstance(value, dict):
+        raise SchemaError(path, "expected an object")
+    return value
+
+
+def _list(value, path, min_items=0):
+    if not isinstance(value, list):
+        raise SchemaError(path, "expected a list")
+    if len(value) < min_items:
+        raise SchemaError(path, f"expected at least {min_items} item{'s' if min_items != 1 else ''}")
+    return value
+
+
+def _text(value, path):
+    if not isinstance(value, str) or not value.strip():
+        raise SchemaError(path, "expected a non-empty string")
+    return value.strip()
+
+
+def _grams(value, path):
+    # bool is an int subclass, but true isn't a number of grams
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+        raise SchemaError(path, "expected a number of grams")
+    return float(value)
+
+
+def _texts(value, path, min_items=0):
+    return [_text(item, f"{path}[{i}]") for i, item in enumerate(_list(value, path, min_items))]
+
+
+def _targets(value, path):
+    value = _object(value, path)
+    fields = {}
+    for field in TARGET_FIELDS:
+        item = value.get(field)
+        if isinstance(item, (int, float)) and not isinstance(item, bool):
+            # A bare number: kcal for calories, a percentage for the macros
+            item = f"{item:g}" if field == "calories" else f"{item:g}%"
+        fields[field] = _text(item, f"{path}.{field}")
+    return DailyTargets(**fields)
+
+
+def _meal(value, path):
+    value = _object(value, path)
+    slot = normalize_slot(value.get("slot"))
+    if slot is None:
+        raise SchemaError(f"{path}.slot", f"expected one of {', '.join(MEAL_SLOTS)}")
+    return Meal(slot, _text(value.get("name"), f"{path}.name"), _text(value.get("description"), f"{path}.description"),
+                *(_grams(value.get(macro), f"{path}.{macro}") for macro in MACROS))
+
+
+def _day(value, path):
+    value = _object(value, path)
+    number = value.get("day")
+    if isinstance(number, bool) or not isinstance(number, int):
+        raise SchemaError(f"{path}.day", "expected a day number")
+    meals = {}
+    for i, item in enumerate(_list(value.get("meals"), f"{path}.meals")):
+        meal = _meal(item, f"{path}.meals[{i}]")
+        if meal.slot in meals:
+            raise SchemaError(f"{path}.meals[{i}].slot", f"{meal.slot} appears twice")
+        meals[meal.slot] = meal
+    missing = [slot for slot in MEAL_SLOTS if slot not in meals]
+    if missing:
+        raise SchemaError(f"{path}.meals", f"missing {', '.join(missing)}")
+    tips = value.get("prep_tips")
+    return Day(number, meals=[meals[slot] for slot in MEAL_SLOTS],
+               prep_tips=_texts(tips, f"{path}.prep_tips") if tips is not None else [])
+
+
+def _grocery(value, path):
+    categories = []
+    for i, item in enumerate(_list(value, path, 1)):
+        item = _object(item, f"{path}[{i}]")
+        name = _text(item.get("category"), f"{path}[{i}].category").rstrip(":").upper()
+        categories.append(GroceryCategory(name, _texts(item.get("items"), f"{path}[{i}].items", 1)))
+    return categories
+
+
+def extract_document(text):
+    """The outermost JSON object in a completion; models without JSON mode may wrap it in a code fence"""
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        raise SchemaError("", "no JSON object in the response")
+    try:
+        return _loads(text[start:end + 1])
+    except (JSONDecodeError, ValueError) as e:
+        raise SchemaError("", f"invalid JSON ({e})")
+
+
+def parse_plan_document(text, day_count=7):
+    """Validate a structured plan completion and return it as a Plan; raises SchemaError.
+
+    Days must be numbered 1 to ``day_count``, each exactly once, and each must
+    have all four meals with a name, a description and numeric macros.
+    """
+    document = _object(extract_document(text), "")
+    days = {}
+    for i, item in enumerate(_list(document.get("days"), "days")):
+        day = _day(item, f"days[{i}]")
+        if not 1 <= day.number <= day_count:
+            raise SchemaError(f"days[{i}].day", f"expected a day from 1 to {day_count}")
+        if day.number in days:
+            raise SchemaError(f"days[{i}].day", f"day {day.number} appears twice")
+        days[day.number] = day
+    missing = [number for number in range(1, day_count + 1) if number not in days]
+    if missing:
+        raise SchemaError("days", f"missing day {', '.join(map(str, missing))}")
+    return Plan(_targets(document.get("targets"), "targets"), [days[number] for number in sorted(days)],
+                _grocery(document.get("grocery"), "grocery"), _texts(document.get("tips"), "tips", 1))
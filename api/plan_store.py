@@ -0,0 +1,212 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import closing
+
+from api.cache import profile_key
+from api.plan_model import Plan
+
+logger = logging.getLogger(__name__)
+
+
+class StoredPlan:
+    __slots__ = ("id", "plan", "profile", "email", "profile_key", "created_at", "version")
+
+    def __init__(self, plan_id, plan, profile, email, key, created_at, version=None):
+        self.id = plan_id
+        self.plan = plan
+        self.profile = profile
+        self.email = email
+        self.profile_key = key
+        self.created_at = created_at
+        # Hash of the stored blob; ``update`` only applies on top of the version that was read
+        self.version = version
+
+
+class PlanStore:
+    """Generated plans kept in SQLite so they can be re-rendered and resent.
+
+    Each request id points at a zlib-compressed JSON blob addressed by its
+    SHA-256, so identical plans (e.g. coalesced generations) are stored once.
+    Plans are indexed by the normalized profile hash too. Entries older than
+    ``retention_seconds`` are evicted, together with blobs nothing points at.
+    """
+
+    def __init__(self, db_path, retention_seconds=30 * 24 * 3600, compression_level=6, enabled=True):
+        self.db_path = db_path
+        self.retention_seconds = retention_seconds
+        self.compression_level = compression_level
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._saves_since_evict = 0
+        self.counters = {"saves": 0, "updates": 0, "conflicts": 0, "reads": 0, "misses": 0, "errors": 0}
+        if enabled:
+            self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS blobs (
+                    hash TEXT PRIMARY KEY,
+                    data BLOB NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS plans (
+                    id TEXT PRIMARY KEY,
+                    profile_key TEXT NOT NULL,
+                    blob_hash TEXT NOT NULL,
+                    profile TEXT NOT NULL,
+                    email TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS plans_profile ON plans (profile_key, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS plans_updated ON plans (updated_at)")
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _put_blob(self, conn, plan):
+        data = json.dumps(plan.to_dict(), sort_keys=True, separators=(',', ':')).encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        conn.execute("INSERT OR IGNORE INTO blobs (hash, data) VALUES (?, ?)",
+                     (digest, zlib.compress(data, self.compression_level)))
+        return digest
+
+    def save(self, plan_id, plan, user_profile, email=None):
+        """Store ``plan`` under ``plan_id``; failures are logged, never raised"""
+        if not self.enabled:
+            return False
+        now = time.time()
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                digest = self._put_blob(conn, plan)
+                conn.execute(
+                    "INSERT OR REPLACE INTO plans (id, profile_key, blob_hash, profile, email, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (plan_id, profile_key(user_profile), digest, json.dumps(user_profile), email, now, now)
+                )
+                conn.execute("COMMIT")
+                with self._lock:
+                    self.counters["saves"] += 1
+                    self._saves_since_evict += 1
+                    evict = self._saves_since_evict >= 50
+                    if evict:
+                        self._saves_since_evict = 0
+                if evict:
+                    self._evict(conn, now)
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Plan store write error: {str(e)}")
+            self._count("errors")
+            return False
+
+    def get(self, plan_id):
+        """The StoredPlan for ``plan_id``, or None if it's unknown or evicted"""
+        if not self.enabled:
+            return None
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT plans.profile_key, plans.profile, plans.email, plans.created_at, plans.blob_hash, blobs.data "
+                "FROM plans JOIN blobs ON blobs.hash = plans.blob_hash WHERE plans.id = ? AND plans.updated_at > ?",
+                (plan_id, time.time() - self.retention_seconds)
+            ).fetchone()
+        if row is None:
+            self._count("misses")
+            return None
+        self._count("reads")
+        key, profile, email, created_at, version, data = row
+        plan = Plan.from_dict(json.loads(zlib.decompress(data)))
+        return StoredPlan(plan_id, plan, json.loads(profile), email, key, created_at, version)
+
+    def update(self, stored, plan):
+        """Replace the plan of ``stored`` with ``plan``.
+
+        Returns the new version, or None if the plan changed (or was evicted)
+        since ``stored`` was read, in which case nothing is written. The old
+        blob is deleted once no plan points at it.
+        """
+        if not self.enabled:
+            return None
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                digest = self._put_blob(conn, plan)
+                updated = conn.execute(
+                    "UPDATE plans SET blob_hash = ?, updated_at = ? WHERE id = ? AND blob_hash = ?",
+                    (digest, time.time(), stored.id, stored.version)
+                ).rowcount
+                if not updated:
+                    conn.execute("ROLLBACK")
+                    self._count("conflicts")
+                    return None
+                if digest != stored.version:
+                    conn.execute("DELETE FROM blobs WHERE hash = ? AND NOT EXISTS "
+                                 "(SELECT 1 FROM plans WHERE blob_hash = ?)", (stored.version, stored.version))
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                self._count("errors")
+                raise
+        self._count("updates")
+        stored.plan, stored.version = plan, digest
+        return digest
+
+    def ids_for_profile(self, user_profile, limit=10):
+        """Most recent plan ids generated for an identical (normalized) profile"""
+        if not self.enabled:
+            return []
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT id FROM plans WHERE profile_key = ? AND updated_at > ? ORDER BY created_at DESC LIMIT ?",
+                (profile_key(user_profile), time.time() - self.retention_seconds, limit)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def iter_plans(self, batch_size=500):
+        """Every plan still within retention, oldest first, read ``batch_size`` rows at a time"""
+        if not self.enabled:
+            return
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "SELECT plans.id, plans.profile_key, plans.profile, plans.email, plans.created_at, plans.blob_hash, "
+                "blobs.data FROM plans JOIN blobs ON blobs.hash = plans.blob_hash WHERE plans.updated_at > ? "
+                "ORDER BY plans.created_at",
+                (time.time() - self.retention_seconds,)
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                for plan_id, key, profile, email, created_at, version, data in rows:
+                    plan = Plan.from_dict(json.loads(zlib.decompress(data)))
+                    yield StoredPlan(plan_id, plan, json.loads(profile), email, key, created_at, version)
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM plans WHERE updated_at <= ?", (now - self.retention_seconds,))
+        conn.execute("DELETE FROM blobs WHERE hash NOT IN (SELECT blob_hash FROM plans)")
+
+    def evict(self):
+        """Drop expired plans and unreferenced blobs now"""
+        if self.enabled:
+            with closing(self._connect()) as conn:
+                self._evict(conn, time.time())
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
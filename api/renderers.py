@@ -0,0 +1,165 @@
+import re
+from html import escape as _escape
+
+_SPECIAL = re.compile(r"[&<>\"']")
+
+SECTION_TITLES = ("Daily Targets", "Your 7-Day Meal Plan", "Grocery List", "Meal Prep Tips")
+
+
+def escape(text):
+    """html.escape, skipping the five replaces for the common case of plain text"""
+    return _escape(text) if _SPECIAL.search(text) else text
+
+
+def format_grams(value):
+    return "?" if value is None else f"{value:g}g"
+
+
+def format_macros(meal):
+    """``protein: 15g, carbs: 20g, fats: 10g``"""
+    if meal.has_macros:
+        return f"protein: {meal.protein:g}g, carbs: {meal.carbs:g}g, fats: {meal.fats:g}g"
+    return f"protein: {format_grams(meal.protein)}, carbs: {format_grams(meal.carbs)}, fats: {format_grams(meal.fats)}"
+
+
+def _day_html(day, parts):
+    append = parts.append
+    extend = parts.extend
+    extend(('<div class="meal-day"><h3>', escape(day.title), "</h3>"))
+    for meal in day.meals:
+        extend(('<div class="meal-item"><h4>', meal.slot, "</h4>"))
+        if meal.name:
+            extend(('<p class="meal-title">', escape(meal.name), "</p>"))
+        if meal.warning:
+            extend(('<p class="meal-warning">Check before eating: ', escape(meal.warning), "</p>"))
+        if meal.description:
+            extend(("<p>", escape(meal.description), "</p>"))
+        if meal.protein is not None and meal.carbs is not None and meal.fats is not None:
+            extend(('<p class="macros">protein: ', f"{meal.protein:g}g, carbs: {meal.carbs:g}g, fats: {meal.fats:g}g",
+                    "</p>"))
+        append("</div>")
+    if day.prep_tips:
+        append("<h4>Meal Prep Tips:</h4>")
+        for tip in day.prep_tips:
+            extend(("<p>", escape(tip), "</p>"))
+    append("</div>")
+
+
+def render_day_html(day):
+    parts = []
+    _day_html(day, parts)
+    return "".join(parts)
+
+
+def render_meal_plan_html(days):
+    if not days:
+        return "<p>Error: Empty meal plan</p>"
+    parts = ["<div class='meal-plan'>"]
+    for day in days:
+        _day_html(day, parts)
+    parts.append("</div>")
+    return "".join(parts)
+
+
+def render_grocery_html(categories):
+    if not categories:
+        return "<p>Error: Empty grocery list</p>"
+    parts = ['<div class="grocery-list">']
+    for category in categories:
+        parts.extend(("<h3>", escape(category.name), ":</h3><ul>"))
+        for item in category.items:
+            parts.extend(("<li>", escape(item), "</li>"))
+        parts.append("</ul>")
+    parts.append("</div>")
+    return "".join(parts)
+
+
+def render_tips_html(tips):
+    if not tips:
+        return "<p>Error: Empty prep tips</p>"
+    parts = ['<div class="prep-tips"><ol>']
+    for tip in tips:
+        parts.extend(("<li>", escape(tip), "</li>"))
+    parts.append("</ol></div>")
+    return "".join(parts)
+
+
+def render_targets_html(targets):
+    if targets is None:
+        return "<p>Error: Invalid daily targets format</p>"
+    return "".join((
+        '<div class="macros-box"><table class="meal-table">',
+        "<tr><th>Calories</th><th>Protein</th><th>Carbs</th><th>Fats</th></tr><tr><td>",
+        escape(targets.calories), "</td><td>", escape(targets.protein), "</td><td>",
+        escape(targets.carbs), "</td><td>", escape(targets.fats),
+        "</td></tr></table></div>",
+    ))
+
+
+def html_sections(plan):
+    """(title, html) pairs for the email template"""
+    return tuple(zip(SECTION_TITLES, (
+        render_targets_html(plan.targets),
+        render_meal_plan_html(plan.days),
+        render_grocery_html(plan.grocery),
+        render_tips_html(plan.tips),
+    )))
+
+
+def _targets_text(targets):
+    if targets is None:
+        return "N/A"
+    return (f"Calories: {targets.calories}\nProtein: {targets.protein}\n"
+            f"Carbs: {targets.carbs}\nFats: {targets.fats}")
+
+
+def _days_text(days):
+    lines = []
+    for day in days:
+        lines.append(day.title)
+        for meal in day.meals:
+            lines.append(f"  {meal.slot}: {meal.name or ''}")
+            if meal.warning:
+                lines.append(f"    Check before eating: {meal.warning}")
+            if meal.description:
+                lines.append(f"    {meal.description}")
+            if meal.has_macros:
+                lines.append(f"    {format_macros(meal)}")
+        for tip in day.prep_tips:
+            lines.append(f"  * {tip}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def _grocery_text(categories):
+    lines = []
+    for category in categories:
+        lines.append(f"{category.name}:")
+        lines.extend(f"  - {item}" for item in category.items)
+    return "\n".join(lines)
+
+
+def text_sections(plan):
+    """(title, text) pairs for the plain-text email alternative"""
+    return tuple(zip(SECTION_TITLES, (
+        _targets_text(plan.targets),
+        _days_text(plan.days),
+        _grocery_text(plan.grocery),
+        "\n".join(f"{i}. {tip}" for i, tip in enumerate(plan.tips, 1)),
+    )))
+
+
+def render_model_text(days):
+    """Serialize days back into the exact text format the meal plan prompt asks for"""
+    lines = []
+    for day in days:
+        lines.append(f"DAY {day.number}:")
+        for meal in day.meals:
+            lines.extend(("", meal.slot, meal.name or meal.slot, f"- {meal.description or ''}"))
+            if meal.has_macros:
+                lines.append(f"| {format_macros(meal)}")
+        if day.prep_tips:
+            lines.extend(("", "Meal Prep Tips:"))
+            lines.extend(f"- {tip}" for tip in day.prep_tips)
+        lines.append("")
+    return "\n".join(lines).strip()
@@ -0,0 +1,366 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing, contextmanager
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+_priority = contextvars.ContextVar("llm_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority_scope(priority):
+    """LLM calls made inside the block (including pipeline stages it starts) use ``priority``"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+class SchedulerOverloaded(Exception):
+    """Raised instead of queueing when the wait would be too long or the queue is too deep"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CallCancelled(Exception):
+    """Raised when the caller gave up (e.g. its pipeline aborted) while the call was queued or backing off"""
+
+
+class SharedRateLimiter:
+    """Request and token buckets plus a concurrency cap, shared by every process
+    through one SQLite row.
+
+    Buckets refill continuously at ``requests_per_minute`` and
+    ``tokens_per_minute``. Concurrency permits are leased so a crashed worker's
+    permits expire. ``block`` pauses everyone, e.g. after a 429.
+    """
+
+    def __init__(self, db_path, requests_per_minute=3500, tokens_per_minute=90000, max_concurrency=16,
+                 lease_seconds=600):
+        self.db_path = db_path
+        self.rpm = float(requests_per_minute)
+        self.tpm = float(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.lease_seconds = lease_seconds
+        self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    requests REAL NOT NULL,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    blocked_until REAL NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute("CREATE TABLE IF NOT EXISTS permits (id TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO buckets (id, requests, tokens, updated_at) VALUES (1, ?, ?, ?)",
+                         (self.rpm, self.tpm, time.time()))
+
+    def _refill(self, conn, now):
+        requests, tokens, updated_at, blocked_until = conn.execute(
+            "SELECT requests, tokens, updated_at, blocked_until FROM buckets WHERE id = 1").fetchone()
+        elapsed = max(0.0, now - updated_at)
+        requests = min(self.rpm, requests + elapsed * self.rpm / 60)
+        tokens = min(self.tpm, tokens + elapsed * self.tpm / 60)
+        return requests, tokens, blocked_until
+
+    def try_acquire(self, tokens, reserve=0.0):
+        """Take one request, ``tokens`` tokens and a concurrency permit.
+
+        ``reserve`` is the share of every budget that must stay untouched,
+        which keeps headroom for higher priority callers. Returns
+        ``(permit_id, 0)`` on success or ``(None, seconds to wait)``.
+        """
+        now = time.time()
+        tokens = min(float(tokens), self.tpm * (1 - reserve))
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                requests_left, tokens_left, blocked_until = self._refill(conn, now)
+                if blocked_until > now:
+                    wait = blocked_until - now
+                    permit = None
+                else:
+                    conn.execute("DELETE FROM permits WHERE expires_at < ?", (now,))
+                    active = conn.execute("SELECT COUNT(*) FROM permits").fetchone()[0]
+                    slots = max(1, int(self.max_concurrency * (1 - reserve)))
+                    need_requests = 1 + self.rpm * reserve
+                    need_tokens = tokens + self.tpm * reserve
+                    if active < slots and requests_left >= need_requests and tokens_left >= need_tokens:
+                        permit = uuid.uuid4().hex
+                        requests_left -= 1
+                        tokens_left -= tokens
+                        conn.execute("INSERT INTO permits (id, expires_at) VALUES (?, ?)",
+                                     (permit, now + self.lease_seconds))
+                        wait = 0.0
+                    else:
+                        permit = None
+                        wait = max((need_requests - requests_left) * 60 / self.rpm,
+                                   (need_tokens - tokens_left) * 60 / self.tpm, 0.0)
+                conn.execute("UPDATE buckets SET requests = ?, tokens = ?, updated_at = ? WHERE id = 1",
+                             (requests_left, tokens_left, now))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return permit, wait
+
+    def release(self, permit, refund_tokens=0):
+        """Return the permit, crediting back tokens that were reserved but not used"""
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM permits WHERE id = ?", (permit,))
+            if refund_tokens > 0:
+                conn.execute("UPDATE buckets SET tokens = MIN(?, tokens + ?) WHERE id = 1", (self.tpm, refund_tokens))
+            conn.execute("COMMIT")
+
+    def block(self, seconds):
+        """Hold back every worker for ``seconds``"""
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE buckets SET blocked_until = MAX(blocked_until, ?) WHERE id = 1",
+                         (time.time() + seconds,))
+
+
+class LLMScheduler:
+    """Admission, ordering and retries for model calls.
+
+    Callers queue per process in priority order (interactive before batch,
+    then FIFO) and only the head of the queue competes for the shared
+    limiter. Batch calls must leave ``batch_reserve`` of every budget for
+    interactive ones, which also orders them across workers. A call is shed
+    with SchedulerOverloaded when the local queue is ``max_queue`` deep or the
+    limiter can't admit it before its deadline. Retryable failures are retried
+    with full-jitter exponential backoff, waiting at least as long as the
+    server's Retry-After, and a 429 pauses all workers.
+    """
+
+    def __init__(self, limiter, max_queue=32, max_retries=4, backoff_base=1.0, backoff_max=30.0,
+                 batch_reserve=0.5, poll_interval=0.05, enabled=True):
+        self.limiter = limiter
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.batch_reserve = batch_reserve
+        self.poll_interval = poll_interval
+        self.enabled = enabled
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self.counters = {"admitted": 0, "shed": 0, "retries": 0, "rate_limited": 0, "wait_seconds": 0.0}
+
+    def _count(self, key, amount=1):
+        with self._condition:
+            self.counters[key] += amount
+
+    def queue_depth(self):
+        return len(self._waiting)
+
+    def overloaded(self):
+        """True when new work should be turned away at the door"""
+        return self.enabled and len(self._waiting) >= self.max_queue
+
+    def stats(self):
+        with self._condition:
+            return dict(self.counters, queued=len(self._waiting))
+
+    def _enqueue(self, priority):
+        entry = (priority, next(self._sequence))
+        with self._condition:
+            if len(self._waiting) >= self.max_queue:
+                self.counters["shed"] += 1
+                raise SchedulerOverloaded(f"LLM queue is full ({self.max_queue} waiting)", retry_after=1)
+            heapq.heappush(self._waiting, entry)
+        return entry
+
+    def _dequeue(self, entry):
+        with self._condition:
+            self._waiting.remove(entry)
+            heapq.heapify(self._waiting)
+            self._condition.notify_all()
+
+    def _admitted(self, started):
+        self._count("admitted")
+        self._count("wait_seconds", time.monotonic() - started)
+
+    def _check_budget(self, wait, deadline):
+        if deadline is not None and time.monotonic() + wait > deadline:
+            self._count("shed")
+            raise SchedulerOverloaded(f"LLM rate limit budget exhausted, retry in {wait:.1f}s", retry_after=wait)
+
+    def _sleep(self, seconds, cancelled):
+        """``time.sleep`` that wakes every ``poll_interval`` to raise CallCancelled once ``cancelled()`` is true"""
+        if cancelled is None:
+            time.sleep(seconds)
+            return
+        end = time.monotonic() + seconds
+        while True:
+            if cancelled():
+                raise CallCancelled("LLM call cancelled")
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, self.poll_interval))
+
+    def _acquire(self, tokens, priority, deadline, cancelled=None):
+        entry = self._enqueue(priority)
+        started = time.monotonic()
+        reserve = self.batch_reserve if priority == BATCH else 0.0
+        try:
+            while True:
+                with self._condition:
+                    while self._waiting[0] != entry:
+                        if cancelled is not None and cancelled():
+                            raise CallCancelled("LLM call cancelled while queued")
+                        remaining = None if deadline is None else deadline - time.monotonic()
+                        if remaining is not None and remaining <= 0:
+                            self.counters["shed"] += 1
+                            raise SchedulerOverloaded("Timed out waiting for an LLM slot")
+                        if cancelled is not None:
+                            remaining = self.poll_interval if remaining is None else min(remaining, self.poll_interval)
+                        self._condition.wait(remaining)
+                permit, wait = self.limiter.try_acquire(tokens, reserve)
+                if permit is not None:
+                    self._admitted(started)
+                    return permit
+                self._check_budget(wait, deadline)
+                self._sleep(min(max(wait, self.poll_interval), 1.0), cancelled)
+        finally:
+            self._dequeue(entry)
+
+    async def _aacquire(self, tokens, priority, deadline):
+        """``_acquire`` for coroutines: same queue, but polled so the event loop never blocks"""
+        entry = self._enqueue(priority)
+        started = time.monotonic()
+        reserve = self.batch_reserve if priority == BATCH else 0.0
+        try:
+            while True:
+                if self._waiting[0] != entry:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        self._count("shed")
+                        raise SchedulerOverloaded("Timed out waiting for an LLM slot")
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                permit, wait = await asyncio.to_thread(self.limiter.try_acquire, tokens, reserve)
+                if permit is not None:
+                    self._admitted(started)
+                    return permit
+                self._check_budget(wait, deadline)
+                await asyncio.sleep(min(max(wait, self.poll_interval), 1.0))
+        finally:
+            self._dequeue(entry)
+
+    @contextmanager
+    def permit(self, tokens, timeout=None, priority=None):
+        """Hold a limiter permit for the duration of the block (no retries)"""
+        if not self.enabled:
+            yield
+            return
+        deadline = None if timeout is None else time.monotonic() + timeout
+        permit = self._acquire(tokens, current_priority() if priority is None else priority, deadline)
+        try:
+            yield
+        finally:
+            self.limiter.release(permit)
+
+    def call(self, func, tokens, timeout=None, priority=None, retry_policy=None, used_tokens=None, cancelled=None):
+        """Run ``func()`` under a permit, retrying failures ``retry_policy`` accepts.
+
+        ``retry_policy(error)`` returns ``(retryable, retry_after or None)``;
+        ``used_tokens(result)`` gives the actual usage so the unused part of
+        ``tokens`` is credited back. ``timeout`` bounds queueing, attempts and
+        backoff together. Once ``cancelled()`` returns true, queueing and
+        backoff stop with CallCancelled; an attempt in flight runs to its end.
+        """
+        if cancelled is not None and cancelled():
+            raise CallCancelled("LLM call cancelled")
+        if not self.enabled:
+            return func()
+        priority = current_priority() if priority is None else priority
+        deadline = None if timeout is None else time.monotonic() + timeout
+        attempt = 0
+        while True:
+            permit = self._acquire(tokens, priority, deadline, cancelled)
+            try:
+                result = func()
+            except BaseException as e:
+                # Failed calls don't use tokens, and the permit isn't held during backoff
+                self.limiter.release(permit, tokens)
+                if not isinstance(e, Exception):
+                    raise
+                error = e
+            else:
+                self.limiter.release(permit, max(0, tokens - used_tokens(result)) if used_tokens else 0)
+                return result
+
+            delay = self._retry_delay(error, attempt, retry_policy, deadline)
+            attempt += 1
+            self._sleep(delay, cancelled)
+
+    async def acall(self, func, tokens, timeout=None, priority=None, retry_policy=None, used_tokens=None):
+        """``call`` for coroutines: ``func()`` returns an awaitable and waits don't block the loop"""
+        if not self.enabled:
+            return await func()
+        priority = current_priority() if priority is None else priority
+        deadline = None if timeout is None else time.monotonic() + timeout
+        attempt = 0
+        while True:
+            permit = await self._aacquire(tokens, priority, deadline)
+            try:
+                result = await func()
+            except BaseException as e:
+                await asyncio.to_thread(self.limiter.release, permit, tokens)
+                if not isinstance(e, Exception):
+                    raise
+                error = e
+            else:
+                await asyncio.to_thread(self.limiter.release, permit,
+                                        max(0, tokens - used_tokens(result)) if used_tokens else 0)
+                return result
+
+            delay = self._retry_delay(error, attempt, retry_policy, deadline)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def _retry_delay(self, error, attempt, retry_policy, deadline):
+        """Backoff before the next attempt; re-raises ``error`` when it shouldn't be retried"""
+        retryable, retry_after = retry_policy(error) if retry_policy else (False, None)
+        if retry_after is not None:
+            self._count("rate_limited")
+            self.limiter.block(retry_after)
+        if not retryable or attempt >= self.max_retries:
+            raise error
+        delay = max(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)), retry_after or 0.0)
+        if deadline is not None and time.monotonic() + delay > deadline:
+            raise error
+        self._count("retries")
+        logger.warning(f"LLM call failed ({str(error)}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+        return delay
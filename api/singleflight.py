@@ -0,0 +1,268 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+
+class FlightError(Exception):
+    """The shared call failed; raised in every caller that waited on it"""
+
+
+class _LeaderCancelled(Exception):
+    """The leader stopped for its own reasons; the followers take the call over"""
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "cancelled")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.cancelled = False
+
+
+class SingleFlight:
+    """Runs a function once per key while identical calls are in flight.
+
+    Threads in one process wait on the first caller's in-memory future. Across
+    processes the first caller claims the key in a SQLite lock table (leased,
+    so a crashed worker's claim expires) and the others poll it, picking up
+    the JSON-encoded result or error when it finishes. Finished rows are only
+    kept for ``grace`` seconds, to cover callers that were already waiting;
+    this is coalescing, not a cache.
+
+    Only failures are shared. When the leader is cancelled (a BaseException
+    such as KeyboardInterrupt or asyncio.CancelledError, or an exception
+    ``is_cancellation`` accepts) its request no longer wants the result, but
+    the followers still do: one of them takes the call over and runs it.
+    """
+
+    def __init__(self, db_path, lease_seconds=300, poll_interval=0.1, grace=5.0, is_cancellation=None,
+                 enabled=True):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.grace = grace
+        self.is_cancellation = is_cancellation
+        self.enabled = enabled
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+        self.counters = {"leader": 0, "thread": 0, "process": 0}
+        if enabled:
+            self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS flights (
+                    key TEXT PRIMARY KEY,
+                    owner INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+    def do(self, key, func, timeout=None):
+        """Return ``(result, shared)``; ``shared`` names where the result came
+        from when another caller did the work (``'thread'`` or ``'process'``)"""
+        if not self.enabled:
+            return func(), None
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+            if leader:
+                break
+            self._count("thread")
+            if not call.done.wait(self._time_left(deadline)):
+                raise FlightError(f"Timed out waiting for shared call {key[:12]}")
+            if call.cancelled:
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result, "thread"
+
+        shared = None
+        try:
+            call.result, shared = self._run_across_processes(key, func, self._time_left(deadline))
+            return call.result, shared
+        except BaseException as e:
+            call.cancelled = self._cancelled(e)
+            call.error = e if isinstance(e, Exception) else FlightError(str(e))
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def ado(self, key, func, timeout=None):
+        """``do`` for coroutines: ``func()`` returns an awaitable, and waiting on
+        another worker's claim polls without blocking the event loop"""
+        if not self.enabled:
+            return await func(), None
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            future = self._async_calls.get(key)
+            if future is None:
+                break
+            self._count("thread")
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), self._time_left(deadline)), "thread"
+            except asyncio.TimeoutError:
+                raise FlightError(f"Timed out waiting for shared call {key[:12]}")
+            except _LeaderCancelled:
+                continue
+        future = self._async_calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result, shared = await self._arun_across_processes(key, func, self._time_left(deadline))
+            future.set_result(result)
+            return result, shared
+        except BaseException as e:
+            future.set_exception(_LeaderCancelled() if self._cancelled(e) else e)
+            # Followers retrieve it; don't warn about an unretrieved exception when there are none
+            future.exception()
+            raise
+        finally:
+            del self._async_calls[key]
+
+    async def _arun_across_processes(self, key, func, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                claim = await asyncio.to_thread(self._claim, key)
+            except sqlite3.Error as e:
+                logger.error(f"Single-flight store error: {str(e)}")
+                return await func(), None
+
+            if claim is True:
+                self._count("leader")
+                try:
+                    result = await func()
+                except BaseException as e:
+                    if self._cancelled(e):
+                        # Shielded, so the claim is dropped even though this task is being cancelled
+                        await asyncio.shield(asyncio.to_thread(self._abandon, key))
+                    else:
+                        await asyncio.to_thread(self._release, key, None, str(e))
+                    raise
+                await asyncio.to_thread(self._release, key, result)
+                return result, None
+
+            _, status, result, error, _ = claim
+            if status == 'done':
+                self._count("process")
+                return json.loads(result), "process"
+            if status == 'failed':
+                self._count("process")
+                raise FlightError(error)
+            if deadline is not None and time.monotonic() >= deadline:
+                raise FlightError(f"Timed out waiting for shared call {key[:12]}")
+            await asyncio.sleep(self.poll_interval)
+
+    def _cancelled(self, error):
+        return not isinstance(error, Exception) or (self.is_cancellation is not None and self.is_cancellation(error))
+
+    @staticmethod
+    def _time_left(deadline):
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    def _count(self, key):
+        with self._lock:
+            self.counters[key] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, in_flight=len(self._calls) + len(self._async_calls))
+
+    def _claim(self, key):
+        """True if this process now owns ``key``, else the row another process owns"""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT owner, status, result, error, expires_at FROM flights WHERE key = ?",
+                                   (key,)).fetchone()
+                if row is not None and row[4] >= now:
+                    conn.execute("COMMIT")
+                    return row
+                conn.execute("DELETE FROM flights WHERE expires_at < ?", (now,))
+                conn.execute("INSERT OR REPLACE INTO flights (key, owner, status, expires_at) "
+                             "VALUES (?, ?, 'running', ?)", (key, os.getpid(), now + self.lease_seconds))
+                conn.execute("COMMIT")
+                return True
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _finish(self, key, result=None, error=None):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE flights SET status = ?, result = ?, error = ?, expires_at = ? WHERE key = ? AND owner = ?",
+                ('failed' if error is not None else 'done', None if error is not None else json.dumps(result),
+                 error, time.time() + self.grace, key, os.getpid()))
+
+    def _run_across_processes(self, key, func, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                claim = self._claim(key)
+            except sqlite3.Error as e:
+                # The lock store is an optimization; never fail the request over it
+                logger.error(f"Single-flight store error: {str(e)}")
+                return func(), None
+
+            if claim is True:
+                self._count("leader")
+                try:
+                    result = func()
+                except BaseException as e:
+                    if self._cancelled(e):
+                        self._abandon(key)
+                    else:
+                        self._release(key, error=str(e))
+                    raise
+                self._release(key, result=result)
+                return result, None
+
+            _, status, result, error, _ = claim
+            if status == 'done':
+                self._count("process")
+                return json.loads(result), "process"
+            if status == 'failed':
+                self._count("process")
+                raise FlightError(error)
+            if deadline is not None and time.monotonic() >= deadline:
+                raise FlightError(f"Timed out waiting for shared call {key[:12]}")
+            time.sleep(self.poll_interval)
+
+    def _release(self, key, result=None, error=None):
+        try:
+            self._finish(key, result, error)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.error(f"Single-flight store error: {str(e)}")
+
+    def _abandon(self, key):
+        """Drop this process's claim, so a process waiting on the key claims it and runs the call"""
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute("DELETE FROM flights WHERE key = ? AND owner = ?", (key, os.getpid()))
+        except sqlite3.Error as e:
+            logger.error(f"Single-flight store error: {str(e)}")
@@ -0,0 +1,49 @@
+import json
+
+from api.plan_parser import MealPlanParser
+from api.renderers import format_macros, render_day_html, render_meal_plan_html
+
+
+def sse_event(event, data):
+    """Encode a Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class MealPlanStreamFormatter:
+    """Incremental version of ``format_meal_plan``.
+
+    ``feed`` accepts arbitrary chunks of model output and returns the events
+    completed by that chunk: a ``meal`` event as soon as a meal's macros line
+    (``| protein: ...``) arrives and a ``day`` event with the finished HTML
+    block when the next ``DAY`` header (or the end of the stream) closes it.
+    """
+
+    def __init__(self):
+        self.parser = MealPlanParser()
+
+    @property
+    def days(self):
+        return self.parser.days
+
+    def feed(self, chunk):
+        """Consume a chunk of text and return a list of (event, data) pairs"""
+        return [self._event(*event) for event in self.parser.feed(chunk)]
+
+    def close(self):
+        """Flush the trailing partial line and the last open day"""
+        return [self._event(*event) for event in self.parser.close()]
+
+    def html(self):
+        """The complete meal plan HTML built from the finished days"""
+        return render_meal_plan_html(self.parser.days)
+
+    def _event(self, kind, day, meal):
+        if kind == "meal":
+            return "meal", {
+                "day": day.title,
+                "meal": meal.slot,
+                "name": meal.name,
+                "description": meal.description,
+                "macros": format_macros(meal),
+            }
+        return "day", {"day": day.title, "html": render_day_html(day)}
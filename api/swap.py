@@ -0,0 +1,118 @@
+"""Replacing a single meal of a stored plan.
+
+The new meal gets a macro budget from the meals around it, so the day keeps
+meeting its targets, and the grocery list is patched by diffing the old and
+new meal's ingredients instead of being rebuilt from the whole week.
+"""
+import re
+
+from api.grocery import update_grocery_list
+from api.plan_model import MEAL_SLOTS
+
+MACROS = ("protein", "carbs", "fats")
+# Calories per gram, for targets that only give a percentage
+CALORIES_PER_GRAM = {"protein": 4, "carbs": 4, "fats": 9}
+GRAMS = re.compile(r"\((\d+(?:\.\d+)?)\s*g\)")
+PERCENT = re.compile(r"(\d+(?:\.\d+)?)\s*%")
+CALORIE_RANGE = re.compile(r"(\d+)(?:\s*-\s*(\d+))?")
+# A budget never drops below this share of the day's target, even if the other meals overshoot
+MIN_SHARE = 0.1
+
+
+def normalize_slot(slot):
+    """``MEAL_SLOTS`` entry matching ``slot`` case-insensitively, or None"""
+    if not isinstance(slot, str):
+        return None
+    slot = slot.strip().lower()
+    if slot == "snack":
+        slot = "snacks"
+    return next((name for name in MEAL_SLOTS if name.lower() == slot), None)
+
+
+def target_calories(targets):
+    """Middle of the daily calorie range, or None"""
+    match = CALORIE_RANGE.search(targets.calories or "") if targets is not None else None
+    if not match:
+        return None
+    low, high = float(match.group(1)), float(match.group(2) or match.group(1))
+    return (low + high) / 2
+
+
+def target_grams(targets):
+    """Daily protein/carbs/fats targets in grams, or None if the targets don't say.
+
+    Local targets carry grams ("30% (150g)"); LLM targets may only give a
+    percentage, which is converted using the middle of the calorie range.
+    """
+    if targets is None:
+        return None
+    calories = target_calories(targets)
+    grams = {}
+    for macro in MACROS:
+        text = getattr(targets, macro) or ""
+        match = GRAMS.search(text)
+        if match:
+            grams[macro] = float(match.group(1))
+            continue
+        match = PERCENT.search(text)
+        if not (match and calories):
+            return None
+        grams[macro] = calories * float(match.group(1)) / 100 / CALORIES_PER_GRAM[macro]
+    return grams
+
+
+def _average(meals):
+    return {macro: sum(getattr(meal, macro) for meal in meals) / len(meals) for macro in MACROS}
+
+
+def macro_budget(plan, day, slot):
+    """Grams of protein/carbs/fats the new ``slot`` meal of ``day`` should provide, or None.
+
+    With daily targets and the rest of the day's meals known, it's whatever
+    those meals leave of the targets. Otherwise it falls back to the same slot
+    on the neighbouring days (and the meal being replaced).
+    """
+    targets = target_grams(plan.targets)
+    others = [meal for meal in day.meals if meal.slot != slot]
+    if targets and others and all(meal.has_macros for meal in others):
+        return {macro: round(max(targets[macro] - sum(getattr(meal, macro) for meal in others),
+                                 targets[macro] * MIN_SHARE))
+                for macro in MACROS}
+    neighbours = [neighbour.meal(slot) for neighbour in plan.days if abs(neighbour.number - day.number) <= 1]
+    neighbours = [meal for meal in neighbours if meal is not None and meal.has_macros]
+    if not neighbours:
+        return None
+    return {macro: round(grams) for macro, grams in _average(neighbours).items()}
+
+
+def meal_text(meal):
+    return f"{meal.name or ''}. {meal.description or ''}" if meal is not None else ""
+
+
+def replace_day(plan, day):
+    """Put ``day`` in place of the plan's day with the same number and patch ``plan.grocery`` meal by meal"""
+    index = next(i for i, other in enumerate(plan.days) if other.number == day.number)
+    old = plan.days[index]
+    for slot in dict.fromkeys([meal.slot for meal in old.meals] + [meal.slot for meal in day.meals]):
+        old_meal, new_meal = old.meal(slot), day.meal(slot)
+        update_grocery_list(plan.grocery, meal_text(old_meal), meal_text(new_meal))
+    plan.days[index] = day
+    return old
+
+
+def replace_meal(plan, day, meal):
+    """Put ``meal`` into ``day`` in place of its slot and patch ``plan.grocery``.
+
+    Returns (old meal or None, added ingredients, removed ingredients).
+    """
+    old = day.meal(meal.slot)
+    if old is None:
+        # Keep the generated slot order for a day that was missing this meal
+        order = MEAL_SLOTS.index(meal.slot)
+        index = next((i for i, other in enumerate(day.meals)
+                      if other.slot in MEAL_SLOTS and MEAL_SLOTS.index(other.slot) > order), len(day.meals))
+        day.meals.insert(index, meal)
+    else:
+        day.meals[day.meals.index(old)] = meal
+    added, removed = update_grocery_list(plan.grocery, meal_text(old), meal_text(meal))
+    return old, added, removed
@@ -0,0 +1,103 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Mifflin-St Jeor: 10 * kg + 6.25 * cm - 5 * years + s, with s = +5 for men and -161 for women
+SEX_CONSTANT = {"male": 5.0, "female": -161.0}
+ACTIVITY_FACTORS = {"sedentary": 1.2, "light": 1.375, "moderate": 1.55, "very_active": 1.725}
+# Daily kcal adjustment on top of maintenance
+GOAL_ADJUSTMENTS = {"weight_loss": -500.0, "muscle_gain": 300.0, "health": 0.0, "energy": 0.0}
+# Share of calories from (protein, carbs, fats)
+MACRO_SPLITS = {
+    "omnivore": (0.30, 0.40, 0.30),
+    "vegetarian": (0.25, 0.50, 0.25),
+    "vegan": (0.20, 0.55, 0.25),
+    "pescatarian": (0.30, 0.40, 0.30),
+    "animal_based": (0.35, 0.15, 0.50),
+}
+MUSCLE_GAIN_PROTEIN_SHIFT = 0.05  # moved from carbs to protein
+KCAL_PER_GRAM = np.array([4.0, 4.0, 9.0])
+MIN_CALORIES = {"male": 1500.0, "female": 1200.0}
+
+# Used when a profile field is missing or out of range
+DEFAULTS = {"age": 30.0, "height": 170.0, "current_weight": 70.0}
+BOUNDS = {"age": (13.0, 100.0), "height": (120.0, 230.0), "current_weight": (35.0, 250.0)}
+DEFAULT_SEX_CONSTANT = -78.0  # midpoint, for profiles without a gender
+DEFAULT_MIN_CALORIES = 1200.0
+CALORIE_RANGE = 100.0  # +/- around the target, shown as a range like the LLM used to
+
+
+def _numbers(profiles, field):
+    low, high = BOUNDS[field]
+    values = np.empty(len(profiles))
+    for i, profile in enumerate(profiles):
+        try:
+            value = float(profile.get(field))
+        except (TypeError, ValueError):
+            value = DEFAULTS[field]
+        values[i] = value if low <= value <= high else DEFAULTS[field]
+    return values
+
+
+def _lookup(profiles, field, table, default):
+    return np.array([table.get(profile.get(field), default) for profile in profiles], dtype=float)
+
+
+def compute_targets_batch(profiles):
+    """Vectorized daily targets for many profiles at once.
+
+    Returns a dict of arrays with one entry per profile: ``bmr``, ``tdee``,
+    ``calories``, ``macro_pct`` (n x 3, protein/carbs/fats) and ``macro_g``
+    (n x 3 grams).
+    """
+    profiles = list(profiles)
+    weight = _numbers(profiles, "current_weight")
+    height = _numbers(profiles, "height")
+    age = _numbers(profiles, "age")
+
+    bmr = 10.0 * weight + 6.25 * height - 5.0 * age + _lookup(profiles, "gender", SEX_CONSTANT, DEFAULT_SEX_CONSTANT)
+    tdee = bmr * _lookup(profiles, "activity", ACTIVITY_FACTORS, ACTIVITY_FACTORS["light"])
+    calories = tdee + _lookup(profiles, "goal", GOAL_ADJUSTMENTS, 0.0)
+    calories = np.maximum(calories, _lookup(profiles, "gender", MIN_CALORIES, DEFAULT_MIN_CALORIES))
+    calories = np.round(calories / 10.0) * 10.0
+
+    splits = np.array([MACRO_SPLITS.get(p.get("diet_preference"), MACRO_SPLITS["omnivore"]) for p in profiles],
+                      dtype=float).reshape(len(profiles), 3)
+    muscle_gain = np.array([p.get("goal") == "muscle_gain" for p in profiles])
+    shift = np.minimum(MUSCLE_GAIN_PROTEIN_SHIFT, splits[:, 1] - 0.10) * muscle_gain
+    splits[:, 0] += shift
+    splits[:, 1] -= shift
+
+    grams = np.round(calories[:, None] * splits / KCAL_PER_GRAM)
+    return {"bmr": bmr, "tdee": tdee, "calories": calories, "macro_pct": splits, "macro_g": grams}
+
+
+def compute_targets(profile):
+    """Daily targets for a single profile as plain floats"""
+    batch = compute_targets_batch([profile])
+    protein, carbs, fats = batch["macro_g"][0]
+    protein_pct, carbs_pct, fats_pct = batch["macro_pct"][0]
+    return {
+        "calories": float(batch["calories"][0]),
+        "protein_g": float(protein), "carbs_g": float(carbs), "fats_g": float(fats),
+        "protein_pct": float(protein_pct), "carbs_pct": float(carbs_pct), "fats_pct": float(fats_pct),
+    }
+
+
+def format_targets(targets):
+    """Render targets in the CALORIES/PROTEIN/CARBS/FATS format the LLM stage used to return"""
+    low = int(targets["calories"] - CALORIE_RANGE)
+    high = int(targets["calories"] + CALORIE_RANGE)
+    return "\n".join((
+        f"CALORIES: {low}-{high}",
+        f"PROTEIN: {round(targets['protein_pct'] * 100)}% ({int(targets['protein_g'])}g)",
+        f"CARBS: {round(targets['carbs_pct'] * 100)}% ({int(targets['carbs_g'])}g)",
+        f"FATS: {round(targets['fats_pct'] * 100)}% ({int(targets['fats_g'])}g)",
+    ))
+
+
+def daily_targets_text(profile):
+    """CALORIES/PROTEIN/CARBS/FATS text for a questionnaire profile"""
+    return format_targets(compute_targets(profile))
@@ -0,0 +1,214 @@
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+class _NoopSpan:
+    """Stands in for spans of unsampled traces so instrumentation costs almost nothing"""
+
+    __slots__ = ("trace_id",)
+    sampled = False
+
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id
+
+    def set(self, **attributes):
+        pass
+
+    def capture(self, name, text):
+        pass
+
+    def end(self, error=None):
+        pass
+
+
+class Span:
+    __slots__ = ("tracer", "trace_id", "span_id", "parent_id", "name", "start", "_started", "attributes",
+                 "payloads", "ended")
+    sampled = True
+
+    def __init__(self, tracer, trace_id, name, parent_id=None):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.attributes = {}
+        self.payloads = {}
+        self.ended = False
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def capture(self, name, text):
+        """Keep the first ``capture_bytes`` characters of a payload"""
+        if text is None:
+            return
+        limit = self.tracer.capture_bytes
+        if len(text) > limit:
+            self.payloads[name] = {"text": text[:limit], "length": len(text), "truncated": True}
+        else:
+            self.payloads[name] = {"text": text, "length": len(text)}
+
+    def end(self, error=None):
+        if self.ended:
+            return
+        self.ended = True
+        record = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round((time.perf_counter() - self._started) * 1000, 3),
+            "status": "error" if error else "ok",
+        }
+        if error:
+            record["error"] = str(error)[:self.tracer.capture_bytes]
+        if self.attributes:
+            record["attributes"] = self.attributes
+        if self.payloads:
+            record["payloads"] = self.payloads
+        self.tracer.export(record)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves JSON encoding to the listener thread and
+    drops spans instead of blocking when the sink falls behind"""
+
+    def __init__(self, queue_, tracer):
+        super().__init__(queue_)
+        self.tracer = tracer
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.tracer.dropped += 1
+
+
+class _JSONLineFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.msg, default=str)
+
+
+class Tracer:
+    """Per-request traces with nested spans, exported as JSONL off the request thread.
+
+    A trace is sampled when it starts (``sample_rate``, or forced by the
+    caller); spans of unsampled traces are no-ops. Finished spans of sampled
+    traces go through a QueueHandler to a listener thread that appends them
+    to ``sink_path``. Captured payloads are cut to ``capture_bytes``.
+    """
+
+    def __init__(self, sink_path, sample_rate=0.01, capture_bytes=2048, queue_size=10000, enabled=True):
+        self.sink_path = sink_path
+        self.sample_rate = sample_rate
+        self.capture_bytes = capture_bytes
+        self.enabled = enabled
+        self._queue = queue.Queue(queue_size)
+        self._export_logger = logging.getLogger(f"{__name__}.export")
+        self._export_logger.propagate = False
+        self._export_logger.setLevel(logging.INFO)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._listener = None
+        self.dropped = 0
+
+    def _ensure_started(self):
+        # The listener thread doesn't survive a fork, so each worker starts its own
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.sink_path)), exist_ok=True)
+            # WatchedFileHandler reopens the file after external rotation (logrotate)
+            sink = logging.handlers.WatchedFileHandler(self.sink_path, encoding="utf-8")
+            sink.setFormatter(_JSONLineFormatter())
+            self._queue = queue.Queue(self._queue.maxsize)
+            self._export_logger.handlers = [_DeferredQueueHandler(self._queue, self)]
+            self._listener = logging.handlers.QueueListener(self._queue, sink)
+            self._listener.start()
+            self._pid = pid
+
+    def export(self, record):
+        self._export_logger.info(record)
+
+    def current(self):
+        return _current.get()
+
+    def start_trace(self, name, trace_id=None, sampled=None):
+        """Start the root span of a trace; ``sampled`` overrides the sample rate"""
+        trace_id = trace_id or os.urandom(16).hex()
+        if sampled is None:
+            sampled = self.enabled and random.random() < self.sample_rate
+        if not (sampled and self.enabled):
+            return _NoopSpan(trace_id)
+        self._ensure_started()
+        return Span(self, trace_id, name)
+
+    def start_span(self, name, parent=None):
+        """Start a child of ``parent`` (default: the active span)"""
+        parent = parent or _current.get()
+        if parent is None or not parent.sampled:
+            return parent if parent is not None else _NoopSpan()
+        return Span(self, parent.trace_id, name, parent.span_id)
+
+    @staticmethod
+    def activate(span):
+        return _current.set(span)
+
+    @staticmethod
+    def deactivate(token):
+        _current.reset(token)
+
+    @contextmanager
+    def trace(self, name, trace_id=None, sampled=None):
+        span = self.start_trace(name, trace_id, sampled)
+        with self._active(span):
+            yield span
+
+    @contextmanager
+    def span(self, name):
+        """Child span of the active span, active for the duration of the block"""
+        span = self.start_span(name)
+        if not span.sampled:
+            yield span
+            return
+        with self._active(span):
+            yield span
+
+    @contextmanager
+    def _active(self, span):
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.end(error=e if not isinstance(e, GeneratorExit) else "cancelled")
+            raise
+        else:
+            span.end()
+        finally:
+            _current.reset(token)
+
+    def stop(self):
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
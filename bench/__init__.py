@@ -0,0 +1 @@
+# Benchmarks for the meal plan service; run modules with `python -m bench.<name>`
@@ -0,0 +1,109 @@
+"""Compare the legacy string-concatenating formatters with the single-pass parser and renderers.
+
+Also times the app's own ``format_*`` wrappers and ``generate_html_email``.
+
+Usage: python -m bench.bench_formatters [--days 7 70 700] [--repeat 5]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.plan_parser import parse_plan  # noqa: E402
+from api.renderers import html_sections, text_sections  # noqa: E402
+from bench import legacy_formatters as legacy  # noqa: E402
+from bench.synthetic import TARGETS_TEXT, grocery_list_text, meal_plan_text, prep_tips_text  # noqa: E402
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def load_app():
+    """Import the Flask module offline: dummy credentials, fake LLM backend, throwaway DATA_DIR"""
+    for key, value in (("OPENAI_API_KEY", "sk-bench"), ("EMAIL_USERNAME", "bench@example.com"),
+                       ("EMAIL_PASSWORD", "bench"), ("LLM_BACKEND", "fake")):
+        os.environ.setdefault(key, value)
+    os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="eatreal-bench-"))
+    from api import generate_meal_plan
+    return generate_meal_plan
+
+
+def run(days_options, repeat):
+    results = []
+    grocery, tips = grocery_list_text(), prep_tips_text()
+    app = load_app()
+    profile = {"goal": "weight_loss", "gender": "female", "age": "34", "height": "165", "current_weight": "72",
+               "target_weight": "65", "activity": "moderate", "diet_preference": "vegetarian"}
+    for days in days_options:
+        plan_text = meal_plan_text(days)
+
+        def legacy_html():
+            legacy.format_daily_targets(TARGETS_TEXT)
+            legacy.format_meal_plan(plan_text)
+            legacy.format_grocery_list(grocery)
+            legacy.format_prep_tips(tips)
+
+        def parsed_html():
+            html_sections(parse_plan(TARGETS_TEXT, plan_text, grocery, tips))
+
+        def parsed_all():
+            plan = parse_plan(TARGETS_TEXT, plan_text, grocery, tips)
+            html_sections(plan)
+            text_sections(plan)
+            json.dumps(plan.to_dict())
+
+        def app_formatters():
+            app.format_daily_targets(TARGETS_TEXT)
+            app.format_meal_plan(plan_text)
+            app.format_grocery_list(grocery)
+            app.format_prep_tips(tips)
+
+        row = {
+            "days": days,
+            "input_bytes": len(plan_text),
+            "legacy_html_ms": best_of(legacy_html, repeat) * 1000,
+            "parser_html_ms": best_of(parsed_html, repeat) * 1000,
+            "parser_html_text_json_ms": best_of(parsed_all, repeat) * 1000,
+            "app_formatters_ms": best_of(app_formatters, repeat) * 1000,
+            "generate_html_email_ms": best_of(
+                lambda: app.generate_html_email(TARGETS_TEXT, plan_text, grocery, tips, profile), repeat) * 1000,
+        }
+        row["speedup"] = row["legacy_html_ms"] / row["parser_html_ms"]
+        results.append(row)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, nargs="+", default=[7, 70, 700])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print raw JSON instead of a table")
+    args = parser.parse_args()
+
+    # The legacy formatters log every payload at DEBUG; keep that out of the timings
+    logging.disable(logging.CRITICAL)
+    results = run(args.days, args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'days':>6} {'bytes':>10} {'legacy ms':>10} {'parser ms':>10} {'+text+json':>11} {'speedup':>8} "
+          f"{'format_* ms':>12} {'email ms':>9}")
+    for row in results:
+        print(f"{row['days']:>6} {row['input_bytes']:>10} {row['legacy_html_ms']:>10.2f} "
+              f"{row['parser_html_ms']:>10.2f} {row['parser_html_text_json_ms']:>11.2f} {row['speedup']:>7.1f}x "
+              f"{row['app_formatters_ms']:>12.2f} {row['generate_html_email_ms']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""Local stand-in for the OpenAI chat-completions endpoint.
+
+Returns canned plan text in the formats our prompts ask for, with
+configurable latency, token rate and injected 429/500/timeout errors, so the
+whole Flask pipeline can be load tested offline:
+
+    python -m bench.fake_openai --port 8089 --latency 0.5 --tokens-per-second 80 --rate-429 0.05
+    LLM_BACKEND=fake LLM_BASE_URL=http://127.0.0.1:8089/v1 gunicorn wsgi:app
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bench.synthetic import (TARGETS_TEXT, grocery_list_text, meal_plan_text, meal_text, plan_document,
+                             prep_tips_text)
+
+CHARS_PER_TOKEN = 4
+STREAM_CHUNK_TOKENS = 4
+PER_DAY_REQUEST = re.compile(r"meal plan for (DAY \d+(?:, DAY \d+)*) only")
+SWAP_REQUEST = re.compile(r"Create one new (\w+) for DAY")
+STRUCTURED_REQUEST = "Respond with one JSON object"
+
+
+def canned_response(prompt, seed=0):
+    """Plan text matching whichever of our prompts this is"""
+    if STRUCTURED_REQUEST in prompt:
+        return plan_document(days=7, seed=seed)
+    per_day = PER_DAY_REQUEST.search(prompt)
+    if per_day:
+        return meal_plan_text(days=per_day.group(1).count("DAY"), seed=seed)
+    swap = SWAP_REQUEST.search(prompt)
+    if swap:
+        return meal_text(swap.group(1), seed=seed)
+    if "7-day meal plan" in prompt:
+        return meal_plan_text(days=7, seed=seed)
+    if "grocery list" in prompt.lower():
+        return grocery_list_text(items_per_category=10)
+    if "meal prep tips" in prompt.lower():
+        return prep_tips_text(5)
+    if "CALORIES:" in prompt:
+        return TARGETS_TEXT
+    return "OK"
+
+
+def count_tokens(text):
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+class FakeOpenAIConfig:
+    __slots__ = ("latency", "jitter", "tokens_per_second", "rate_429", "rate_500", "rate_timeout",
+                 "hang_seconds", "retry_after", "seed")
+
+    def __init__(self, latency=0.5, jitter=0.1, tokens_per_second=80.0, rate_429=0.0, rate_500=0.0,
+                 rate_timeout=0.0, hang_seconds=600.0, retry_after=1.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.rate_429 = rate_429
+        self.rate_500 = rate_500
+        self.rate_timeout = rate_timeout
+        self.hang_seconds = hang_seconds
+        self.retry_after = retry_after
+        self.seed = seed
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """``serve_forever`` in the foreground, or ``start``/``stop`` from a benchmark"""
+
+    daemon_threads = True
+
+    def __init__(self, address, config=None):
+        super().__init__(address, FakeOpenAIHandler)
+        self.config = config or FakeOpenAIConfig()
+        self.random = random.Random(self.config.seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "completions": 0, "streams": 0, "429": 0, "500": 0, "timeouts": 0,
+                      "completion_tokens": 0}
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def draw_fault(self):
+        config = self.config
+        with self.lock:
+            roll = self.random.random()
+        for fault, rate in (("429", config.rate_429), ("500", config.rate_500), ("timeout", config.rate_timeout)):
+            if roll < rate:
+                return fault
+            roll -= rate
+        return None
+
+    def first_token_delay(self):
+        with self.lock:
+            jitter = self.random.uniform(-self.config.jitter, self.config.jitter)
+        return max(0.0, self.config.latency + jitter)
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/") in ("", "/health", "/stats"):
+            with self.server.lock:
+                self._send_json(200, dict(self.server.stats))
+        else:
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server = self.server
+        server.count("requests")
+
+        fault = server.draw_fault()
+        if fault == "429":
+            server.count("429")
+            self._send_json(429, {"error": {"message": "Rate limit reached (injected)", "type": "requests"}},
+                            {"Retry-After": f"{server.config.retry_after:g}"})
+            return
+        if fault == "500":
+            server.count("500")
+            self._send_json(500, {"error": {"message": "Internal server error (injected)", "type": "server_error"}})
+            return
+        if fault == "timeout":
+            server.count("timeouts")
+            time.sleep(server.config.hang_seconds)
+            self.close_connection = True
+            return
+
+        prompt = body.get("messages", [{}])[-1].get("content", "")
+        text = canned_response(prompt, seed=body.get("seed") or 0)
+        max_chars = body.get("max_tokens", 4096) * CHARS_PER_TOKEN
+        finish_reason = "length" if len(text) > max_chars else "stop"
+        text = text[:max_chars]
+        server.count("completion_tokens", count_tokens(text))
+
+        time.sleep(server.first_token_delay())
+        if body.get("stream"):
+            server.count("streams")
+            self._stream(body, text, finish_reason)
+        else:
+            server.count("completions")
+            time.sleep(count_tokens(text) / server.config.tokens_per_second)
+            self._send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                             "finish_reason": finish_reason}],
+                "usage": {"prompt_tokens": count_tokens(prompt), "completion_tokens": count_tokens(text),
+                          "total_tokens": count_tokens(prompt) + count_tokens(text)},
+            })
+
+    def _stream(self, body, text, finish_reason):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+        step = STREAM_CHUNK_TOKENS * CHARS_PER_TOKEN
+        delay = STREAM_CHUNK_TOKENS / self.server.config.tokens_per_second
+
+        def event(delta, finish=None):
+            payload = {"id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                       "model": body.get("model", "fake"),
+                       "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode())
+            self.wfile.flush()
+
+        try:
+            event({"role": "assistant", "content": ""})
+            for start in range(0, len(text), step):
+                time.sleep(delay)
+                event({"content": text[start:start + step]})
+            event({}, finish_reason)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI chat-completions API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument("--jitter", type=float, default=0.1, help="+/- seconds added to the latency")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of requests rate limited")
+    parser.add_argument("--rate-500", type=float, default=0.0, help="fraction of requests failing")
+    parser.add_argument("--rate-timeout", type=float, default=0.0, help="fraction of requests that hang")
+    parser.add_argument("--hang-seconds", type=float, default=600.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    config = FakeOpenAIConfig(args.latency, args.jitter, args.tokens_per_second, args.rate_429, args.rate_500,
+                              args.rate_timeout, args.hang_seconds, args.retry_after, args.seed)
+    server = FakeOpenAIServer((args.host, args.port), config)
+    print(f"Fake OpenAI listening on {server.base_url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Minimal SMTP sink that accepts and counts messages without delivering them.
+
+Advertises no AUTH or STARTTLS, so the mailer skips login; run the app with
+``SMTP_HOST=127.0.0.1 SMTP_PORT=<port> SMTP_STARTTLS=false``.
+
+    python -m bench.fake_smtp --port 8025
+"""
+import argparse
+import socketserver
+import threading
+
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.reply("220 fake-smtp ready")
+        recipients = 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].decode(errors="replace").upper()
+            if command in ("EHLO", "HELO"):
+                self.reply("250-fake-smtp")
+                self.reply("250 8BITMIME")
+            elif command == "MAIL":
+                recipients = 0
+                self.reply("250 OK")
+            elif command == "RCPT":
+                recipients += 1
+                self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                for data in self.rfile:
+                    if data in (b".\r\n", b".\n"):
+                        break
+                    size += len(data)
+                self.server.record(recipients, size)
+                self.reply("250 OK queued")
+            elif command in ("RSET", "NOOP"):
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, FakeSMTPHandler)
+        self.lock = threading.Lock()
+        self.stats = {"messages": 0, "recipients": 0, "bytes": 0}
+        self._thread = None
+
+    def record(self, recipients, size):
+        with self.lock:
+            self.stats["messages"] += 1
+            self.stats["recipients"] += recipients
+            self.stats["bytes"] += size
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-smtp", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SMTP sink for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    args = parser.parse_args(argv)
+    server = FakeSMTPServer((args.host, args.port))
+    print(f"Fake SMTP listening on {args.host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Pre-parser string-concatenating formatters, kept verbatim as a benchmark baseline"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+def format_meal_plan(meal_plan_text):
+    """Format the meal plan text into structured HTML"""
+    try:
+        logger.debug(f"Formatting meal plan: {meal_plan_text}")
+        if not meal_plan_text:
+            return "<p>Error: Empty meal plan</p>"
+
+        formatted_html = "<div class='meal-plan'>"
+        current_day = None
+        current_meal = None
+        meal_description = None
+        
+        for line in meal_plan_text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+                
+            if line.startswith("DAY"):
+                if current_day:
+                    if current_meal and meal_description:
+                        formatted_html += f"<p>{meal_description}</p>"
+                    formatted_html += "</div>"
+                current_day = line
+                current_meal = None
+                meal_description = None
+                formatted_html += f"""
+                    <div class="meal-day">
+                        <h3>{current_day}</h3>
+                """
+            elif line in ["Breakfast", "Lunch", "Dinner", "Snacks"]:
+                if current_meal and meal_description:
+                    formatted_html += f"<p>{meal_description}</p>"
+                current_meal = line
+                meal_description = None
+                formatted_html += f"""
+                    <div class="meal-item">
+                        <h4>{current_meal}</h4>
+                """
+            elif line.startswith("-"):
+                meal_description = line[1:].strip()
+            elif line.startswith("|"):
+                formatted_html += f"""
+                    <p>{meal_description}</p>
+                    <p class="macros">{line.strip()}</p>
+                    </div>
+                """
+                current_meal = None
+                meal_description = None
+            elif "Meal Prep Tips:" in line:
+                if current_meal and meal_description:
+                    formatted_html += f"<p>{meal_description}</p>"
+                formatted_html += "<h4>Meal Prep Tips:</h4>"
+            elif line.startswith("-") and "Meal Prep Tips:" in formatted_html:
+                formatted_html += f"<p>{line[1:].strip()}</p>"
+        
+        if current_day:  # Close the last day div if exists
+            if current_meal and meal_description:
+                formatted_html += f"<p>{meal_description}</p>"
+            formatted_html += "</div>"
+        formatted_html += "</div>"
+        return formatted_html
+            
+    except Exception as e:
+        logger.error(f"Error formatting meal plan: {str(e)}")
+        return "<p>Error formatting meal plan</p>"
+
+def format_grocery_list(grocery_list):
+    """Format the grocery list with categories"""
+    try:
+        logger.debug(f"Formatting grocery list: {grocery_list}")
+        if not grocery_list:
+            return "<p>Error: Empty grocery list</p>"
+
+        formatted_html = '<div class="grocery-list">'
+        current_category = None
+        
+        for line in grocery_list.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+                
+            if line.endswith(':'):  # Category header
+                if current_category:
+                    formatted_html += "</ul>"
+                current_category = line
+                formatted_html += f"""
+                    <h3>{current_category}</h3>
+                    <ul>
+                """
+            elif line.startswith('-'):
+                formatted_html += f"<li>{line[1:].strip()}</li>"
+        
+        if current_category:  # Close the last category if exists
+            formatted_html += "</ul>"
+        formatted_html += "</div>"
+        return formatted_html
+            
+    except Exception as e:
+        logger.error(f"Error formatting grocery list: {str(e)}")
+        return "<p>Error formatting grocery list</p>"
+
+def format_prep_tips(tips_text):
+    """Format the meal prep tips"""
+    try:
+        logger.debug(f"Formatting prep tips: {tips_text}")
+        if not tips_text:
+            return "<p>Error: Empty prep tips</p>"
+
+        formatted_html = '<div class="prep-tips"><ol>'
+        for line in tips_text.splitlines():
+            line = line.strip()
+            if line and (line[0].isdigit() or line.startswith('-')):
+                formatted_html += f"<li>{line.lstrip('123456789.- ')}</li>"
+        formatted_html += '</ol></div>'
+        return formatted_html
+            
+    except Exception as e:
+        logger.error(f"Error formatting prep tips: {str(e)}")
+        return "<p>Error formatting prep tips</p>"
+
+def format_daily_targets(targets_text):
+    """Format the daily targets section"""
+    try:
+        logger.debug(f"Formatting daily targets: {targets_text}")
+        if not targets_text or "CALORIES:" not in targets_text:
+            return "<p>Error: Invalid daily targets format</p>"
+
+        # Split the text into lines and find the relevant lines
+        lines = targets_text.split('\n')
+        calories = next((line.split('CALORIES:')[1].strip() for line in lines if 'CALORIES:' in line), 'N/A')
+        protein = next((line.split('PROTEIN:')[1].strip() for line in lines if 'PROTEIN:' in line), 'N/A')
+        carbs = next((line.split('CARBS:')[1].strip() for line in lines if 'CARBS:' in line), 'N/A')
+        fats = next((line.split('FATS:')[1].strip() for line in lines if 'FATS:' in line), 'N/A')
+        
+        return f"""
+        <div class="macros-box">
+            <table class="meal-table">
+                <tr>
+                    <th>Calories</th>
+                    <th>Protein</th>
+                    <th>Carbs</th>
+                    <th>Fats</th>
+                </tr>
+                <tr>
+                    <td>{calories}</td>
+                    <td>{protein}</td>
+                    <td>{carbs}</td>
+                    <td>{fats}</td>
+                </tr>
+            </table>
+        </div>
+        """
+    except Exception as e:
+        logger.error(f"Error formatting daily targets: {str(e)}")
+        return "<p>Error formatting daily targets</p>"
+
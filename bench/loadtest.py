@@ -0,0 +1,292 @@
+"""End-to-end load test: the app under gunicorn against local OpenAI and SMTP stand-ins.
+
+Starts the fake OpenAI server, an SMTP sink and ``gunicorn wsgi:app``, then
+drives ``/api/generate-meal-plan`` with a questionnaire profile mix and
+prints throughput, latency percentiles and error rates as JSON, so runs can
+be compared between commits.
+
+Usage: python -m bench.loadtest [--server wsgi|asgi] [--workers 2] [--threads 4] [--concurrency 8] [--requests 100]
+                                [--mode sync|async|stream] [--latency 0.5] [--tokens-per-second 80]
+                                [--rate-429 0.0] [--env MEAL_PLAN_MODE=per_day] [--output run.json]
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.fake_openai import FakeOpenAIConfig, FakeOpenAIServer
+from bench.fake_smtp import FakeSMTPServer
+from bench.profiles import profile_mix
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PATH = "/api/generate-meal-plan"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    # Nearest-rank
+    return sorted_values[max(0, math.ceil(pct / 100.0 * len(sorted_values)) - 1)]
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def start_gunicorn(port, workers, threads, env, log_path, server="wsgi", extra_args=()):
+    command = [sys.executable, "-m", "gunicorn", f"{server}:app", "--bind", f"127.0.0.1:{port}",
+               "--workers", str(workers), "--timeout", "300", *extra_args]
+    # The ASGI app runs one event loop per worker instead of a thread pool
+    command += ["-k", "uvicorn.workers.UvicornWorker"] if server == "asgi" else ["--threads", str(threads)]
+    log = open(log_path, "w")
+    process = subprocess.Popen(command, cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    process.log_file = log
+    return process, command
+
+
+def wait_until_up(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("gunicorn did not become healthy in time")
+
+
+class Client:
+    """One keep-alive connection per driver thread"""
+
+    def __init__(self, port, timeout):
+        self.port = port
+        self.timeout = timeout
+        self.conn = None
+
+    def request(self, method, path, body=None):
+        for attempt in (0, 1):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=self.timeout)
+            try:
+                headers = {"Content-Type": "application/json"} if body is not None else {}
+                self.conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+                response = self.conn.getresponse()
+                return response.status, response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The server closed an idle keep-alive connection; retry once on a fresh one
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+
+def run_one(client, mode, profile, email, poll_interval):
+    """Returns (outcome, seconds); outcome is 'ok', an HTTP status, or an error name"""
+    body = {"userProfile": profile, "email": email}
+    start = time.perf_counter()
+    try:
+        if mode == "stream":
+            status, data = client.request("POST", PATH + "/stream", body)
+            ok = status == 200 and b"event: done" in data
+            return ("ok" if ok else (str(status) if status != 200 else "stream_error")), time.perf_counter() - start
+        if mode == "async":
+            status, data = client.request("POST", PATH + "?async=1", body)
+            if status != 202:
+                return str(status), time.perf_counter() - start
+            status_url = json.loads(data)["status_url"]
+            while True:
+                time.sleep(poll_interval)
+                status, data = client.request("GET", status_url)
+                job = json.loads(data).get("job", {}) if status == 200 else {}
+                if job.get("status") == "succeeded":
+                    return "ok", time.perf_counter() - start
+                if status != 200 or job.get("status") == "failed":
+                    return "job_failed", time.perf_counter() - start
+        status, data = client.request("POST", PATH, body)
+        return ("ok" if status == 200 else str(status)), time.perf_counter() - start
+    except socket.timeout:
+        return "timeout", time.perf_counter() - start
+    except OSError as e:
+        return type(e).__name__, time.perf_counter() - start
+
+
+def drive(port, requests, concurrency, mode, timeout, poll_interval):
+    local = threading.local()
+    results = []
+    lock = threading.Lock()
+
+    def worker(item):
+        if not hasattr(local, "client"):
+            local.client = Client(port, timeout)
+        outcome = run_one(local.client, mode, item[0], item[1], poll_interval)
+        with lock:
+            results.append(outcome)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, requests))
+    return results, time.perf_counter() - start
+
+
+def summarize(results, elapsed):
+    latencies = sorted(seconds for outcome, seconds in results if outcome == "ok")
+    outcomes = {}
+    for outcome, _ in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    total = len(results)
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 1)
+
+    return {
+        "requests": total,
+        "succeeded": len(latencies),
+        "error_rate": round((total - len(latencies)) / total, 4) if total else 0.0,
+        "outcomes": outcomes,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": ms(sum(latencies) / len(latencies)) if latencies else None,
+            "p50": ms(percentile(latencies, 50)),
+            "p95": ms(percentile(latencies, 95)),
+            "p99": ms(percentile(latencies, 99)),
+            "max": ms(latencies[-1]) if latencies else None,
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--threads", type=int, default=4, help="gunicorn threads per worker")
+    parser.add_argument("--server", choices=("wsgi", "asgi"), default="wsgi",
+                        help="sync Flask workers or the ASGI app on uvicorn workers")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent client connections")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=4, help="requests sent before measuring")
+    parser.add_argument("--mode", choices=("sync", "async", "stream"), default="sync")
+    parser.add_argument("--repeat-rate", type=float, default=0.2, help="share of repeated profiles")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=300.0, help="client socket timeout")
+    parser.add_argument("--poll-interval", type=float, default=0.25, help="job status polling in async mode")
+    parser.add_argument("--latency", type=float, default=0.5, help="fake OpenAI time to first token")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-500", type=float, default=0.0)
+    parser.add_argument("--rate-timeout", type=float, default=0.0)
+    parser.add_argument("--hang-seconds", type=float, default=60.0)
+    parser.add_argument("--no-cache", action="store_true", help="disable the prompt cache in the app")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra app environment, e.g. MEAL_PLAN_MODE=per_day")
+    parser.add_argument("--keep-data", action="store_true", help="keep the app's DATA_DIR and gunicorn log")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    fake_config = FakeOpenAIConfig(args.latency, args.jitter, args.tokens_per_second, args.rate_429, args.rate_500,
+                                   args.rate_timeout, args.hang_seconds, seed=args.seed)
+    openai_server = FakeOpenAIServer(("127.0.0.1", 0), fake_config).start()
+    smtp_server = FakeSMTPServer(("127.0.0.1", 0)).start()
+    data_dir = tempfile.mkdtemp(prefix="eatreal-loadtest-")
+    port = free_port()
+
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "sk-loadtest",
+        "EMAIL_USERNAME": "loadtest@example.com",
+        "EMAIL_PASSWORD": "loadtest",
+        "LLM_BACKEND": "fake",
+        "LLM_BASE_URL": openai_server.base_url,
+        "SMTP_HOST": "127.0.0.1",
+        "SMTP_PORT": str(smtp_server.server_address[1]),
+        "SMTP_STARTTLS": "false",
+        "DATA_DIR": data_dir,
+        "PROMPT_CACHE_ENABLED": "false" if args.no_cache else "true",
+        "PYTHONPATH": REPO_ROOT,
+    })
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    log_path = os.path.join(data_dir, "gunicorn.log")
+    process, command = start_gunicorn(port, args.workers, args.threads, env, log_path, args.server)
+    try:
+        wait_until_up(port, process)
+        mix = profile_mix(args.warmup + args.requests, seed=args.seed, repeat_rate=args.repeat_rate)
+        if args.warmup:
+            drive(port, mix[:args.warmup], min(args.concurrency, args.warmup), args.mode, args.timeout,
+                  args.poll_interval)
+        with openai_server.lock:
+            openai_before = dict(openai_server.stats)
+        results, elapsed = drive(port, mix[args.warmup:], args.concurrency, args.mode, args.timeout,
+                                 args.poll_interval)
+
+        # Give the outbox a moment to drain so delivered mail can be compared to requests
+        deadline = time.monotonic() + 10
+        while smtp_server.stats["messages"] < args.warmup + args.requests and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+        with openai_server.lock:
+            openai_stats = {key: value - openai_before[key] for key, value in openai_server.stats.items()}
+        report = {
+            "revision": git_revision(),
+            "config": {
+                "server": args.server, "workers": args.workers, "threads": args.threads,
+                "concurrency": args.concurrency, "mode": args.mode, "requests": args.requests, "warmup": args.warmup,
+                "repeat_rate": args.repeat_rate, "prompt_cache": not args.no_cache, "env": args.env,
+                "fake_openai": {"latency": args.latency, "jitter": args.jitter,
+                                "tokens_per_second": args.tokens_per_second, "rate_429": args.rate_429,
+                                "rate_500": args.rate_500, "rate_timeout": args.rate_timeout},
+                "command": " ".join(command[1:]),
+            },
+            "results": summarize(results, elapsed),
+            "openai": openai_stats,
+            "smtp": dict(smtp_server.stats),
+        }
+        if args.keep_data:
+            report["data_dir"] = data_dir
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        process.log_file.close()
+        openai_server.stop()
+        smtp_server.stop()
+        if not args.keep_data:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
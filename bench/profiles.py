@@ -0,0 +1,50 @@
+"""Questionnaire profiles for load tests, drawn from the answer space in assets/js/questionnaire.js"""
+import random
+
+CHOICES = {
+    "goal": ("weight_loss", "muscle_gain", "health", "energy"),
+    "gender": ("male", "female"),
+    "activity": ("sedentary", "light", "moderate", "very_active"),
+    "diet_preference": ("omnivore", "vegetarian", "vegan", "pescatarian", "animal_based"),
+    "allergies": ("none", "nuts", "dairy", "gluten"),
+    "cooking_time": ("minimal", "moderate", "flexible"),
+    "meal_prep": ("yes", "no"),
+}
+# Weights for a realistic mix; fields not listed are uniform
+WEIGHTS = {
+    "goal": (0.45, 0.25, 0.2, 0.1),
+    "diet_preference": (0.55, 0.15, 0.1, 0.1, 0.1),
+    "allergies": (0.7, 0.1, 0.1, 0.1),
+}
+# The questionnaire's validation ranges
+RANGES = {"age": (16, 100), "height": (140, 220), "current_weight": (30, 250), "target_weight": (30, 250)}
+
+
+def random_profile(rng):
+    """One questionnaire answer set, with numbers kept plausible for the gender"""
+    profile = {field: rng.choices(options, WEIGHTS.get(field))[0] for field, options in CHOICES.items()}
+    male = profile["gender"] == "male"
+    profile["age"] = str(int(min(max(rng.gauss(36, 12), RANGES["age"][0]), 75)))
+    profile["height"] = str(int(min(max(rng.gauss(178 if male else 165, 7), RANGES["height"][0]),
+                                    RANGES["height"][1])))
+    weight = min(max(rng.gauss(85 if male else 70, 15), 45), 180)
+    change = {"weight_loss": -rng.uniform(3, 20), "muscle_gain": rng.uniform(2, 8)}.get(profile["goal"], 0)
+    profile["current_weight"] = f"{weight:.0f}"
+    profile["target_weight"] = f"{weight + change:.0f}"
+    return profile
+
+
+def profile_mix(count, seed=0, repeat_rate=0.2):
+    """``count`` (profile, email) pairs; ``repeat_rate`` of them reuse an earlier profile,
+    as happens when people retake the questionnaire with the same answers"""
+    rng = random.Random(seed)
+    profiles = []
+    requests = []
+    for i in range(count):
+        if profiles and rng.random() < repeat_rate:
+            profile = rng.choice(profiles)
+        else:
+            profile = random_profile(rng)
+            profiles.append(profile)
+        requests.append((dict(profile, email=f"loadtest+{i}@example.com"), f"loadtest+{i}@example.com"))
+    return requests
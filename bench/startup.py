@@ -0,0 +1,147 @@
+"""Startup benchmark: module import time, gunicorn boot time and first-request latency.
+
+Import time is measured in fresh interpreters, without any secrets set.
+Boot time is from starting gunicorn until ``GET /`` answers, with and
+without ``--preload``; then the first and second plan generations are timed
+against the local OpenAI and SMTP stand-ins. Prints a JSON report.
+
+Usage: python -m bench.startup [--runs 5] [--workers 2] [--server wsgi|asgi] [--output startup.json]
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.fake_openai import FakeOpenAIConfig, FakeOpenAIServer
+from bench.fake_smtp import FakeSMTPServer
+from bench.loadtest import PATH, REPO_ROOT, Client, free_port, git_revision, start_gunicorn
+from bench.profiles import profile_mix
+
+MODULES = ("api.generate_meal_plan", "wsgi")
+SECRETS = ("OPENAI_API_KEY", "EMAIL_USERNAME", "EMAIL_PASSWORD")
+
+
+def import_seconds(module, env):
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, env=env, capture_output=True, text=True,
+                            timeout=120)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed: {result.stderr.strip().splitlines()[-1:]}")
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def wait_for_health(port, process, timeout=60):
+    """Seconds until ``GET /`` returns 200, polled every 10 ms"""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/")
+            if conn.getresponse().status == 200:
+                return time.perf_counter() - start
+        except OSError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError("gunicorn did not become healthy in time")
+
+
+def boot_once(env, workers, server, preload, profiles, data_dir):
+    port = free_port()
+    env = dict(env, GUNICORN_PRELOAD="true" if preload else "false")
+    process, _ = start_gunicorn(port, workers, 2, env, os.path.join(data_dir, "gunicorn.log"), server)
+    try:
+        boot = wait_for_health(port, process)
+        client = Client(port, 120)
+        latencies = []
+        for profile, email in profiles:
+            start = time.perf_counter()
+            status, _ = client.request("POST", PATH, {"userProfile": profile, "email": email})
+            if status != 200:
+                raise RuntimeError(f"generation returned HTTP {status}")
+            latencies.append(time.perf_counter() - start)
+        return boot, latencies
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        process.log_file.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--server", choices=("wsgi", "asgi"), default="wsgi")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake OpenAI time to first token")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    env = {key: value for key, value in os.environ.items() if key not in SECRETS}
+    env.update({"PYTHONPATH": REPO_ROOT, "LOG_LEVEL": "WARNING", "DOTENV_PATH": os.devnull})
+    imports = {}
+    for module in MODULES:
+        seconds = [import_seconds(module, env) for _ in range(args.runs)]
+        imports[module] = {"median_ms": round(statistics.median(seconds) * 1000, 1),
+                           "min_ms": round(min(seconds) * 1000, 1)}
+
+    openai_server = FakeOpenAIServer(("127.0.0.1", 0), FakeOpenAIConfig(args.latency, 0.0, 5000.0)).start()
+    smtp_server = FakeSMTPServer(("127.0.0.1", 0)).start()
+    env.update({
+        "OPENAI_API_KEY": "sk-startup",
+        "EMAIL_USERNAME": "startup@example.com",
+        "EMAIL_PASSWORD": "startup",
+        "LLM_BACKEND": "fake",
+        "LLM_BASE_URL": openai_server.base_url,
+        "SMTP_HOST": "127.0.0.1",
+        "SMTP_PORT": str(smtp_server.server_address[1]),
+        "SMTP_STARTTLS": "false",
+        "PROMPT_CACHE_ENABLED": "false",
+    })
+    boots = {}
+    try:
+        for preload in (False, True):
+            boot_seconds, first, second = [], [], []
+            for run in range(args.runs):
+                data_dir = tempfile.mkdtemp(prefix="eatreal-startup-")
+                try:
+                    boot, latencies = boot_once(dict(env, DATA_DIR=data_dir), args.workers, args.server, preload,
+                                                profile_mix(2, seed=run, repeat_rate=0.0), data_dir)
+                finally:
+                    shutil.rmtree(data_dir, ignore_errors=True)
+                boot_seconds.append(boot)
+                first.append(latencies[0])
+                second.append(latencies[1])
+            boots["preload" if preload else "no_preload"] = {
+                "boot_ms": round(statistics.median(boot_seconds) * 1000, 1),
+                "first_request_ms": round(statistics.median(first) * 1000, 1),
+                "second_request_ms": round(statistics.median(second) * 1000, 1),
+            }
+    finally:
+        openai_server.stop()
+        smtp_server.stop()
+
+    report = {
+        "revision": git_revision(),
+        "config": {"runs": args.runs, "workers": args.workers, "server": args.server, "latency": args.latency},
+        "import": imports,
+        "gunicorn": boots,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
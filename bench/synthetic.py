@@ -0,0 +1,77 @@
+"""Synthetic model output in the exact formats the prompts ask for"""
+import json
+import random
+
+MEALS = {
+    "Breakfast": ["Oatmeal with Berries", "Greek Yogurt Parfait", "Veggie Omelette", "Avocado Toast"],
+    "Lunch": ["Grilled Chicken Salad", "Quinoa Buddha Bowl", "Turkey Wrap", "Lentil Soup"],
+    "Dinner": ["Baked Salmon", "Beef Stir Fry", "Chickpea Curry", "Stuffed Peppers"],
+    "Snacks": ["Hummus and Carrots", "Apple with Almond Butter", "Trail Mix", "Cottage Cheese"],
+}
+DESCRIPTION = ("A hearty serving of {name} made with fresh seasonal vegetables, olive oil and herbs. "
+               "Served with a side of whole grains for lasting energy.")
+
+
+def meal_plan_text(days=7, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    for day in range(1, days + 1):
+        lines.append(f"DAY {day}:")
+        lines.append("")
+        for slot, names in MEALS.items():
+            name = rng.choice(names)
+            lines.extend((
+                slot,
+                name,
+                "- " + DESCRIPTION.format(name=name.lower()),
+                f"| protein: {rng.randint(10, 45)}g, carbs: {rng.randint(10, 70)}g, fats: {rng.randint(5, 30)}g",
+                "",
+            ))
+        lines.extend(("Meal Prep Tips:", "- Prep vegetables and proteins in advance",
+                      "- Cook grains in batches", "- Store components separately", ""))
+    return "\n".join(lines)
+
+
+def meal_text(slot, seed=0):
+    """A single meal, as the swap prompt asks for"""
+    rng = random.Random(seed)
+    name = rng.choice(MEALS.get(slot, MEALS["Dinner"]))
+    return "\n".join((slot, name, "- " + DESCRIPTION.format(name=name.lower()),
+                      f"| protein: {rng.randint(10, 45)}g, carbs: {rng.randint(10, 70)}g, fats: {rng.randint(5, 30)}g"))
+
+
+def plan_document(days=7, seed=0):
+    """The JSON object the structured plan prompt asks for"""
+    rng = random.Random(seed)
+    document = {
+        "targets": {"calories": "1800-2000", "protein": "30%", "carbs": "40%", "fats": "30%"},
+        "days": [],
+        "grocery": [{"category": category, "items": [f"{category.lower()} item {i} ({i % 5 + 1} lbs)"
+                                                     for i in range(10)]}
+                    for category in ("PRODUCE", "PROTEINS", "PANTRY")],
+        "tips": [f"Batch cook and store meal component {i} in airtight containers." for i in range(1, 6)],
+    }
+    for day in range(1, days + 1):
+        meals = []
+        for slot, names in MEALS.items():
+            name = rng.choice(names)
+            meals.append({"slot": slot, "name": name, "description": DESCRIPTION.format(name=name.lower()),
+                          "protein": rng.randint(10, 45), "carbs": rng.randint(10, 70), "fats": rng.randint(5, 30)})
+        document["days"].append({"day": day, "meals": meals,
+                                 "prep_tips": ["Prep vegetables and proteins in advance", "Cook grains in batches"]})
+    return json.dumps(document, indent=1)
+
+
+def grocery_list_text(items_per_category=30):
+    lines = []
+    for category in ("PRODUCE", "PROTEINS", "PANTRY"):
+        lines.append(f"{category}:")
+        lines.extend(f"- {category.lower()} item {i} ({i % 5 + 1} lbs)" for i in range(items_per_category))
+    return "\n".join(lines)
+
+
+def prep_tips_text(count=5):
+    return "\n".join(f"{i}. Batch cook and store meal component {i} in airtight containers." for i in range(1, count + 1))
+
+
+TARGETS_TEXT = "CALORIES: 1800-2000\nPROTEIN: 30%\nCARBS: 40%\nFATS: 30%"
@@ -0,0 +1,12 @@
+import os
+
+# Import the app once in the master and fork workers from it, so they share its
+# warmed memory and boot without repeating the imports. Set GUNICORN_PRELOAD=false
+# to import per worker instead (e.g. for --reload during development).
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        from api.generate_meal_plan import warm_up
+        warm_up()
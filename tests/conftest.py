@@ -0,0 +1,8 @@
+import pytest
+
+from tests.samples import make_plan
+
+
+@pytest.fixture
+def plan():
+    return make_plan()
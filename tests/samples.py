@@ -0,0 +1,21 @@
+"""Sample plans shared by the tests"""
+from api.grocery import build_grocery_list
+from api.plan_model import DailyTargets, Day, Meal, Plan
+
+MEALS = {
+    "Breakfast": ("Oatmeal with Berries", "Rolled oats topped with blueberries and chia seeds.", 15, 60, 10),
+    "Lunch": ("Grilled Chicken Salad", "Mixed greens with grilled chicken breast, cucumber and olive oil.", 45, 20, 15),
+    "Dinner": ("Baked Salmon", "Salmon fillet with roasted broccoli and quinoa.", 40, 45, 20),
+    "Snacks": ("Apple with Almond Butter", "A sliced apple with two tablespoons of almond butter.", 6, 25, 16),
+}
+
+
+def make_day(number):
+    return Day(number, meals=[Meal(slot, *MEALS[slot]) for slot in MEALS], prep_tips=["Cook the quinoa ahead"])
+
+
+def make_plan(days=2):
+    plan = Plan(DailyTargets("1800-2000", "30% (140g)", "40% (190g)", "30% (63g)"),
+                [make_day(number) for number in range(1, days + 1)], tips=["Batch cook grains"])
+    plan.grocery = build_grocery_list(plan.days)
+    return plan
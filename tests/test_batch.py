@@ -0,0 +1,84 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import api.generate_meal_plan as service
+from api.batch import load_checkpoint, read_profiles, run
+from tests.samples import make_plan
+
+
+@pytest.fixture
+def profiles(tmp_path):
+    path = tmp_path / "profiles.jsonl"
+    lines = [{"userProfile": {"goal": "good"}, "id": "a"}, {"userProfile": {"goal": "bad"}, "id": "b"},
+             {"userProfile": {"goal": "good"}, "id": "c"}]
+    path.write_text("".join(json.dumps(line) + "\n" for line in lines))
+    return str(path)
+
+
+@pytest.fixture
+def generated(tmp_path, monkeypatch):
+    """Names of the profiles generated; the ones in ``failing`` raise"""
+    generated = SimpleNamespace(calls=[], failing={"bad"})
+
+    def generate_plan(profile):
+        generated.calls.append(profile["goal"])
+        if profile["goal"] in generated.failing:
+            raise ValueError("could not parse the meal plan")
+        return make_plan()
+
+    monkeypatch.setattr(service, "DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(service, "generate_plan", generate_plan)
+    monkeypatch.setattr(service, "review_plan", lambda plan, profile: (set(), [], []))
+    service.metrics.cache_clear()
+    yield generated
+    service.metrics.cache_clear()
+
+
+def read_results(output):
+    return [json.loads(line) for line in (output / "results.jsonl").read_text().splitlines()]
+
+
+def test_read_profiles_groups_identical_profiles(profiles):
+    assert [(profile["goal"], ids) for _, profile, ids in read_profiles(profiles)] == [("good", ["a", "c"]),
+                                                                                      ("bad", ["b"])]
+
+
+def test_a_failing_profile_is_recorded_and_retried(tmp_path, profiles, generated):
+    output = tmp_path / "out"
+    summary = run(profiles, str(output), workers=2, html=False)
+
+    assert (summary["unique"], summary["succeeded"], summary["failed"]) == (2, 1, 1)
+    failed = [record for record in read_results(output) if record["status"] == "failed"]
+    assert failed == [{"profile_key": failed[0]["profile_key"], "ids": ["b"], "status": "failed",
+                       "error": "could not parse the meal plan", "seconds": failed[0]["seconds"]}]
+
+    generated.calls.clear()
+    generated.failing.clear()
+    summary = run(profiles, str(output), workers=2, html=False)
+    assert generated.calls == ["bad"]
+    assert (summary["skipped"], summary["succeeded"], summary["failed"]) == (1, 1, 0)
+    assert len(load_checkpoint(str(output / "results.jsonl"))) == 2
+
+
+def test_checkpoint_drops_a_partly_written_record(tmp_path):
+    path = tmp_path / "results.jsonl"
+    path.write_text(json.dumps({"profile_key": "k1", "status": "ok"}) + "\n"
+                    + json.dumps({"profile_key": "k2", "status": "failed"}) + "\n"
+                    + json.dumps({"profile_key": "k2", "status": "ok"}) + "\n"
+                    + '{"profile_key": "k3", "sta')
+
+    assert load_checkpoint(str(path)) == {"k1", "k2"}
+    assert path.read_text().endswith('"ok"}\n')
+
+
+def test_restart_ignores_the_checkpoint(tmp_path, profiles, generated):
+    output = tmp_path / "out"
+    generated.failing.clear()
+    run(profiles, str(output), html=False)
+    generated.calls.clear()
+
+    summary = run(profiles, str(output), html=False, restart=True)
+    assert sorted(generated.calls) == ["bad", "good"] and summary["skipped"] == 0
+    assert len(read_results(output)) == 2
@@ -0,0 +1,177 @@
+import pytest
+
+from api.compliance import (RepairShed, Restrictions, check_meal, check_plan, check_text, flagged_meals,
+                            meal_warnings, profile_restrictions, repair_meals)
+from api.plan_model import Meal
+
+NUTS = Restrictions({"NUTS"}, reasons={"NUTS": "nuts allergy"}, allergens={"NUTS"})
+
+
+def terms(text, restrictions):
+    return sorted(term for _, term in check_text(text, restrictions))
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Toast with peanut butter", ["peanut butter"]),
+    ("Walnuts and pecans", ["pecans", "walnuts"]),
+    ("Oats with almond milk", ["almond milk"]),
+    ("Pesto pasta", ["pesto"]),
+    ("Butternut squash soup with nutmeg", []),
+    ("Coconut yogurt bowl", []),
+])
+def test_allergen_matcher(text, expected):
+    assert terms(text, NUTS) == expected
+
+
+def test_longest_match_decides_the_category():
+    dairy = Restrictions({"DAIRY"})
+    assert terms("Oats with almond milk", dairy) == []
+    assert terms("Oats with whole milk", dairy) == ["whole milk"]
+    assert terms("Curry with coconut milk", dairy) == []
+
+
+@pytest.mark.parametrize("text", [
+    "Salad with no cheese", "Tacos without sour cream", "Dairy-free pancakes", "Dairy free chocolate",
+])
+def test_negated_terms_are_ignored(text):
+    assert check_text(text, Restrictions({"DAIRY"})) == []
+
+
+def test_gluten_free_only_frees_the_next_match():
+    gluten = Restrictions({"GLUTEN"})
+    assert terms("Gluten-free pasta", gluten) == []
+    assert terms("Gluten-free pasta with toast", gluten) == ["toast"]
+
+
+def test_one_term_can_break_several_categories():
+    found = check_text("Stir fry with soy sauce", Restrictions({"SOY", "GLUTEN"}))
+    assert sorted(category for category, _ in found) == ["GLUTEN", "SOY"]
+
+
+def test_profile_restrictions_from_diet_and_allergies():
+    restrictions = profile_restrictions({"diet_preference": "vegetarian", "allergies": "Peanuts, dairy and kiwi"})
+    assert restrictions.categories == {"MEAT", "FISH", "SHELLFISH", "NUTS", "DAIRY"}
+    assert restrictions.allergens == {"NUTS", "DAIRY"}
+    assert restrictions.extra_terms == ("kiwi",)
+    assert restrictions.reasons["MEAT"] == "vegetarian diet"
+    assert restrictions.reasons["DAIRY"] == "dairy allergy"
+
+
+@pytest.mark.parametrize("allergies", ["", "none", "N/A", "n/a", None, "a, b"])
+def test_no_allergies(allergies):
+    assert not profile_restrictions({"allergies": allergies})
+
+
+def test_free_text_allergies():
+    restrictions = profile_restrictions({"allergies": "kiwi"})
+    [violation] = check_meal(Meal("Snacks", "Fruit Cup", "Sliced kiwis."), restrictions, 3)
+    assert (violation.day, violation.category, violation.term) == (3, "allergy:kiwi", "kiwis")
+    assert violation.allergen
+
+
+def test_diet_violations():
+    restrictions = profile_restrictions({"diet_preference": "vegan", "allergies": "none"})
+    [violation] = check_meal(Meal("Breakfast", "Honey Toast", "Toast with honey."), restrictions, 1)
+    assert violation.reason == "vegan diet"
+    assert not violation.allergen
+
+
+def test_check_plan_reports_meals_in_order(plan):
+    violations = check_plan(plan, NUTS)
+    assert [(v.day, v.slot, v.term) for v in violations] == [(1, "Snacks", "almond butter"),
+                                                             (2, "Snacks", "almond butter")]
+    assert flagged_meals(violations) == [(1, "Snacks"), (2, "Snacks")]
+    assert meal_warnings(violations)[(1, "Snacks")] == "Contains almond butter (nuts allergy)"
+    assert check_plan(plan, Restrictions()) == []
+
+
+def safe_snack(day, slot, exclude, attempt):
+    return Meal(slot, "Hummus and Carrots", "Carrot sticks with hummus.", 6, 20, 8)
+
+
+def test_repair_replaces_only_flagged_meals(plan):
+    violations = check_plan(plan, NUTS)
+    lunch = plan.days[0].meal("Lunch")
+
+    repaired, unresolved, shed = repair_meals(plan, NUTS, violations, safe_snack)
+
+    assert sorted(repaired) == [(1, "Snacks"), (2, "Snacks")]
+    assert (unresolved, shed) == ([], [])
+    assert check_plan(plan, NUTS) == []
+    assert plan.days[0].meal("Lunch") is lunch
+
+
+def test_repair_retries_with_every_term_seen(plan):
+    violations = check_plan(plan, NUTS)[:1]
+    calls = []
+
+    def generate(day, slot, exclude, attempt):
+        calls.append((attempt, exclude))
+        if attempt == 0:
+            return Meal(slot, "Trail Mix", "A handful of cashews.", 5, 10, 12)
+        return safe_snack(day, slot, exclude, attempt)
+
+    repaired, unresolved, _ = repair_meals(plan, NUTS, violations, generate)
+
+    assert repaired == [(1, "Snacks")] and unresolved == []
+    assert calls[0] == (0, [("almond butter", "nuts allergy")])
+    assert calls[1][0] == 1
+    assert {term for term, _ in calls[1][1]} == {"almond butter", "trail mix", "cashews"}
+
+
+def test_failed_repairs_stay_unresolved(plan):
+    violations = check_plan(plan, NUTS)
+
+    def generate(day, slot, exclude, attempt):
+        raise ValueError("Error: The model did not return a complete meal")
+
+    repaired, unresolved, shed = repair_meals(plan, NUTS, violations, generate, max_attempts=2)
+
+    assert repaired == [] and shed == []
+    assert unresolved == [(1, "Snacks"), (2, "Snacks")]
+
+
+def test_shed_calls_do_not_use_up_attempts(plan):
+    violations = check_plan(plan, NUTS)
+    calls = []
+
+    def generate(day, slot, exclude, attempt):
+        calls.append((day.number, attempt))
+        if len(calls) == 1:
+            raise RepairShed("busy")
+        return safe_snack(day, slot, exclude, attempt)
+
+    repaired, unresolved, shed = repair_meals(plan, NUTS, violations, generate, max_attempts=1)
+
+    assert sorted(repaired) == [(1, "Snacks"), (2, "Snacks")]
+    assert (unresolved, shed) == ([], [])
+    assert sorted(calls) == [(1, 0), (1, 0), (2, 0)]
+
+
+def test_repairs_stop_when_every_call_is_shed(plan):
+    violations = check_plan(plan, NUTS)
+    calls = []
+
+    def generate(day, slot, exclude, attempt):
+        calls.append(day.number)
+        raise RepairShed("busy")
+
+    repaired, unresolved, shed = repair_meals(plan, NUTS, violations, generate, max_attempts=3)
+
+    assert repaired == []
+    assert unresolved == shed == [(1, "Snacks"), (2, "Snacks")]
+    assert len(calls) == 2
+
+
+def test_meals_past_the_limit_are_unresolved_without_a_call(plan):
+    violations = check_plan(plan, NUTS)
+    calls = []
+
+    def generate(day, slot, exclude, attempt):
+        calls.append(day.number)
+        return safe_snack(day, slot, exclude, attempt)
+
+    repaired, unresolved, shed = repair_meals(plan, NUTS, violations, generate, max_meals=1)
+
+    assert (repaired, unresolved, shed) == ([(1, "Snacks")], [(2, "Snacks")], [])
+    assert calls == [1]
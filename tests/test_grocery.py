@@ -0,0 +1,72 @@
+import pytest
+
+from api.grocery import (build_grocery_list, extract_ingredients, extract_quantities, grocery_list_text,
+                         update_grocery_list)
+from api.plan_model import Day, GroceryCategory, Meal
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Rice noodles with bean sprouts and tofu", {"Rice noodles", "Bean sprouts", "Tofu"}),
+    ("Brown rice and black beans", {"Brown rice", "Black beans"}),
+    ("Greek yogurt with blueberries", {"Greek yogurt", "Blueberries"}),
+    ("Zucchini noodles with turkey meatballs", {"Zucchini", "Turkey"}),
+    ("Cauliflower rice stir fry", {"Cauliflower"}),
+    ("Spaghetti with marinara", {"Whole wheat pasta", "Canned tomatoes"}),
+])
+def test_phrases_are_matched_whole(text, expected):
+    assert extract_ingredients(text)[0] == expected
+
+
+def test_compounds_are_not_read_as_their_words():
+    known, _ = extract_ingredients("Pad thai with rice noodles and bean sprouts")
+    assert not known & {"Brown rice", "Whole wheat pasta", "Beans"}
+
+
+def test_plurals_and_unknown_phrases():
+    known, unknown = extract_ingredients("Roasted carrots, peaches and pickled jackfruit")
+    assert known == {"Carrots", "Peaches"}
+    assert unknown == {"pickled jackfruit"}
+
+
+def test_quantities_are_totalled_per_unit():
+    assert extract_quantities("150g grilled chicken breast, 1/2 cup rolled oats and 2 large eggs") == {
+        "Chicken breast": {"g": 150.0}, "Rolled oats": {"cup": 0.5}, "Eggs": {"": 2.0}}
+    assert extract_quantities("1.5 kg potatoes and 100 g rice noodles") == {
+        "Potatoes": {"g": 1500.0}, "Rice noodles": {"g": 100.0}}
+
+
+def test_build_grocery_list():
+    days = [Day(1, meals=[Meal("Lunch", "Pad Thai", "100g rice noodles with bean sprouts."),
+                          Meal("Dinner", "Stir Fry", "Tofu with bean sprouts and brown rice.")]),
+            Day(2, meals=[Meal("Lunch", "Pad Thai", "150g rice noodles with tofu.")])]
+
+    grocery = build_grocery_list(days)
+
+    assert [(category.name, category.items) for category in grocery] == [
+        ("PRODUCE", ["Bean sprouts (2 meals)"]),
+        ("PROTEINS", ["Tofu (2 meals)"]),
+        ("PANTRY", ["Brown rice (1 meal)", "Rice noodles (250g)"]),
+    ]
+
+
+def test_unknown_phrases_are_classified():
+    days = [Day(1, meals=[Meal("Lunch", "Bowl", "Farro with pickled jackfruit.")])]
+
+    def classify(phrases):
+        assert sorted(phrases) == ["farro", "pickled jackfruit"]
+        return [GroceryCategory("pantry", ["Farro"]), GroceryCategory("Freezer", ["Jackfruit"])]
+
+    assert grocery_list_text(build_grocery_list(days, classify)) == "PANTRY:\n- Farro (1 meal)"
+
+
+def test_update_grocery_list():
+    grocery = [GroceryCategory("PRODUCE", ["Bean sprouts (1 meal)"]),
+               GroceryCategory("PANTRY", ["Rice noodles (2 meals)"])]
+
+    added, removed = update_grocery_list(grocery, "Rice noodles with bean sprouts.", "Salmon with 200g brown rice.")
+
+    assert (added, removed) == (["Brown rice", "Salmon"], ["Bean sprouts", "Rice noodles"])
+    assert [(category.name, category.items) for category in grocery] == [
+        ("PROTEINS", ["Salmon (1 meal)"]),
+        ("PANTRY", ["Rice noodles (1 meal)", "Brown rice (200g)"]),
+    ]
@@ -0,0 +1,110 @@
+import sqlite3
+import time
+
+import pytest
+
+from api.jobs import JobQueue, QueueFullError
+
+
+def make_queue(tmp_path, handler, **kwargs):
+    kwargs.setdefault("workers", 1)
+    kwargs.setdefault("retry_delay", 0)
+    kwargs.setdefault("poll_interval", 0.05)
+    return JobQueue(str(tmp_path / "jobs.sqlite3"), handler, **kwargs)
+
+
+def wait_for_status(queue, job_id, status):
+    deadline = time.monotonic() + 5
+    while queue.get(job_id)["status"] != status:
+        assert time.monotonic() < deadline, queue.get(job_id)
+        time.sleep(0.01)
+    return queue.get(job_id)
+
+
+def stored_payload(queue, job_id):
+    with sqlite3.connect(queue.db_path) as conn:
+        return conn.execute("SELECT payload FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+
+
+def test_job_runs_and_reports_progress(tmp_path):
+    def handler(payload, report):
+        report({"completed": ["daily_targets"], "total": payload["total"]})
+
+    queue = make_queue(tmp_path, handler)
+    job = wait_for_status(queue, queue.enqueue({"total": 5}), "succeeded")
+
+    assert (job["progress"], job["error"], job["attempts"]) == ({"completed": ["daily_targets"], "total": 5}, None, 1)
+    assert stored_payload(queue, job["id"]) is None
+
+
+def test_failed_jobs_are_retried(tmp_path):
+    attempts = []
+
+    def handler(payload, report):
+        attempts.append(payload)
+        if len(attempts) < 3:
+            raise RuntimeError("Error: Service busy, please try again shortly")
+
+    queue = make_queue(tmp_path, handler, max_attempts=3)
+    job = wait_for_status(queue, queue.enqueue({"email": "a@example.com"}), "succeeded")
+
+    assert attempts == [{"email": "a@example.com"}] * 3
+    assert job["attempts"] == 3
+
+
+def test_jobs_fail_after_max_attempts(tmp_path):
+    attempts = []
+
+    def handler(payload, report):
+        attempts.append(1)
+        raise RuntimeError("Could not replace meals that break the profile's allergies")
+
+    queue = make_queue(tmp_path, handler, max_attempts=2)
+    job = wait_for_status(queue, queue.enqueue({}), "failed")
+    time.sleep(0.1)
+
+    assert len(attempts) == 2
+    assert job["error"] == "Could not replace meals that break the profile's allergies" and job["attempts"] == 2
+    assert stored_payload(queue, job["id"]) is None
+
+
+def test_retries_wait_for_the_retry_delay(tmp_path):
+    def handler(payload, report):
+        raise RuntimeError("boom")
+
+    queue = make_queue(tmp_path, handler, retry_delay=60)
+    job_id = queue.enqueue({"email": "a@example.com"})
+    deadline = time.monotonic() + 5
+    while queue.get(job_id)["error"] is None:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    time.sleep(0.2)
+
+    job = queue.get(job_id)
+    assert (job["status"], job["error"], job["attempts"]) == ("queued", "boom", 1)
+    assert stored_payload(queue, job_id) is not None
+
+
+def test_expired_leases_are_reclaimed_until_max_attempts(tmp_path):
+    # No workers, so the test drives the claims; a zero lease expires at once, like a killed worker's
+    queue = make_queue(tmp_path, lambda payload, report: None, workers=0, lease_seconds=0, max_attempts=2)
+    job_id = queue.enqueue({"n": 1})
+
+    assert queue._claim() == (job_id, {"n": 1}, 1)
+    time.sleep(0.01)
+    assert queue._claim() == (job_id, {"n": 1}, 2)
+    time.sleep(0.01)
+    assert queue._claim() is None
+    assert queue.get(job_id)["status"] == "failed"
+    assert queue.get(job_id)["error"] == "Job abandoned too many times"
+
+
+def test_full_queue_rejects_jobs(tmp_path):
+    queue = make_queue(tmp_path, lambda payload, report: None, workers=0, max_queued=1)
+    queue.enqueue({})
+    with pytest.raises(QueueFullError):
+        queue.enqueue({})
+
+
+def test_unknown_job(tmp_path):
+    assert make_queue(tmp_path, lambda payload, report: None, workers=0).get("missing") is None
@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from api.macros import day_targets, plan_arrays, rebalance_days, score_plans, verify_plan
+from api.plan_model import DailyTargets, Day, Meal
+
+from tests.samples import make_day, make_plan
+
+# The sample day's totals: 106g protein, 150g carbs, 61g fats, 1573 kcal
+ON_TARGET = DailyTargets("1573", "27% (106g)", "38% (150g)", "35% (61g)")
+
+
+def test_plan_arrays_marks_missing_meals(plan):
+    plan.days[1].meals.remove(plan.days[1].meal("Lunch"))
+    meals, targets = plan_arrays([plan], day_count=2)
+
+    assert meals.shape == (1, 2, 4, 3)
+    assert meals[0, 0, 1].tolist() == [45, 20, 15]
+    assert np.isnan(meals[0, 1, 1]).all()
+    assert targets[0].tolist() == [1900, 140, 190, 63]
+
+
+def test_days_on_target_are_within(plan):
+    plan.targets = ON_TARGET
+    report = verify_plan(plan)
+
+    assert [day["within"] for day in report["days"]] == [True, True]
+    assert report["days"][0]["totals"] == {"calories": 1573, "protein": 106, "carbs": 150, "fats": 61}
+    assert report["off_target"] == [] and report["score"] == 1.0
+
+
+def test_days_off_target(plan):
+    report = verify_plan(plan, tolerance=0.15)
+
+    assert report["off_target"] == [1, 2]
+    assert report["days"][0]["deviation"]["protein"] == pytest.approx((106 - 140) / 140, abs=1e-3)
+    assert report["days"][0]["error"] == pytest.approx(34 / 140, abs=1e-3)
+
+
+def test_incomplete_days_are_never_within(plan):
+    plan.targets = ON_TARGET
+    plan.days[0].meals.pop()
+    report = verify_plan(plan)
+
+    assert report["days"][0]["complete"] is False
+    assert report["days"][0]["error"] is None
+    assert report["off_target"] == [1]
+
+
+def test_score_plans_scores_each_plan():
+    good, bad = make_plan(), make_plan()
+    good.targets = ON_TARGET
+    result = score_plans([good, bad], day_count=2)
+
+    assert result["score"].tolist() == [1.0, 0.0]
+
+
+def test_day_targets(plan):
+    assert day_targets(plan) == {"protein": 140, "carbs": 190, "fats": 63, "calories": 1900}
+    plan.targets = None
+    assert day_targets(plan) is None
+
+
+def bigger_day(number, targets):
+    day = make_day(number)
+    for meal in day.meals:
+        meal.protein, meal.carbs, meal.fats = targets["protein"] / 4, targets["carbs"] / 4, targets["fats"] / 4
+    return day
+
+
+def test_rebalance_replaces_the_worst_days_that_improve(plan):
+    plan.days[1].meal("Dinner").protein = 5
+    calls = []
+
+    def generate_day(number, targets):
+        calls.append(number)
+        return bigger_day(number, targets)
+
+    report, replaced = rebalance_days(plan, generate_day, max_days=1)
+
+    assert report["off_target"] == [1, 2]
+    assert calls == [2] and replaced == [2]
+    assert verify_plan(plan)["days"][1]["within"]
+
+
+def test_rebalance_keeps_days_that_would_get_worse(plan):
+    def generate_day(number, targets):
+        day = make_day(number)
+        day.meal("Lunch").protein = 0
+        return day
+
+    _, replaced = rebalance_days(plan, generate_day)
+
+    assert replaced == []
+    assert plan.days[0].meal("Lunch").protein == 45
+
+
+def test_rebalance_ignores_incomplete_replacements(plan):
+    def generate_day(number, targets):
+        return Day(number, meals=[Meal("Lunch", "Lentil Soup", "Red lentils with carrots.", 20, 40, 5)])
+
+    assert rebalance_days(plan, generate_day)[1] == []
+
+
+def test_rebalance_without_off_target_days_makes_no_calls(plan):
+    plan.targets = ON_TARGET
+
+    def generate_day(number, targets):
+        raise AssertionError("no day should be regenerated")
+
+    assert rebalance_days(plan, generate_day)[1] == []
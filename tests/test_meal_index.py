@@ -0,0 +1,121 @@
+from api.compliance import Restrictions, profile_restrictions
+from api.meal_index import MealIndex, assemble_days, gap_budgets
+from api.meal_library import MealLibrary, cooking_level, meal_categories, meal_key
+from api.plan_model import MEAL_SLOTS, Day, Meal
+
+from tests.samples import make_plan
+
+NONE = Restrictions()
+TARGETS = {"protein": 120, "carbs": 200, "fats": 60}
+
+
+def build_index(rows):
+    """rows: (meal, cooking level)"""
+    meals = [meal for meal, _ in rows]
+    return MealIndex(meals, [level for _, level in rows], [meal_categories(meal) for meal in meals])
+
+
+def library_rows(per_slot=6):
+    rows = []
+    shares = {"Breakfast": 0.25, "Lunch": 0.3, "Dinner": 0.3, "Snacks": 0.15}
+    for slot in MEAL_SLOTS:
+        for i in range(per_slot):
+            scale = shares[slot] * (0.9 + 0.04 * i)
+            rows.append((Meal(slot, f"{slot} bowl {i}", "Rice with vegetables and beans.",
+                              TARGETS["protein"] * scale, TARGETS["carbs"] * scale, TARGETS["fats"] * scale), 0))
+    return rows
+
+
+def test_candidates_filter_slot_cooking_and_restrictions():
+    index = build_index([
+        (Meal("Lunch", "Chicken Wrap", "Chicken in a tortilla.", 30, 40, 10), 0),
+        (Meal("Lunch", "Lentil Soup", "Lentils and carrots.", 20, 40, 5), 0),
+        (Meal("Lunch", "Slow Roast", "Vegetables roasted for hours.", 10, 30, 10), 2),
+        (Meal("Dinner", "Tofu Stir Fry", "Tofu and rice.", 25, 50, 12), 0),
+    ])
+
+    assert index.candidates("Lunch", NONE, level=2).tolist() == [0, 1, 2]
+    assert index.candidates("Lunch", NONE, level=0).tolist() == [0, 1]
+    assert index.candidates("Lunch", Restrictions({"MEAT", "GLUTEN"}), level=2).tolist() == [1, 2]
+    assert index.slot_counts() == {"Breakfast": 0, "Lunch": 3, "Dinner": 1, "Snacks": 0}
+
+
+def test_nearest_ranks_by_relative_macro_distance():
+    index = build_index([
+        (Meal("Lunch", "Small", "Rice.", 10, 20, 5), 0),
+        (Meal("Lunch", "Medium", "Rice.", 30, 60, 15), 0),
+        (Meal("Lunch", "Large", "Rice.", 60, 120, 30), 0),
+    ])
+    found = index.nearest(index.candidates("Lunch", NONE, 2), [32, 58, 16], NONE, count=2)
+
+    assert [position for position, _ in found] == [1, 0]
+    assert found[0][1] < found[1][1]
+
+
+def test_nearest_checks_free_text_allergies():
+    index = build_index([
+        (Meal("Snacks", "Kiwi Cup", "Sliced kiwi.", 2, 20, 1), 0),
+        (Meal("Snacks", "Apple Slices", "A sliced apple.", 1, 25, 0), 0),
+    ])
+    restrictions = profile_restrictions({"allergies": "kiwi"})
+
+    found = index.nearest(index.candidates("Snacks", restrictions, 2), [2, 20, 1], restrictions)
+
+    assert [position for position, _ in found] == [1]
+
+
+def test_assemble_days_fills_every_slot_without_repeats():
+    index = build_index(library_rows())
+    days, gaps = assemble_days(index, TARGETS, NONE, level=2, day_count=3, tolerance=0.5, seed=1)
+
+    assert gaps == []
+    names = [meal.name for day in days for meal in day.meals]
+    assert len(names) == 12 and len(set(names)) == 12
+    assert all([meal.slot for meal in day.meals] == list(MEAL_SLOTS) for day in days)
+
+
+def test_assemble_days_is_seeded():
+    index = build_index(library_rows())
+    first, _ = assemble_days(index, TARGETS, NONE, level=2, day_count=2, seed=7)
+    again, _ = assemble_days(index, TARGETS, NONE, level=2, day_count=2, seed=7)
+    assert [day.to_dict() for day in first] == [day.to_dict() for day in again]
+
+
+def test_assemble_days_leaves_gaps():
+    rows = [row for row in library_rows(per_slot=2) if row[0].slot != "Snacks"]
+    days, gaps = assemble_days(build_index(rows), TARGETS, NONE, level=2, day_count=3, tolerance=1.0, fresh=1, seed=3)
+
+    # Two meals per slot for three days, no snacks at all, and one slot left for the model
+    assert sum(1 for gap in gaps if gap[1] == "Snacks") == 3
+    assert len(gaps) == 3 + 3 + 1
+    assert gaps == sorted(gaps, key=lambda gap: (gap[0], MEAL_SLOTS.index(gap[1])))
+    assert sum(len(day.meals) for day in days) == 12 - len(gaps)
+
+
+def test_gap_budgets_split_what_the_day_leaves():
+    day = Day(1, meals=[Meal("Breakfast", "Oats", "Oats.", 30, 50, 15), Meal("Lunch", "Salad", "Salad.", 30, 50, 15)])
+    budgets = gap_budgets(day, TARGETS)
+
+    assert set(budgets) == {"Dinner", "Snacks"}
+    # 60g protein left, split 0.3 : 0.15
+    assert budgets["Dinner"]["protein"] == 40 and budgets["Snacks"]["protein"] == 20
+
+
+def test_meal_keys_and_cooking_levels():
+    assert meal_key(Meal("Lunch", "Grilled  Chicken-Salad!")) == "Lunch:grilled chicken salad"
+    assert [cooking_level(answer) for answer in ("minimal", "Moderate", "flexible", None)] == [0, 1, 2, 2]
+
+
+def test_library_round_trip(tmp_path):
+    library = MealLibrary(str(tmp_path / "meals.sqlite3"), refresh_interval=0)
+    plan = make_plan()
+
+    assert library.add_plan(plan, {"cooking_time": "flexible"}) == 4
+    # The same meals from a profile with less time only lower their cooking level
+    assert library.add_plan(plan, {"cooking_time": "minimal"}) == 4
+    assert library.add_plan(plan, {"cooking_time": "flexible"}) == 0
+
+    index = library.index()
+    assert len(index) == 4
+    assert len(index.candidates("Snacks", NONE, level=0)) == 1
+    assert len(index.candidates("Snacks", Restrictions({"NUTS"}), level=2)) == 0
@@ -0,0 +1,148 @@
+import asyncio
+import contextvars
+import threading
+import time
+
+import pytest
+
+from api.pipeline import Stage, StageError, arun_stages, run_stages, stage_cancelled, stage_time_left
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+def test_stages_get_their_dependencies_results():
+    finished = []
+    results = run_stages([
+        Stage("targets", lambda: 2000),
+        Stage("plan", lambda: "plan"),
+        Stage("grocery", lambda targets, plan: f"{plan} for {targets}", deps=("targets", "plan")),
+    ], on_complete=finished.append)
+
+    assert results == {"targets": 2000, "plan": "plan", "grocery": "plan for 2000"}
+    assert finished[-1] == "grocery" and sorted(finished) == ["grocery", "plan", "targets"]
+
+
+def test_independent_stages_run_concurrently():
+    barrier = threading.Barrier(2, timeout=2)
+    # Each stage waits for the other, so this only finishes if both run at once
+    results = run_stages([Stage("a", barrier.wait), Stage("b", barrier.wait)])
+    assert sorted(results.values()) == [0, 1]
+
+
+def test_stages_see_the_callers_context():
+    request_id.set("r1")
+    assert run_stages([Stage("a", request_id.get)]) == {"a": "r1"}
+
+
+def test_unknown_dependency():
+    with pytest.raises(ValueError, match="unknown stages: missing"):
+        run_stages([Stage("a", lambda missing: missing, deps=("missing",))])
+
+
+def test_failure_skips_dependents():
+    started = []
+
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(StageError) as error:
+        run_stages([Stage("targets", fail), Stage("plan", lambda targets: started.append(targets), deps=("targets",))])
+
+    assert error.value.stage == "targets"
+    assert error.value.message == "Stage targets failed: boom"
+    assert started == []
+
+
+def test_stage_errors_keep_their_stage():
+    def fail():
+        raise StageError("meal_plan", "Error: Empty response")
+
+    with pytest.raises(StageError) as error:
+        run_stages([Stage("plan", fail)])
+    assert (error.value.stage, error.value.message) == ("meal_plan", "Error: Empty response")
+
+
+def test_timeout():
+    release = threading.Event()
+    start = time.monotonic()
+    with pytest.raises(StageError, match="Stage slow timed out after 0.1s"):
+        run_stages([Stage("slow", lambda: release.wait(2), timeout=0.1)])
+    release.set()
+    assert time.monotonic() - start < 1
+
+
+def test_running_stages_see_the_pipeline_abort():
+    stopped = threading.Event()
+
+    def slow():
+        deadline = time.monotonic() + 2
+        while not stage_cancelled() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        if stage_cancelled():
+            stopped.set()
+
+    def fail():
+        time.sleep(0.05)
+        raise RuntimeError("boom")
+
+    with pytest.raises(StageError, match="boom"):
+        run_stages([Stage("slow", slow), Stage("fail", fail)])
+    assert stopped.wait(1)
+
+
+def test_running_stages_see_their_timeout():
+    seen = {}
+
+    def slow():
+        seen["left"] = stage_time_left(100)
+        seen["unbounded"] = stage_time_left()
+        while not stage_cancelled():
+            time.sleep(0.01)
+        seen["stopped"] = True
+
+    with pytest.raises(StageError, match="timed out"):
+        run_stages([Stage("slow", slow, timeout=0.2)])
+    time.sleep(0.1)
+
+    assert 0 < seen["left"] <= 0.2
+    assert 0 < seen["unbounded"] <= 0.2
+    assert seen["stopped"]
+
+
+def test_outside_a_stage():
+    assert not stage_cancelled()
+    assert stage_time_left(5) == 5 and stage_time_left() is None
+
+
+def test_async_stages():
+    async def value(result, delay=0.0):
+        await asyncio.sleep(delay)
+        return result
+
+    async def combine(a, b):
+        return a + b
+
+    results = asyncio.run(arun_stages([
+        Stage("a", lambda: value(1, 0.01)), Stage("b", lambda: value(2)),
+        Stage("sum", combine, deps=("a", "b")),
+    ]))
+    assert results == {"a": 1, "b": 2, "sum": 3}
+
+
+def test_async_timeout_cancels_the_other_stages():
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(2)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def run():
+        with pytest.raises(StageError, match="Stage fast timed out after 0.05s"):
+            await arun_stages([Stage("slow", slow), Stage("fast", lambda: asyncio.sleep(1), timeout=0.05)])
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert cancelled == [True]
@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from api.plan_model import MEAL_SLOTS
+from api.plan_schema import SchemaError, extract_document, parse_plan_document
+
+from bench.synthetic import plan_document
+
+
+def document(days=7, seed=0):
+    return json.loads(plan_document(days, seed))
+
+
+def parse(value, day_count=7):
+    return parse_plan_document(json.dumps(value), day_count)
+
+
+def assert_rejected(value, message, day_count=7):
+    with pytest.raises(SchemaError) as error:
+        parse(value, day_count)
+    assert str(error.value) == message
+
+
+def test_parses_a_valid_document():
+    plan = parse_plan_document(plan_document(7, seed=2))
+
+    assert [day.number for day in plan.days] == list(range(1, 8))
+    assert all([meal.slot for meal in day.meals] == list(MEAL_SLOTS) for day in plan.days)
+    assert all(meal.has_macros for day in plan.days for meal in day.meals)
+    assert plan.targets.calories == "1800-2000" and plan.targets.protein == "30%"
+    assert [category.name for category in plan.grocery] == ["PRODUCE", "PROTEINS", "PANTRY"]
+    assert len(plan.tips) == 5
+
+
+def test_accepts_a_code_fenced_document():
+    plan = parse_plan_document(f"Here is your plan:\n```json\n{plan_document(3)}\n```", day_count=3)
+    assert len(plan.days) == 3
+
+
+def test_orders_days_and_meals():
+    value = document(3)
+    value["days"].reverse()
+    value["days"][0]["meals"].reverse()
+    plan = parse(value, 3)
+
+    assert [day.number for day in plan.days] == [1, 2, 3]
+    assert [meal.slot for meal in plan.days[2].meals] == list(MEAL_SLOTS)
+
+
+def test_rejects_a_missing_day():
+    value = document()
+    del value["days"][3]
+    assert_rejected(value, "days: missing day 4")
+
+
+def test_rejects_a_missing_meal():
+    value = document()
+    del value["days"][2]["meals"][1]
+    assert_rejected(value, "days[2].meals: missing Lunch")
+
+
+def test_rejects_missing_or_boolean_grams():
+    value = document()
+    del value["days"][0]["meals"][0]["fats"]
+    assert_rejected(value, "days[0].meals[0].fats: expected a number of grams")
+
+    value = document()
+    value["days"][0]["meals"][0]["protein"] = True
+    assert_rejected(value, "days[0].meals[0].protein: expected a number of grams")
+
+
+def test_rejects_a_repeated_day():
+    value = document()
+    value["days"][1]["day"] = 1
+    assert_rejected(value, "days[1].day: day 1 appears twice")
+
+
+def test_rejects_a_day_out_of_range():
+    value = document(3)
+    value["days"][2]["day"] = 9
+    assert_rejected(value, "days[2].day: expected a day from 1 to 3", day_count=3)
+
+
+def test_rejects_bad_tips():
+    value = document()
+    value["tips"] = "Cook in batches."
+    assert_rejected(value, "tips: expected a list")
+
+
+def test_formats_numeric_targets():
+    value = document(1)
+    value["targets"] = {"calories": 1900, "protein": 30, "carbs": 40.0, "fats": 30}
+    targets = parse(value, 1).targets
+
+    assert (targets.calories, targets.protein, targets.carbs) == ("1900", "30%", "40%")
+
+
+def test_needs_a_json_object():
+    with pytest.raises(SchemaError, match="no JSON object in the response"):
+        extract_document("I can't write a plan for that.")
+    with pytest.raises(SchemaError, match="invalid JSON"):
+        extract_document("{\"days\": [}")
@@ -0,0 +1,82 @@
+import sqlite3
+from contextlib import closing
+
+from api.plan_store import PlanStore
+
+PROFILE = {"goal": "health", "diet_preference": "omnivore", "allergies": "none"}
+
+
+def make_store(tmp_path, **kwargs):
+    return PlanStore(str(tmp_path / "plans.sqlite3"), **kwargs)
+
+
+def count(store, table):
+    with closing(sqlite3.connect(store.db_path)) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_save_and_get_round_trip(tmp_path, plan):
+    store = make_store(tmp_path)
+    assert store.save("p1", plan, PROFILE, "a@example.com")
+
+    stored = store.get("p1")
+    assert stored.plan.to_dict() == plan.to_dict()
+    assert stored.profile == PROFILE
+    assert stored.email == "a@example.com"
+    assert stored.version
+
+
+def test_get_unknown_plan_is_none(tmp_path):
+    store = make_store(tmp_path)
+    assert store.get("missing") is None
+    assert store.stats()["misses"] == 1
+
+
+def test_identical_plans_share_one_blob(tmp_path, plan):
+    store = make_store(tmp_path)
+    store.save("p1", plan, PROFILE)
+    store.save("p2", plan, PROFILE)
+
+    assert count(store, "blobs") == 1
+    assert set(store.ids_for_profile(PROFILE)) == {"p1", "p2"}
+
+
+def test_update_rejects_a_stale_version(tmp_path, plan):
+    store = make_store(tmp_path)
+    store.save("p1", plan, PROFILE)
+    first, second = store.get("p1"), store.get("p1")
+
+    first.plan.tips.append("Freeze leftovers")
+    assert store.update(first, first.plan) is not None
+    second.plan.tips.append("Label containers")
+    assert store.update(second, second.plan) is None
+
+    assert store.get("p1").plan.tips[-1] == "Freeze leftovers"
+    assert store.stats()["conflicts"] == 1
+    # The replaced blob goes once no plan points at it
+    assert count(store, "blobs") == 1
+
+
+def test_expired_plans_are_evicted(tmp_path, plan):
+    store = make_store(tmp_path, retention_seconds=-1)
+    store.save("p1", plan, PROFILE)
+
+    assert store.get("p1") is None
+    assert store.ids_for_profile(PROFILE) == []
+    store.evict()
+    assert count(store, "plans") == 0 and count(store, "blobs") == 0
+
+
+def test_iter_plans(tmp_path, plan):
+    store = make_store(tmp_path)
+    store.save("p1", plan, PROFILE)
+    store.save("p2", plan, dict(PROFILE, goal="muscle"))
+
+    assert [stored.id for stored in store.iter_plans(batch_size=1)] == ["p1", "p2"]
+
+
+def test_disabled_store_keeps_nothing(tmp_path, plan):
+    store = make_store(tmp_path, enabled=False)
+    assert not store.save("p1", plan, PROFILE)
+    assert store.get("p1") is None
+    assert not (tmp_path / "plans.sqlite3").exists()
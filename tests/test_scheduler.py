@@ -0,0 +1,204 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from api.scheduler import (BATCH, INTERACTIVE, CallCancelled, LLMScheduler, SchedulerOverloaded, SharedRateLimiter,
+                           current_priority, priority_scope)
+
+
+def make_limiter(tmp_path, **kwargs):
+    return SharedRateLimiter(str(tmp_path / "ratelimit.sqlite3"), **kwargs)
+
+
+def make_scheduler(tmp_path, limiter=None, **kwargs):
+    kwargs.setdefault("backoff_base", 0.01)
+    kwargs.setdefault("poll_interval", 0.01)
+    return LLMScheduler(limiter or make_limiter(tmp_path), **kwargs)
+
+
+def retry_everything(error):
+    return True, None
+
+
+def test_limiter_caps_concurrency(tmp_path):
+    limiter = make_limiter(tmp_path, max_concurrency=2)
+    first, _ = limiter.try_acquire(100)
+    second, _ = limiter.try_acquire(100)
+    third, _ = limiter.try_acquire(100)
+
+    assert first and second and third is None
+    limiter.release(first)
+    assert limiter.try_acquire(100)[0] is not None
+
+
+def test_limiter_waits_for_tokens_to_refill(tmp_path):
+    limiter = make_limiter(tmp_path, tokens_per_minute=600)
+    permit, _ = limiter.try_acquire(600)
+    limiter.release(permit)
+
+    permit, wait = limiter.try_acquire(300)
+    # 300 tokens at 10 per second
+    assert permit is None and 29 < wait <= 30
+
+
+def test_limiter_refunds_unused_tokens(tmp_path):
+    limiter = make_limiter(tmp_path, tokens_per_minute=600)
+    permit, _ = limiter.try_acquire(600)
+    limiter.release(permit, refund_tokens=500)
+    assert limiter.try_acquire(400)[0] is not None
+
+
+def test_batch_calls_leave_a_reserve(tmp_path):
+    limiter = make_limiter(tmp_path, max_concurrency=4)
+    permits = [limiter.try_acquire(10, reserve=0.5)[0] for _ in range(3)]
+
+    assert permits[0] and permits[1] and permits[2] is None
+    assert limiter.try_acquire(10)[0] is not None
+
+
+def test_block_holds_everyone_back(tmp_path):
+    limiter = make_limiter(tmp_path)
+    limiter.block(5)
+    permit, wait = limiter.try_acquire(10)
+    assert permit is None and 4 < wait <= 5
+
+
+def test_call_retries_retryable_errors(tmp_path):
+    scheduler = make_scheduler(tmp_path)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError("reset")
+        return "ok"
+
+    assert scheduler.call(flaky, 100, retry_policy=retry_everything) == "ok"
+    assert len(attempts) == 3
+    assert scheduler.stats()["retries"] == 2 and scheduler.stats()["admitted"] == 3
+
+
+def test_call_gives_up(tmp_path):
+    scheduler = make_scheduler(tmp_path, max_retries=2)
+    attempts = []
+
+    def broken():
+        attempts.append(1)
+        raise ConnectionError("reset")
+
+    with pytest.raises(ConnectionError):
+        scheduler.call(broken, 100, retry_policy=retry_everything)
+    assert len(attempts) == 3
+
+    attempts.clear()
+    with pytest.raises(ConnectionError):
+        scheduler.call(broken, 100, retry_policy=lambda error: (False, None))
+    assert len(attempts) == 1
+
+
+def test_rate_limited_calls_pause_every_worker(tmp_path):
+    limiter = make_limiter(tmp_path)
+    scheduler = make_scheduler(tmp_path, limiter)
+
+    def limited():
+        raise ConnectionError("429")
+
+    with pytest.raises(ConnectionError):
+        scheduler.call(limited, 100, retry_policy=lambda error: (False, 30))
+    assert scheduler.stats()["rate_limited"] == 1
+    assert limiter.try_acquire(10)[0] is None
+
+
+def test_full_queue_sheds(tmp_path):
+    scheduler = make_scheduler(tmp_path, max_queue=0)
+    with pytest.raises(SchedulerOverloaded):
+        scheduler.call(lambda: "ok", 100)
+    assert scheduler.overloaded()
+    assert scheduler.stats()["shed"] == 1
+
+
+def test_waiting_past_the_deadline_sheds(tmp_path):
+    scheduler = make_scheduler(tmp_path, make_limiter(tmp_path, max_concurrency=1))
+    with scheduler.permit(10):
+        with pytest.raises(SchedulerOverloaded):
+            scheduler.call(lambda: "ok", 10, timeout=0.1)
+
+
+def test_interactive_calls_go_first(tmp_path):
+    scheduler = make_scheduler(tmp_path, make_limiter(tmp_path, max_concurrency=1))
+    order = []
+
+    def caller(name, priority):
+        scheduler.call(lambda: order.append(name), 10, priority=priority)
+
+    # The first caller holds the head of the queue, so the other two are ordered by priority alone
+    threads = []
+    with scheduler.permit(10):
+        for name, priority in [("first", INTERACTIVE), ("batch", BATCH), ("interactive", INTERACTIVE)]:
+            threads.append(threading.Thread(target=caller, args=(name, priority)))
+            threads[-1].start()
+            while scheduler.queue_depth() < len(threads):
+                time.sleep(0.01)
+    for thread in threads:
+        thread.join(2)
+
+    assert order == ["first", "interactive", "batch"]
+
+
+def test_priority_scope():
+    assert current_priority() == INTERACTIVE
+    with priority_scope(BATCH):
+        assert current_priority() == BATCH
+    assert current_priority() == INTERACTIVE
+
+
+def test_cancelled_calls_stop_backing_off(tmp_path):
+    scheduler = make_scheduler(tmp_path, backoff_base=5, backoff_max=5)
+    cancelled = threading.Event()
+    threading.Timer(0.1, cancelled.set).start()
+    attempts = []
+
+    def broken():
+        attempts.append(1)
+        raise ConnectionError("reset")
+
+    start = time.monotonic()
+    with pytest.raises(CallCancelled):
+        scheduler.call(broken, 100, retry_policy=retry_everything, cancelled=cancelled.is_set)
+    # The first backoff can be as short as the poll interval, so a second attempt may start
+    assert time.monotonic() - start < 1 and len(attempts) <= 2
+
+
+def test_cancelled_calls_leave_the_queue(tmp_path):
+    scheduler = make_scheduler(tmp_path, make_limiter(tmp_path, max_concurrency=1))
+    cancelled = threading.Event()
+
+    with scheduler.permit(10):
+        threading.Timer(0.1, cancelled.set).start()
+        with pytest.raises(CallCancelled):
+            scheduler.call(lambda: "ok", 10, cancelled=cancelled.is_set)
+    assert scheduler.queue_depth() == 0
+    with pytest.raises(CallCancelled):
+        scheduler.call(lambda: "ok", 10, cancelled=lambda: True)
+
+
+def test_async_call(tmp_path):
+    scheduler = make_scheduler(tmp_path)
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 2:
+            raise ConnectionError("reset")
+        return "ok"
+
+    assert asyncio.run(scheduler.acall(flaky, 100, retry_policy=retry_everything)) == "ok"
+    assert len(attempts) == 2
+
+
+def test_disabled_scheduler_calls_directly(tmp_path):
+    scheduler = make_scheduler(tmp_path, max_queue=0, enabled=False)
+    assert scheduler.call(lambda: "ok", 100) == "ok"
+    assert not scheduler.overloaded()
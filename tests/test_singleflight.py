@@ -0,0 +1,202 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from api.singleflight import FlightError, SingleFlight
+
+
+class Cancelled(Exception):
+    pass
+
+
+def make_flight(tmp_path, **kwargs):
+    kwargs.setdefault("poll_interval", 0.01)
+    kwargs.setdefault("is_cancellation", lambda error: isinstance(error, Cancelled))
+    return SingleFlight(str(tmp_path / "flights.sqlite3"), **kwargs)
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 2
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def call_in_thread(flight, key, func, outcomes):
+    """Run ``flight.do`` in a thread, appending its return value or exception to ``outcomes``"""
+    def call():
+        try:
+            outcomes.append(flight.do(key, func))
+        except Exception as e:
+            outcomes.append(e)
+
+    thread = threading.Thread(target=call)
+    thread.start()
+    return thread
+
+
+def blocking(calls, name, release, result=None, error=None):
+    def func():
+        calls.append(name)
+        release.wait(2)
+        if error is not None:
+            raise error
+        return result
+    return func
+
+
+def test_identical_calls_share_one_run(tmp_path):
+    flight = make_flight(tmp_path)
+    release = threading.Event()
+    calls, outcomes = [], []
+
+    threads = [call_in_thread(flight, "k", blocking(calls, "leader", release, result="plan"), outcomes)]
+    wait_for(lambda: calls)
+    threads += [call_in_thread(flight, "k", blocking(calls, "follower", release), outcomes) for _ in range(3)]
+    wait_for(lambda: flight.stats()["thread"] == 3)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+
+    assert calls == ["leader"]
+    assert sorted(outcomes, key=str) == [("plan", "thread")] * 3 + [("plan", None)]
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_failures_are_shared(tmp_path):
+    flight = make_flight(tmp_path)
+    release = threading.Event()
+    calls, outcomes = [], []
+
+    leader = call_in_thread(flight, "k", blocking(calls, "leader", release, error=ValueError("boom")), outcomes)
+    wait_for(lambda: calls)
+    follower = call_in_thread(flight, "k", blocking(calls, "follower", release), outcomes)
+    wait_for(lambda: flight.stats()["thread"] == 1)
+    release.set()
+    leader.join(2)
+    follower.join(2)
+
+    assert calls == ["leader"]
+    assert [str(outcome) for outcome in outcomes] == ["boom", "boom"]
+
+
+def test_a_follower_takes_over_from_a_cancelled_leader(tmp_path):
+    flight = make_flight(tmp_path)
+    release = threading.Event()
+    calls, led, followed = [], [], []
+
+    leader = call_in_thread(flight, "k", blocking(calls, "leader", release, error=Cancelled()), led)
+    wait_for(lambda: calls)
+    follower = call_in_thread(flight, "k", blocking(calls, "follower", release, result="plan"), followed)
+    wait_for(lambda: flight.stats()["thread"] == 1)
+    release.set()
+    leader.join(2)
+    follower.join(2)
+
+    assert calls == ["leader", "follower"]
+    assert isinstance(led[0], Cancelled)
+    assert followed == [("plan", None)]
+
+
+def test_other_processes_get_the_result(tmp_path):
+    # A second instance on the same file stands in for another worker process
+    flight, other = make_flight(tmp_path), make_flight(tmp_path)
+    release = threading.Event()
+    calls, outcomes = [], []
+
+    leader = call_in_thread(flight, "k", blocking(calls, "leader", release, result={"days": 7}), outcomes)
+    wait_for(lambda: calls)
+    threading.Timer(0.05, release.set).start()
+    assert other.do("k", lambda: calls.append("other")) == ({"days": 7}, "process")
+    leader.join(2)
+    assert calls == ["leader"]
+
+
+def test_other_processes_get_the_failure(tmp_path):
+    flight, other = make_flight(tmp_path), make_flight(tmp_path)
+    release = threading.Event()
+    calls, outcomes = [], []
+
+    leader = call_in_thread(flight, "k", blocking(calls, "leader", release, error=ValueError("boom")), outcomes)
+    wait_for(lambda: calls)
+    threading.Timer(0.05, release.set).start()
+    with pytest.raises(FlightError, match="boom"):
+        other.do("k", lambda: calls.append("other"))
+    leader.join(2)
+
+
+def test_other_processes_take_over_from_a_cancelled_leader(tmp_path):
+    flight, other = make_flight(tmp_path), make_flight(tmp_path)
+    release = threading.Event()
+    calls, outcomes = [], []
+
+    leader = call_in_thread(flight, "k", blocking(calls, "leader", release, error=Cancelled()), outcomes)
+    wait_for(lambda: calls)
+    threading.Timer(0.05, release.set).start()
+    assert other.do("k", lambda: calls.append("other") or "plan") == ("plan", None)
+    leader.join(2)
+    assert calls == ["leader", "other"]
+
+
+def test_waiting_times_out(tmp_path):
+    flight, other = make_flight(tmp_path), make_flight(tmp_path)
+    release = threading.Event()
+    calls, outcomes = [], []
+
+    leader = call_in_thread(flight, "k", blocking(calls, "leader", release, result="plan"), outcomes)
+    wait_for(lambda: calls)
+    with pytest.raises(FlightError, match="Timed out"):
+        flight.do("k", lambda: "plan", timeout=0.05)
+    with pytest.raises(FlightError, match="Timed out"):
+        other.do("k", lambda: "plan", timeout=0.05)
+    release.set()
+    leader.join(2)
+
+
+def test_async_calls_share_one_run(tmp_path):
+    flight = make_flight(tmp_path)
+    calls = []
+
+    async def generate():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "plan"
+
+    async def run():
+        return await asyncio.gather(*(flight.ado("k", generate) for _ in range(3)))
+
+    assert asyncio.run(run()) == [("plan", None), ("plan", "thread"), ("plan", "thread")]
+    assert calls == [1]
+
+
+def test_async_follower_takes_over_from_a_cancelled_leader(tmp_path):
+    flight = make_flight(tmp_path)
+    calls = []
+
+    async def generate(name):
+        calls.append(name)
+        await asyncio.sleep(0.05)
+        return name
+
+    async def run():
+        leader = asyncio.ensure_future(flight.ado("k", lambda: generate("leader")))
+        while not calls:
+            await asyncio.sleep(0.01)
+        follower = asyncio.ensure_future(flight.ado("k", lambda: generate("follower")))
+        while not flight.stats()["thread"]:
+            await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == ("follower", None)
+    assert calls == ["leader", "follower"]
+
+
+def test_disabled(tmp_path):
+    flight = make_flight(tmp_path, enabled=False)
+    assert flight.do("k", lambda: "plan") == ("plan", None)
+    assert not (tmp_path / "flights.sqlite3").exists()
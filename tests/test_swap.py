@@ -0,0 +1,68 @@
+import pytest
+
+from api.plan_model import DailyTargets, Meal
+from api.swap import macro_budget, normalize_slot, replace_meal, target_calories, target_grams
+
+
+@pytest.mark.parametrize("slot, expected", [
+    ("lunch", "Lunch"), (" Dinner ", "Dinner"), ("snack", "Snacks"), ("SNACKS", "Snacks"), ("brunch", None), (3, None),
+])
+def test_normalize_slot(slot, expected):
+    assert normalize_slot(slot) == expected
+
+
+def test_target_grams_prefers_grams():
+    targets = DailyTargets("1800-2000", "30% (140g)", "40% (190g)", "30% (63g)")
+    assert target_calories(targets) == 1900
+    assert target_grams(targets) == {"protein": 140, "carbs": 190, "fats": 63}
+
+
+def test_target_grams_from_percentages():
+    grams = target_grams(DailyTargets("2000", "30%", "40%", "30%"))
+    assert grams == pytest.approx({"protein": 150, "carbs": 200, "fats": 2000 * 0.3 / 9})
+
+
+def test_target_grams_without_usable_targets():
+    assert target_grams(None) is None
+    assert target_grams(DailyTargets()) is None
+
+
+def test_macro_budget_is_what_the_other_meals_leave(plan):
+    day = plan.days[0]
+    # Other meals: protein 15+40+6, carbs 60+45+25, fats 10+20+16
+    assert macro_budget(plan, day, "Lunch") == {"protein": 79, "carbs": 60, "fats": 17}
+
+
+def test_macro_budget_never_drops_below_a_share_of_the_target(plan):
+    day = plan.days[0]
+    day.meal("Dinner").protein = 500
+    assert macro_budget(plan, day, "Lunch")["protein"] == 14
+
+
+def test_macro_budget_falls_back_to_neighbouring_days(plan):
+    plan.targets = None
+    assert macro_budget(plan, plan.days[0], "Dinner") == {"protein": 40, "carbs": 45, "fats": 20}
+
+
+def test_replace_meal_patches_the_grocery_list(plan):
+    day = plan.days[0]
+    meal = Meal("Dinner", "Tofu Stir Fry", "Tofu with broccoli and brown rice.", 30, 50, 15)
+
+    old, added, removed = replace_meal(plan, day, meal)
+
+    assert old.name == "Baked Salmon"
+    assert day.meal("Dinner") is meal
+    assert added == ["Brown rice", "Tofu"]
+    assert removed == ["Quinoa", "Salmon"]
+    items = [item for category in plan.grocery for item in category.items]
+    # Day 2's dinner still uses quinoa and salmon
+    assert {"Tofu (1 meal)", "Brown rice (1 meal)", "Quinoa (1 meal)", "Salmon (1 meal)"} <= set(items)
+
+
+def test_replace_meal_fills_a_missing_slot_in_order(plan):
+    day = plan.days[0]
+    day.meals.remove(day.meal("Lunch"))
+
+    replace_meal(plan, day, Meal("Lunch", "Lentil Soup", "Red lentils with carrots.", 20, 40, 5))
+
+    assert [meal.slot for meal in day.meals] == ["Breakfast", "Lunch", "Dinner", "Snacks"]
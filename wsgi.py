@@ -1,4 +1,3 @@
-# DEPRECATED: Consider consolidating with app.py
 import os
 import sys
 